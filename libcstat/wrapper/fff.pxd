@@ -168,7 +168,8 @@ cdef extern from "fffpy.h":
     void fff_vector_fetch_using_NumPy(fff_vector* y, char* data, npy_intp stride, int type, int itemsize)
     fffpy_multi_iterator* fffpy_multi_iterator_new(int narr, int axis, ...) 
     void fffpy_multi_iterator_delete(fffpy_multi_iterator* thisone)
-    void fffpy_multi_iterator_update(fffpy_multi_iterator* thisone)
-    void fffpy_multi_iterator_reset(fffpy_multi_iterator* thisone)
+    void fffpy_multi_iterator_update(fffpy_multi_iterator* thisone) nogil
+    void fffpy_multi_iterator_reset(fffpy_multi_iterator* thisone) nogil
+    void fffpy_multi_iterator_goto(fffpy_multi_iterator* thisone, size_t index) nogil
 
     
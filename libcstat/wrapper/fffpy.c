@@ -615,6 +615,30 @@ void fffpy_multi_iterator_reset(fffpy_multi_iterator* thisone)
   return; 
 }
 
+void fffpy_multi_iterator_goto(fffpy_multi_iterator* thisone, size_t index)
+{
+  npy_intp coords[NPY_MAXDIMS]; 
+  PyArrayIterObject* it; 
+  size_t r; 
+  int i, j; 
+
+  /* The iterators have the same shape, except along the iterated
+     axis where they have a single position */ 
+  for(i=0; i<thisone->narr; i++) {
+    it = thisone->multi->iters[i]; 
+    r = index; 
+    for(j=it->nd_m1; j>=0; j--) {
+      coords[j] = r % (it->dims_m1[j]+1); 
+      r /= (it->dims_m1[j]+1); 
+    }
+    PyArray_ITER_GOTO(it, coords); 
+    _fff_vector_sync_with_PyArrayIter(thisone->vector[i], (const PyArrayIterObject*)it, thisone->axis); 
+  }
+  thisone->multi->index = index; 
+  thisone->index = index; 
+  return; 
+}
+
 static int _PyArray_BroadcastAllButAxis (PyArrayMultiIterObject* mit, int axis)
 {
   int i, nd;
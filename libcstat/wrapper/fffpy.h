@@ -151,3 +151,17 @@ extern fffpy_multi_iterator* fffpy_multi_iterator_new(int narr, int axis, ...);
 extern void fffpy_multi_iterator_delete(fffpy_multi_iterator* thisone); 
 extern void fffpy_multi_iterator_update(fffpy_multi_iterator* thisone); 
 extern void fffpy_multi_iterator_reset(fffpy_multi_iterator* thisone); 
+
+/*!
+  \brief Move a multi-iterator to a given position
+  \param thisone multi-iterator
+  \param index position, in the range [0, thisone->size)
+
+  Unlike \c fffpy_multi_iterator_update, this function does not need
+  to be called sequentially, so that distinct multi-iterators on the
+  same arrays may process distinct ranges of positions, e.g. in
+  parallel threads. It does not use the Python API provided that the
+  iterated arrays have double data type, and may then be called
+  without holding the GIL.
+*/
+extern void fffpy_multi_iterator_goto(fffpy_multi_iterator* thisone, size_t index); 
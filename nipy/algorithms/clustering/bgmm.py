@@ -21,7 +21,7 @@ from scipy.special import gammaln
 import math
 
 from .utils import kmeans
-from gmm import GMM
+from gmm import GMM, _finite_log
 
 ##################################################################
 # ancillary functions ############################################
@@ -882,8 +882,10 @@ class VBGMM(BGMM):
         BGMM.__init__(self, k, dim, means, precisions, weights, shrinkage, dof)
         self.scale = self.precisions.copy()
 
-    def _Estep(self, x):
-        """VB-E step
+    def log_likelihood(self, x):
+        """
+        return the expected log-likelihood of the model for the data x,
+        under the variational posterior of the parameters
 
         Parameters
         ----------
@@ -892,32 +894,22 @@ class VBGMM(BGMM):
 
         Returns
         -------
-        like: array of shape(nb_samples,self.k),
-              component-wise likelihood
+        log_like: array of shape(nb_samples,self.k),
+                  component-wise log-likelihood
         """
-        n = x.shape[0]
-        like = np.zeros((n, self.k))
         from scipy.special import psi
-
-        spsi = psi(np.sum(self.weights))
-        for k in range(self.k):
-            # compute the data-independent factor first
-            w0 = psi(self.weights[k]) - spsi
-            w0 += 0.5 * np.log(detsh(self.scale[k]))
-            w0 -= self.dim * 0.5 / self.shrinkage[k]
-            w0 += 0.5 * np.log(2) * self.dim
-            for i in range(self.dim):
-                w0 += 0.5 * psi((self.dof[k] - i) / 2)
-            m = np.reshape(self.means[k], (1, self.dim))
-            b = self.dof[k] * self.scale[k]
-            q = np.sum(np.dot(m - x, b) * (m - x), 1)
-            w = w0 - q / 2
-            w -= 0.5 * np.log(2 * np.pi) * self.dim
-            like[:, k] = np.exp(w)
-
-        if like.min() < 0:
-            raise ValueError('Likelihood cannot be negative')
-        return like
+        dof = np.asarray(self.dof, np.float)
+        log_like = self._gaussian_log_likelihood(
+            x, self.means, self.scale * np.reshape(dof, (self.k, 1, 1)))
+
+        # replace the log-determinant of the precisions by its expectation
+        w = psi(self.weights) - psi(np.sum(self.weights))
+        w -= 0.5 * np.log(dof) * self.dim
+        w -= self.dim * 0.5 / self.shrinkage
+        w += 0.5 * np.log(2) * self.dim
+        w += 0.5 * np.sum(psi((dof[:, np.newaxis] - np.arange(self.dim)) / 2),
+                          1)
+        return log_like + w
 
     def evidence(self, x, like=None, verbose=0):
         """computation of evidence bound aka free energy
@@ -939,8 +931,7 @@ class VBGMM(BGMM):
         from numpy.linalg import inv
         tiny = 1.e-15
         if like == None:
-            like = self._Estep(x)
-            like = (like.T / np.maximum(like.sum(1), tiny)).T
+            like = self._Estep(x)[0]
 
         pop = like.sum(0)[:self.k]
         pop = np.reshape(pop, (self.k, 1))
@@ -985,24 +976,18 @@ class VBGMM(BGMM):
         F -= Dkl
         return F
 
-    def _Mstep(self, x, like):
-        """VB-M step
+    def _Mstep_statistics(self, pop, sx, sxx):
+        """VB-M step, given the sufficient statistics of the data
 
         Parameters
         ----------
-        x: array of shape(nb_samples, self.dim)
-           the data from which the model is estimated
-        like: array of shape(nb_samples, self.k)
-           the likelihood of the data under each class
+        pop, sx, sxx: see self._sufficient_statistics
         """
         from numpy.linalg import inv
         tiny = 1.e-15
-        pop = like.sum(0)
 
         # shrinkage, weights,dof
         self.weights = self.prior_weights + pop
-        pop = pop[0:self.k]
-        like = like[:, :self.k]
         self.shrinkage = self.prior_shrinkage + pop
         self.dof = self.prior_dof + pop
 
@@ -1012,21 +997,19 @@ class VBGMM(BGMM):
         shrinkage = np.reshape(self.shrinkage, (self.k, 1))
 
         # means
-        means = np.dot(like.T, x) + self.prior_means * prior_shrinkage
+        means = sx + self.prior_means * prior_shrinkage
         self.means = means / shrinkage
 
         #precisions
-        empmeans = np.dot(like.T, x) / np.maximum(pop, tiny)
-        empcov = np.zeros(np.shape(self.prior_scale))
-        for k in range(self.k):
-            dx = x - empmeans[k]
-            empcov[k] = np.dot(dx.T, like[:, k:k + 1] * dx)
-            covariance = np.array(self._inv_prior_scale) + empcov
-
-        dx = np.reshape(empmeans - self.prior_means, (self.k, self.dim, 1))
-        addcov = np.array([np.dot(dx[k], dx[k].T) for k in range(self.k)])
-        apms = np.reshape(prior_shrinkage * pop / shrinkage, (self.k, 1, 1))
-        covariance += addcov * apms
+        empmeans = sx / np.maximum(pop, tiny)
+        covariance = np.array(self._inv_prior_scale) + sxx
+        covariance -= pop[:, :, np.newaxis] * \
+            empmeans[:, :, np.newaxis] * empmeans[:, np.newaxis]
+
+        dx = empmeans - self.prior_means
+        apms = prior_shrinkage * pop / shrinkage
+        covariance += apms[:, :, np.newaxis] * \
+            dx[:, :, np.newaxis] * dx[:, np.newaxis]
         # update scale
         self.scale = np.array([inv(covariance[k]) for k in range(self.k)])
 
@@ -1086,11 +1069,11 @@ class VBGMM(BGMM):
                 verbosity mode
         """
         # alternation of E/M step until convergence
-        tiny = 1.e-15
         av_ll_old = - np.inf
         for i in range(niter):
-            like = self._Estep(x)
-            av_ll = np.mean(np.log(np.maximum(np.sum(like, 1), tiny)))
+            like, log_sl = self._Estep(x)
+            log_sl = _finite_log(log_sl)
+            av_ll = np.mean(log_sl)
             if av_ll < av_ll_old + delta:
                 if verbose:
                     print 'iteration:', i, 'log-likelihood:', av_ll,\
@@ -1099,8 +1082,7 @@ class VBGMM(BGMM):
             else:
                 av_ll_old = av_ll
             if verbose:
-                print i, av_ll, self.bic(like)
-            like = (like.T / np.maximum(like.sum(1), tiny)).T
+                print i, av_ll, self._bic(log_sl.sum(), x.shape[0])
             self._Mstep(x, like)
 
     def likelihood(self, x):
@@ -1119,7 +1101,7 @@ class VBGMM(BGMM):
               component-wise likelihood
         """
         x = self.check_x(x)
-        return self._Estep(x)
+        return np.exp(self.log_likelihood(x))
 
     def pop(self, like, tiny=1.e-15):
         """
@@ -9,8 +9,42 @@ computationally and memory efficient.
 Author : Bertrand Thirion, 2006-2009
 """
 
+from copy import deepcopy
+
 import numpy as np
-from scipy.linalg import eigvalsh
+from scipy.linalg import eigh, cholesky, LinAlgError
+
+from .utils import _map_seeded, _best_fit
+
+# maximal number of elements of the temporaries in the likelihood computation
+BLOCK_SIZE = 2 ** 20
+
+# log-likelihood of the samples that are impossible under all the components
+LOG_TINY = np.log(np.finfo(np.float64).tiny)
+
+
+def _log_normalize(a):
+    """ Replaces the log-likelihoods in the rows of a by the corresponding
+    normalized probabilities, in place, and returns the log of their sums,
+    computed without under/overflow
+    """
+    amax = a.max(1)
+    amax[np.isinf(amax)] = 0
+    a -= amax[:, np.newaxis]
+    np.exp(a, a)
+    sa = a.sum(1)
+    # sa >= 1 unless the whole row is zero
+    a /= np.maximum(sa, 1)[:, np.newaxis]
+    with np.errstate(divide='ignore'):
+        return amax + np.log(sa)
+
+
+def _finite_log(log_sl):
+    """ Replaces the -inf values of log_sl by LOG_TINY, in place, and
+    returns it; the other values, however small, are left unchanged
+    """
+    log_sl[np.isneginf(log_sl)] = LOG_TINY
+    return log_sl
 
 
 class GridDescriptor(object):
@@ -98,8 +132,66 @@ class GridDescriptor(object):
         return grid
 
 
+class DataChunks(object):
+    """
+    An iterable over the (masked) voxels of a 3D or 4D data array, by slabs
+    along the first axis, e.g. to use GMM.estimate_chunks on image data
+
+    When data is memory-mapped, e.g. the data of an uncompressed image
+    file, only one slab is read in memory at once.
+    """
+
+    def __init__(self, data, mask=None, slab_size=1):
+        """
+        Parameters
+        ----------
+        data: array of shape (nx, ny, nz) or (nx, ny, nz, dim),
+              the data to iterate over
+        mask: array of shape (nx, ny, nz), optional,
+              the voxels to consider (nonzero values); by default, all
+        slab_size: int, optional,
+                   the number of slices along the first axis in each chunk
+        """
+        if data.ndim not in [3, 4]:
+            raise ValueError('data should be a 3D or 4D array')
+        if mask is not None and np.shape(mask) != data.shape[:3]:
+            raise ValueError('mask and data should have the same 3D shape')
+        if slab_size < 1:
+            raise ValueError('slab_size should be at least 1')
+        self.data = data
+        self.mask = mask
+        self.slab_size = int(slab_size)
+        self.dim = 1
+        if data.ndim == 4:
+            self.dim = data.shape[3]
+
+    def __iter__(self):
+        """ Yields the arrays of shape (n_i, self.dim) of the voxel values
+        in each slab, skipping empty slabs
+        """
+        for start in range(0, self.data.shape[0], self.slab_size):
+            end = start + self.slab_size
+            slab = np.asarray(self.data[start:end])
+            if self.mask is None:
+                chunk = np.reshape(slab, (-1, self.dim))
+            else:
+                mask = np.asarray(self.mask[start:end]) > 0
+                chunk = np.reshape(slab[mask], (-1, self.dim))
+            if chunk.shape[0] > 0:
+                yield chunk
+
+
+def _estimate_gmm(x, model, niter, delta):
+    """ Initializes and estimates a copy of model on x; returns it with the
+    resulting bic
+    """
+    model = deepcopy(model)
+    model.initialize(x)
+    return model, model.estimate(x, niter=niter, delta=delta, verbose=0)
+
+
 def best_fitting_GMM(x, krange, prec_type='full', niter=100, delta=1.e-4,
-                     ninit=1, verbose=0):
+                     ninit=1, verbose=0, n_jobs=1, seed=None):
     """
     Given a certain dataset x, find the best-fitting GMM
     with a number k of classes in a certain range defined by krange
@@ -119,6 +211,12 @@ def best_fitting_GMM(x, krange, prec_type='full', niter=100, delta=1.e-4,
     ninit: int
            number of initialization performed
     verbose=0: verbosity mode
+    n_jobs=1: int, optional,
+              number of worker processes among which the ninit * len(krange)
+              estimations are distributed
+    seed=None: int, optional,
+               seed of the random initializations; the result does not
+               depend on n_jobs
 
     Returns
     -------
@@ -128,11 +226,13 @@ def best_fitting_GMM(x, krange, prec_type='full', niter=100, delta=1.e-4,
         x = np.reshape(x, (np.size(x), 1))
 
     dim = x.shape[1]
+    krange = list(krange)
+    fits = _map_seeded(_estimate_gmm, x,
+                       [(GMM(k, dim, prec_type), niter, delta)
+                        for k in krange for i in range(ninit)], n_jobs, seed)
     bestbic = - np.inf
-    for k in krange:
-        lgmm = GMM(k, dim, prec_type)
-        gmmk = lgmm.initialize_and_estimate(x, None, niter, delta, ninit,
-                                            verbose)
+    for q, k in enumerate(krange):
+        gmmk = _best_fit(fits[q * ninit: (q + 1) * ninit])
         bic = gmmk.evidence(x)
         if bic > bestbic:
             bestbic = bic
@@ -288,6 +388,8 @@ class GMM(object):
         if self.weights == None:
             self.weights = np.ones(self.k) * 1.0 / self.k
 
+        self._factors = None
+
     def plugin(self, means, precisions, weights):
         """
         Set manually the weights, means and precision of the model
@@ -429,26 +531,12 @@ class GMM(object):
         -------
         like, array of shape(n_samples,self.k)
           unweighted component-wise likelihood
-        """
-        n = x.shape[0]
-        like = np.zeros((n, self.k))
 
-        for k in range(self.k):
-            # compute the data-independent factor first
-            w = - np.log(2 * np.pi) * self.dim
-            m = np.reshape(self.means[k], (1, self.dim))
-            b = self.precisions[k]
-            if self.prec_type == 'full':
-                w += np.log(eigvalsh(b)).sum()
-                dx = m - x
-                q = np.sum(np.dot(dx, b) * dx, 1)
-            else:
-                w += np.sum(np.log(b))
-                q = np.dot((m - x) ** 2, b)
-            w -= q
-            w /= 2
-            like[:, k] = np.exp(w)
-        return like
+        Notes
+        -----
+        Kept for backward compatibility, same as self.unweighted_likelihood
+        """
+        return self.unweighted_likelihood(x)
 
     def unweighted_likelihood(self, x):
         """
@@ -467,31 +555,129 @@ class GMM(object):
 
         Notes
         -----
-        Hopefully faster
+        Computed as the exponential of self.unweighted_log_likelihood(x)
         """
-        xt = x.T.copy()
-        n = x.shape[0]
-        like = np.zeros((n, self.k))
+        return np.exp(self.unweighted_log_likelihood(x))
 
-        for k in range(self.k):
-            # compute the data-independent factor first
-            w = - np.log(2 * np.pi) * self.dim
-            m = np.reshape(self.means[k], (self.dim, 1))
-            b = self.precisions[k]
-            if self.prec_type == 'full':
-                w += np.log(eigvalsh(b)).sum()
-                dx = xt - m
-                sqx = dx * np.dot(b, dx)
-                q = np.zeros(n)
-                for d in range(self.dim):
-                    q += sqx[d]
-            else:
-                w += np.sum(np.log(b))
-                q = np.dot(b, (m - xt) ** 2)
-            w -= q
-            w /= 2
-            like[:, k] = np.exp(w)
-        return like
+    def _precision_factors(self, precisions=None):
+        """
+        return the square root factors of the precisions, i.e. their
+        Cholesky factors in the 'full' case, and half their log-determinant
+
+        The result is cached until the precisions are changed
+
+        Parameters
+        ----------
+        precisions: array of shape (self.k, self.dim, self.dim)
+                    or (self.k, self.dim), optional,
+                    the precisions to factor, self.precisions by default
+
+        Returns
+        -------
+        factors: array of shape (self.k, self.dim, self.dim)
+                 or (self.k, self.dim), such that
+                 self.precisions[k] = np.dot(factors[k], factors[k].T)
+                 ('full' case) or factors[k] ** 2 ('diag' case)
+        half_log_det: array of shape (self.k)
+                      half the log-determinant of the precisions
+        """
+        if precisions is None:
+            precisions = self.precisions
+        precisions = np.asarray(precisions)
+        cached = getattr(self, '_factors', None)
+        if cached is not None and cached[0].shape == precisions.shape and \
+                (cached[0] == precisions).all():
+            return cached[1:]
+
+        if self.prec_type == 'full':
+            factors = np.zeros(precisions.shape)
+            half_log_det = np.zeros(precisions.shape[0])
+            for k in range(precisions.shape[0]):
+                try:
+                    factors[k] = cholesky(precisions[k], lower=True)
+                    half_log_det[k] = np.log(np.diag(factors[k])).sum()
+                except LinAlgError:
+                    # singular precision: use its eigen-decomposition
+                    w, v = eigh(precisions[k])
+                    factors[k] = v * np.sqrt(np.maximum(w, 0))
+                    half_log_det[k] = np.log(w).sum() / 2
+        else:
+            factors = np.sqrt(precisions)
+            half_log_det = np.log(precisions).sum(1) / 2
+        self._factors = (precisions.copy(), factors, half_log_det)
+        return factors, half_log_det
+
+    def unweighted_log_likelihood(self, x):
+        """
+        return the log-likelihood of each data for each component
+        the values are not weighted by the component weights
+
+        Parameters
+        ----------
+        x: array of shape (n_samples,self.dim)
+           the data used in the estimation process
+
+        Returns
+        -------
+        log_like, array of shape(n_samples,self.k)
+          unweighted component-wise log-likelihood
+
+        Notes
+        -----
+        The Mahalanobis distances to all the components are obtained by a
+        single product of the data with the concatenated precision factors,
+        by blocks of rows.
+        """
+        return self._gaussian_log_likelihood(x, self.means, self.precisions)
+
+    def _gaussian_log_likelihood(self, x, means, precisions):
+        """ log-density of x under the Gaussians with the given means, of
+        shape (self.k, self.dim), and precisions
+        """
+        n, k, dim = x.shape[0], self.k, self.dim
+        factors, half_log_det = self._precision_factors(precisions)
+        w = half_log_det - 0.5 * np.log(2 * np.pi) * dim
+        if self.prec_type == 'diag':
+            # expand the squares, around the center of the means
+            center = means.mean(0)
+            dx, dm = x - center, means - center
+            pm = precisions * dm
+            q = np.dot(dx ** 2, precisions.T) - 2 * np.dot(dx, pm.T)
+            q += np.sum(pm * dm, 1)
+            return w - 0.5 * q
+
+        # the projections of x - means[j] on the columns of factors[j]
+        # are all obtained from a single product
+        mf = np.array([np.dot(means[j], factors[j]) for j in range(k)])
+        factors = np.vstack((
+            np.reshape(np.transpose(factors, (1, 0, 2)), (dim, k * dim)),
+            - np.reshape(mf, (1, k * dim))))
+        log_like = np.zeros((n, k))
+        step = max(1, BLOCK_SIZE // max(k * dim, 1))
+        for start in range(0, n, step):
+            rows = slice(start, min(start + step, n))
+            xr = np.hstack((x[rows], np.ones((rows.stop - start, 1))))
+            proj = np.reshape(np.dot(xr, factors), (-1, k, dim))
+            log_like[rows] = w - 0.5 * np.einsum('ijk,ijk->ij', proj, proj)
+        return log_like
+
+    def log_likelihood(self, x):
+        """
+        return the log-likelihood of the model for the data x
+        the values are weighted by the components weights
+
+        Parameters
+        ----------
+        x array of shape (n_samples,self.dim)
+           the data used in the estimation process
+
+        Returns
+        -------
+        log_like, array of shape(n_samples,self.k)
+          component-wise log-likelihood
+        """
+        with np.errstate(divide='ignore'):
+            return self.unweighted_log_likelihood(x) + np.log(self.weights)
 
     def mixture_likelihood(self, x):
         """Returns the likelihood of the mixture for x
@@ -534,9 +720,8 @@ class GMM(object):
         the bic value
         """
         x = self.check_x(x)
-        tiny = 1.e-15
-        like = self.likelihood(x)
-        return self.bic(like, tiny)
+        log_sl = _finite_log(_log_normalize(self.log_likelihood(x)))
+        return self._bic(log_sl.sum(), x.shape[0])
 
     def bic(self, like, tiny=1.e-15):
         """Computation of bic approximation of evidence
@@ -553,10 +738,12 @@ class GMM(object):
         """
         sl = np.sum(like, 1)
         sl = np.maximum(sl, tiny)
-        bicc = np.sum(np.log(sl))
+        return self._bic(np.sum(np.log(sl)), like.shape[0])
 
+    def _bic(self, bicc, n):
+        """ bic value given the log-likelihood bicc of n data items
+        """
         # number of parameters
-        n = like.shape[0]
         if self.prec_type == 'full':
             eta = self.k * (1 + self.dim + (self.dim * self.dim + 1) / 2) - 1
         else:
@@ -566,8 +753,8 @@ class GMM(object):
 
     def _Estep(self, x):
         """
-        E step of the EM algo
-        returns the likelihood per class of each data item
+        E step of the EM algo, performed in the log domain
+        returns the posterior probability of each class for each data item
 
         Parameters
         ----------
@@ -576,10 +763,14 @@ class GMM(object):
 
         Returns
         -------
-        likelihood array of shape(n_samples,self.k)
-                   component-wise likelihood
+        post: array of shape(n_samples,self.k)
+              component-wise posterior probability
+        log_sl: array of shape(n_samples)
+                log-likelihood of the data under the mixture
         """
-        return self.likelihood(x)
+        post = self.log_likelihood(x)
+        log_sl = _log_normalize(post)
+        return post, log_sl
 
     def guess_regularizing(self, x, bcheck=1):
         """
@@ -625,11 +816,49 @@ class GMM(object):
         like: array of shape(n_samples,self.k)
            the likelihood of the data under each class
         """
-        from numpy.linalg import pinv
         tiny = 1.e-15
-        pop = self.pop(like)
         sl = np.maximum(tiny, np.sum(like, 1))
         like = (like.T / sl).T
+        self._Mstep_statistics(*self._sufficient_statistics(x, like))
+
+    def _sufficient_statistics(self, x, post):
+        """
+        Returns the sufficient statistics of the data for the M step
+
+        Parameters
+        ----------
+        x: array of shape(n_samples,self.dim)
+           the data from which the model is estimated
+        post: array of shape(n_samples,self.k)
+           the posterior probability of each class for the data
+
+        Returns
+        -------
+        pop: array of shape(self.k), the population of the classes
+        sx: array of shape(self.k,self.dim), the weighted sums of the data
+        sxx: array of shape(self.k,self.dim,self.dim) or (self.k,self.dim),
+             the weighted sums of the products (or squares) of the data
+        """
+        pop = np.sum(post, 0)
+        sx = np.dot(post.T, x)
+        if self.prec_type == 'full':
+            sxx = np.array([np.dot(x.T * post[:, k], x)
+                            for k in range(self.k)])
+        else:
+            sxx = np.dot(post.T, x ** 2)
+        return pop, sx, sxx
+
+    def _Mstep_statistics(self, pop, sx, sxx):
+        """
+        M step regularized according to the procedure of
+        Fraley et al. 2007, given the sufficient statistics of the data
+
+        Parameters
+        ----------
+        pop, sx, sxx: see self._sufficient_statistics
+        """
+        from numpy.linalg import pinv
+        tiny = 1.e-15
 
         # shrinkage,weights,dof
         self.weights = self.prior_weights + pop
@@ -641,50 +870,38 @@ class GMM(object):
         shrinkage = pop + prior_shrinkage
 
         # means
-        means = np.dot(like.T, x) + self.prior_means * prior_shrinkage
+        means = sx + self.prior_means * prior_shrinkage
         self.means = means / shrinkage
 
         #precisions
-        empmeans = np.dot(like.T, x) / np.maximum(pop, tiny)
-        empcov = np.zeros(np.shape(self.precisions))
+        empmeans = sx / np.maximum(pop, tiny)
+        dx = empmeans - self.prior_means
+        apms = prior_shrinkage * pop / shrinkage
+        dof = self.prior_dof + pop + self.dim + 2
 
         if self.prec_type == 'full':
-            for k in range(self.k):
-                dx = x - empmeans[k]
-                empcov[k] = np.dot(dx.T, like[:, k:k + 1] * dx)
             #covariance
             covariance = np.array([pinv(self.prior_scale[k])
                                    for k in range(self.k)])
-            covariance += empcov
-            dx = np.reshape(empmeans - self.prior_means, (self.k, self.dim, 1))
-            addcov = np.array([np.dot(dx[k], dx[k].T) for k in range(self.k)])
-            apms = np.reshape(prior_shrinkage * pop / shrinkage,
-                              (self.k, 1, 1))
-            covariance += (addcov * apms)
-            dof = self.prior_dof + pop + self.dim + 2
-            covariance /= np.reshape(dof, (self.k, 1, 1))
+            covariance += sxx
+            covariance -= pop[:, :, np.newaxis] * \
+                empmeans[:, :, np.newaxis] * empmeans[:, np.newaxis]
+            covariance += apms[:, :, np.newaxis] * \
+                dx[:, :, np.newaxis] * dx[:, np.newaxis]
+            covariance /= dof[:, :, np.newaxis]
 
             # precision
             self.precisions = np.array([pinv(covariance[k]) \
                                        for k in range(self.k)])
         else:
-            for k in range(self.k):
-                dx = x - empmeans[k]
-                empcov[k] = np.sum(dx ** 2 * like[:, k:k + 1], 0)
             # covariance
-            covariance = np.array([1.0 / self.prior_scale[k]
-                                   for k in range(self.k)])
-            covariance += empcov
-            dx = np.reshape(empmeans - self.prior_means, (self.k, self.dim, 1))
-            addcov = np.array([np.sum(dx[k] ** 2, 0) for k in range(self.k)])
-            apms = np.reshape(prior_shrinkage * pop / shrinkage, (self.k, 1))
-            covariance += addcov * apms
-            dof = self.prior_dof + pop + self.dim + 2
-            covariance /= np.reshape(dof, (self.k, 1))
+            covariance = 1.0 / self.prior_scale
+            covariance += sxx - pop * empmeans ** 2
+            covariance += apms * np.sum(dx ** 2, 1)[:, np.newaxis]
+            covariance /= dof
 
             # precision
-            self.precisions = np.array([1.0 / covariance[k] \
-                                       for k in range(self.k)])
+            self.precisions = 1.0 / covariance
 
     def map_label(self, x, like=None):
         """return the MAP labelling of x
@@ -727,11 +944,11 @@ class GMM(object):
         x = self.check_x(x)
 
         # alternation of E/M step until convergence
-        tiny = 1.e-15
         av_ll_old = - np.inf
         for i in range(niter):
-            l = self._Estep(x)
-            av_ll = np.mean(np.log(np.maximum(np.sum(l, 1), tiny)))
+            l, log_sl = self._Estep(x)
+            log_sl = _finite_log(log_sl)
+            av_ll = np.mean(log_sl)
             if av_ll < av_ll_old + delta:
                 if verbose:
                     print 'iteration:', i, 'log-likelihood:', av_ll,\
@@ -740,13 +957,115 @@ class GMM(object):
             else:
                 av_ll_old = av_ll
             if verbose:
-                print i, av_ll, self.bic(l)
+                print i, av_ll, self._bic(log_sl.sum(), x.shape[0])
             self._Mstep(x, l)
 
-        return self.bic(l)
+        return self._bic(log_sl.sum(), x.shape[0])
+
+    def estimate_minibatch(self, x, batch_size=1000, niter=100, forget=.6,
+                           delay=2., verbose=0):
+        """ Stochastic estimation of the model given a dataset x
+
+        At each iteration, the sufficient statistics of a random subset of
+        x are computed and blended with the running ones, with a step size
+        (i + delay) ** (- forget) that decreases with the iteration i; the
+        parameters are then updated from the running statistics.  This only
+        touches niter * batch_size samples.
+
+        Parameters
+        ----------
+        x array of shape (n_samples,dim)
+          the data from which the model is estimated
+        batch_size=1000: number of samples drawn at each iteration
+        niter=100: number of iterations
+        forget=.6: float in ]0.5, 1], the decay exponent of the step size
+        delay=2.: float >= 1, the delay of the step size decay
+        verbose=0: verbosity mode
+
+        Notes
+        -----
+        self should have been initialized, e.g. with self.initialize on a
+        subset of x.
+        """
+        x = self.check_x(x)
+        if forget <= .5 or forget > 1:
+            raise ValueError('forget should be in ]0.5, 1]')
+        if delay < 1:
+            raise ValueError('delay should be at least 1')
+        n = x.shape[0]
+        batch_size = min(batch_size, n)
+        scale = float(n) / batch_size
+        stats = None
+        for i in range(niter):
+            batch = x[np.random.randint(0, n, batch_size)]
+            post, log_sl = self._Estep(batch)
+            batch_stats = self._sufficient_statistics(batch, post)
+            if stats is None:
+                stats = [scale * bs for bs in batch_stats]
+            else:
+                step = (i + delay) ** (- forget)
+                stats = [(1 - step) * s + step * scale * bs
+                         for s, bs in zip(stats, batch_stats)]
+            if verbose:
+                print i, 'batch log-likelihood:', np.mean(log_sl)
+            self._Mstep_statistics(*stats)
+
+    def estimate_chunks(self, chunks, niter=100, delta=1.e-4, verbose=0):
+        """ Estimation of the model given a dataset read by chunks
+
+        This is the EM algorithm of self.estimate, but each iteration
+        accumulates the exact sufficient statistics over the chunks, so
+        that only one chunk needs to be in memory at once.
+
+        Parameters
+        ----------
+        chunks: iterable of arrays of shape (n_i, dim), that can be
+                iterated several times (one pass per iteration),
+                e.g. a list of memory-mapped arrays or a DataChunks instance
+        niter=100: maximal number of iterations in the estimation process
+        delta = 1.e-4: increment of data likelihood at which
+              convergence is declared
+        verbose=0: verbosity mode
+
+        Returns
+        -------
+        bic : an asymptotic approximation of model evidence
+        """
+        av_ll_old = - np.inf
+        for i in range(niter):
+            stats, ll, n = None, 0, 0
+            for x in chunks:
+                x = np.asarray(x, np.float64)
+                if x.size == 0:
+                    continue
+                x = self.check_x(x)
+                post, log_sl = self._Estep(x)
+                ll += _finite_log(log_sl).sum()
+                n += x.shape[0]
+                chunk_stats = self._sufficient_statistics(x, post)
+                if stats is None:
+                    stats = list(chunk_stats)
+                else:
+                    for s, cs in zip(stats, chunk_stats):
+                        s += cs
+            if n == 0:
+                raise ValueError('no data in chunks')
+            av_ll = ll / n
+            if av_ll < av_ll_old + delta:
+                if verbose:
+                    print 'iteration:', i, 'log-likelihood:', av_ll,\
+                          'old value:', av_ll_old
+                break
+            else:
+                av_ll_old = av_ll
+            if verbose:
+                print i, av_ll, self._bic(ll, n)
+            self._Mstep_statistics(*stats)
+
+        return self._bic(ll, n)
 
     def initialize_and_estimate(self, x, z=None, niter=100, delta=1.e-4,\
-                                ninit=1, verbose=0):
+                                ninit=1, verbose=0, n_jobs=1, seed=None):
         """Estimation of self given x
 
         Parameters
@@ -761,25 +1080,20 @@ class GMM(object):
         ninit=1: number of initialization performed
                  to reach a good solution
         verbose=0: verbosity mode
+        n_jobs=1: number of worker processes among which the
+                  initializations are distributed
+        seed=None: seed of the random initializations; the result does not
+                   depend on n_jobs
 
         Returns
         -------
-        the best model is returned
+        the best model is returned; self is also set to it
         """
-        bestbic = - np.inf
-        bestgmm = GMM(self.k, self.dim, self.prec_type)
-        bestgmm.initialize(x)
-
-        for i in range(ninit):
-            # initialization -> Kmeans
-            self.initialize(x)
-
-            # alternation of E/M step until convergence
-            bic = self.estimate(x, niter=niter, delta=delta, verbose=0)
-            if bic > bestbic:
-                bestbic = bic
-                bestgmm.plugin(self.means, self.precisions, self.weights)
-
+        # each initialization (Kmeans) + EM is run on a copy of self
+        fits = _map_seeded(_estimate_gmm, x, [(self, niter, delta)] * ninit,
+                           n_jobs, seed)
+        bestgmm = _best_fit(fits)
+        self.__dict__.update(deepcopy(bestgmm.__dict__))
         return bestgmm
 
     def train(self, x, z=None, niter=100, delta=1.e-4, ninit=1, verbose=0):
@@ -889,7 +889,20 @@ def ward(G, feature, verbose=False):
     -----
     When G has more than 1 connected component, t is no longer a tree.  This
     case is handled cleanly now
+
+    The candidate merges (pairs of adjacent clusters) are kept in a
+    priority queue keyed by the inertia of their union; candidates that
+    involve an already merged cluster are discarded when they are popped,
+    so that each merge costs O(d log E), d being the number of neighbours
+    of the new cluster.
+
+    Ties between equal inertias, which are common with integer-valued
+    features, are broken by the rank of the first edge of G (in
+    lexicographic order) that joins the two clusters. The forest depends
+    on this rule, and may then differ from that of earlier versions, which
+    broke ties according to the internal order of their edge lists.
     """
+    import heapq
     # basic check
     if feature.ndim == 1:
         feature = np.reshape(feature, (-1, 1))
@@ -898,60 +911,81 @@ def ward(G, feature, verbose=False):
         raise ValueError(
             "Incompatible dimension for the feature matrix and the graph")
 
-    Features = [np.ones(2 * G.V), np.zeros((2 * G.V, feature.shape[1])),
-                np.zeros((2 * G.V, feature.shape[1]))]
-    Features[1][:G.V] = feature
-    Features[2][:G.V] = feature ** 2
-
-    # prepare a graph with twice the number of vertices
-    # this graph will contain the connectivity information
-    # along the merges.
     n = G.V
-    nbcc = G.cc().max() + 1
-    K = _auxiliary_graph(G, Features)
-
-    # prepare some variables that are useful tp speed up the algorithm
-    parent = np.arange(2 * n - nbcc).astype(np.int)
-    height = np.zeros(2 * n - nbcc)
-    linc = K.left_incidence()
-    rinc = K.right_incidence()
+    size = np.ones(2 * n)
+    first = np.zeros((2 * n, feature.shape[1]))
+    second = np.zeros((2 * n, feature.shape[1]))
+    first[:n] = feature
+    second[:n] = feature ** 2
+
+    def inertia(k, l):
+        """ inertia of the union of cluster k with each of the clusters l
+        """
+        s = first[k] + first[l]
+        return np.sum(second[k] + second[l] - s ** 2 /
+                      (size[k] + size[l])[:, np.newaxis], 1)
+
+    # adjacency between the current clusters: neighbours[i] maps each
+    # neighbour of cluster i to the rank of the first edge joining them
+    neighbours = [{} for i in range(n)]
+    if G.E > 0:
+        edges = G.edges[G.edges[:, 0] != G.edges[:, 1]]
+        edges = np.unique(np.minimum(edges[:, 0], edges[:, 1]) * n +
+                          np.maximum(edges[:, 0], edges[:, 1]))
+        left, right = edges // n, edges % n
+        # python scalars are much faster to compare than numpy ones
+        left, right = left.tolist(), right.tolist()
+        for rank, (i, j) in enumerate(zip(left, right)):
+            neighbours[i][j] = neighbours[j][i] = rank
+        queue = zip(inertia(left, right).tolist(), range(len(left)), left,
+                    right)
+        heapq.heapify(queue)
+    else:
+        queue = []
 
     # iteratively merge clusters
-    for q in range(n - nbcc):
-        # 1. find the lightest edge
-        m = (K.weights).argmin()
-        cost = K.weights[m]
-        k = q + n
-        i = K.edges[m, 0]
-        j = K.edges[m, 1]
-        height[k] = cost
+    parent = np.arange(2 * n).astype(np.int)
+    height = np.zeros(2 * n)
+    active = np.zeros(2 * n, np.bool)
+    active[:n] = True
+    k = n
+    while queue:
+        cost, rank, i, j = heapq.heappop(queue)
+        if not (active[i] and active[j]):
+            continue
         if verbose:
-            print q, i, j, m, cost
-
-        # 2. remove the current edge
-        K.edges[m] = - 1
-        K.weights[m] = np.inf
-        linc[i].remove(m)
-        rinc[j].remove(m)
-
-        ml = linc[j]
-        if np.sum(K.edges[ml, 1] == i) > 0:
-            m = ml[np.flatnonzero(K.edges[ml, 1] == i)]
-            K.edges[m] = -1
-            K.weights[m] = np.inf
-            linc[j].remove(m)
-            rinc[i].remove(m)
-
-        # 3. merge the edges with third part edges
-        parent[i] = k
-        parent[j] = k
-        for p in range(3):
-            Features[p][k] = Features[p][i] + Features[p][j]
-
-        linc, rinc = _remap(K, i, j, k, Features, linc, rinc)
+            print k - n, i, j, cost
+        height[k] = cost
+        parent[i] = parent[j] = k
+        active[i] = active[j] = False
+        active[k] = True
+        size[k] = size[i] + size[j]
+        first[k] = first[i] + first[j]
+        second[k] = second[i] + second[j]
+
+        # the neighbours of k are those of i and j
+        if len(neighbours[i]) < len(neighbours[j]):
+            i, j = j, i
+        nk = neighbours[i]
+        for l, rank in neighbours[j].iteritems():
+            if rank < nk.get(l, rank + 1):
+                nk[l] = rank
+        nk.pop(i, None)
+        nk.pop(j, None)
+        neighbours[i] = neighbours[j] = None
+        neighbours.append(nk)
+        for l, rank in nk.iteritems():
+            neighbours[l].pop(i, None)
+            neighbours[l].pop(j, None)
+            neighbours[l][k] = rank
+        if nk:
+            l = list(nk)
+            for c, m in zip(inertia(k, l).tolist(), l):
+                heapq.heappush(queue, (c, nk[m], k, m))
+        k += 1
 
     # build a tree to encode the results
-    t = WeightedForest(2 * n - nbcc, parent, height)
+    t = WeightedForest(k, parent[:k], height[:k])
     return t
 
 
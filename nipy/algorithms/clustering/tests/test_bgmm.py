@@ -10,11 +10,14 @@ Author : Bertrand Thirion, 2009
 """
 
 import numpy as np
+from copy import deepcopy
 import numpy.random as nr
 
 from ..bgmm import BGMM, VBGMM, dirichlet_eval, multinomial, dkl_gaussian 
+from .test_gmm import count_calls
 
 from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal
 
 def test_dirichlet_eval():
     # check that the Dirichlet evaluation function sums to one on a simple
@@ -142,6 +145,45 @@ def test_vbgmm():
     assert_true(z.max() + 1 == b.k)
 
 
+
+def test_vbgmm_chunks():
+    """ the estimation by chunks is the estimation on the whole data, and
+    the stochastic estimation recovers the components
+    """
+    n_samples, dim, offset, k = 1000, 2, 5, 2
+    x = nr.randn(n_samples, dim)
+    x[:300] += offset
+    b = VBGMM(k, dim)
+    b.guess_priors(x)
+    b.initialize(x)
+    b1, b2 = deepcopy(b), deepcopy(b)
+    b.estimate(x)
+    b1.estimate_chunks([x[:400], x[400:]])
+    assert_array_almost_equal(b.means, b1.means)
+    assert_array_almost_equal(b.scale, b1.scale)
+    b2.estimate_minibatch(x, batch_size=100, niter=200)
+    assert_array_almost_equal(np.sort(b2.means[:, 0]),
+                              np.sort(b.means[:, 0]), 1)
+
+
+def test_vbgmm_high_dimension():
+    # the variational EM iterates on high-dimensional data, whose
+    # log-likelihoods are far below the log of any fixed small constant
+    n_samples, dim, k = 300, 60, 2
+    x = nr.randn(n_samples, dim)
+    x[:150] += 1
+    b = VBGMM(k, dim)
+    b.guess_priors(x)
+    b.initialize(x)
+    b.means = x[[0, 1]].copy()
+    log_like = b._Estep(x)[1]
+    assert_true(np.median(log_like) < np.log(1.e-15))
+    nsteps = count_calls(b, '_Mstep')
+    b.estimate(x, niter=10)
+    assert_true(len(nsteps) > 1)
+    assert_true(b._Estep(x)[1].mean() > log_like.mean())
+
+
 def test_vbgmm_select(kmax=6):
     """ perform the estimation of a variational gmm + model selection
     """
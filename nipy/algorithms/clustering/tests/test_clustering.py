@@ -3,7 +3,7 @@
 # to run only the simple tests:
 # python testClustering.py Test_Clustering
 
-from ..utils import kmeans
+from ..utils import kmeans, _MStep, _EStep
 import nose
 import numpy as np
 import numpy.random as nr
@@ -28,6 +28,44 @@ class TestClustering(TestCase):
         l = L[:7000].astype(np.float)
         self.assert_(np.mean(l) > 0.9)
 
+    def testkmeans_lloyd(self):
+        # the accelerated iterations are those of the standard algorithm
+        nr.seed(0)
+        X = nr.randn(1000, 3)
+        L = nr.randint(0, 5, 1000)
+        C, L1, J = kmeans(X, 5, L, delta=0)
+        centers = _MStep(X, L, 5)
+        for i in range(300):
+            z, _ = _EStep(X, centers)
+            centers = _MStep(X, z, 5)
+        np.testing.assert_array_almost_equal(C, centers)
+        self.assert_((L1 == z).all())
+        self.assert_(np.abs(J - _EStep(X, C)[1]) < 1.e-8)
+
+    def testkmeans_init(self):
+        nr.seed(1)
+        X = nr.randn(3000, 2)
+        X[:1000] += 10
+        X[1000:2000] -= 10
+        for init in ['k-means++', 'random']:
+            C, L, J = kmeans(X, 3, init=init, ninit=3)
+            self.assert_(np.unique(L[:1000]).size == 1)
+            self.assert_(np.unique(L[1000:2000]).size == 1)
+            self.assert_(np.unique(L[2000:]).size == 1)
+            self.assert_(np.unique(L).size == 3)
+        self.assertRaises(ValueError, kmeans, X, 3, init='foo')
+
+    def testkmeans_minibatch(self):
+        nr.seed(2)
+        X = nr.randn(10000, 2)
+        X[:7000] += 5
+        C, L, J = kmeans(X, 2, batch_size=500)
+        C0, L0, J0 = kmeans(X, 2)
+        # the labels are defined up to a permutation
+        agreement = np.mean(L == L0)
+        self.assert_(max(agreement, 1 - agreement) > 0.99)
+        self.assert_(J < 1.01 * J0)
+
 
 if __name__ == '__main__':
     nose.run(argv=['', __file__])
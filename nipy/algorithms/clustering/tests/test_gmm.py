@@ -4,8 +4,10 @@
 # python testClustering.py Test_Clustering
 
 import numpy as np
-from nose.tools import assert_true
-from ..gmm import GMM, best_fitting_GMM
+from copy import deepcopy
+from nose.tools import assert_true, assert_equal
+from numpy.testing import assert_array_almost_equal
+from ..gmm import GMM, DataChunks, best_fitting_GMM
 
 # seed the random number generator to avoid rare random failures
 seed = 1
@@ -114,7 +116,24 @@ def test_em_selection():
     lgmm = best_fitting_GMM(x, krange, prec_type='full',
                             niter=100, delta = 1.e-4, ninit=1)
     assert_true(lgmm.k < 4)
-    
+
+
+
+def test_em_selection_parallel():
+    # the model selection does not depend on the number of workers
+    dim = 2
+    x = np.concatenate((nr.randn(100, dim), 3 + 2 * nr.randn(100, dim)))
+    krange = range(1, 4)
+    gmm1 = best_fitting_GMM(x, krange, ninit=2, seed=1)
+    gmm2 = best_fitting_GMM(x, krange, ninit=2, seed=1, n_jobs=2)
+    assert_equal(gmm1.k, gmm2.k)
+    assert_array_almost_equal(gmm1.means, gmm2.means)
+    assert_array_almost_equal(gmm1.precisions, gmm2.precisions)
+    lgmm = GMM(2, dim)
+    gmm3 = lgmm.initialize_and_estimate(x, ninit=3, seed=2, n_jobs=2)
+    gmm4 = GMM(2, dim).initialize_and_estimate(x, ninit=3, seed=2)
+    assert_array_almost_equal(gmm3.means, gmm4.means)
+    assert_array_almost_equal(lgmm.means, gmm4.means)
 
 def test_em_gmm_full():
     # Computing the BIC value for different configurations
@@ -260,6 +279,138 @@ def test_em_gmm_cv():
     assert_true(ll[4] < ll[1])
 
 
+def explicit_likelihood(lgmm, x):
+    """ likelihood of x under each component of lgmm, computed explicitly
+    """
+    like = np.zeros((x.shape[0], lgmm.k))
+    for k in range(lgmm.k):
+        w = - np.log(2 * np.pi) * lgmm.dim
+        m = np.reshape(lgmm.means[k], (1, lgmm.dim))
+        b = lgmm.precisions[k]
+        if lgmm.prec_type == 'full':
+            w += np.log(np.linalg.eigvalsh(b)).sum()
+            dx = m - x
+            q = np.sum(np.dot(dx, b) * dx, 1)
+        else:
+            w += np.sum(np.log(b))
+            q = np.dot((m - x) ** 2, b)
+        like[:, k] = np.exp((w - q) / 2)
+    return like
+
+
+def test_em_log_likelihood():
+    # the log-domain likelihood is that of the explicit computation,
+    # and is still defined where the latter underflows
+    dim, k = 3, 4
+    x = nr.randn(200, dim)
+    for prec_type in ['full', 'diag']:
+        lgmm = GMM(k, dim, prec_type)
+        lgmm.initialize(x)
+        like = explicit_likelihood(lgmm, x)
+        assert_array_almost_equal(
+            np.exp(lgmm.unweighted_log_likelihood(x)) / like, 1)
+        assert_array_almost_equal(lgmm.unweighted_likelihood(x) / like, 1)
+        assert_array_almost_equal(lgmm.unweighted_likelihood_(x) / like, 1)
+
+    dim = 200
+    x = 100 * nr.randn(100, dim)
+    x[:50] += 200
+    lgmm = GMM(2, dim, 'diag')
+    lgmm.initialize(x)
+    assert_true((lgmm.likelihood(x) == 0).all())
+    post, log_like = lgmm._Estep(x)
+    assert_array_almost_equal(post.sum(1), 1)
+    assert_true(np.isfinite(log_like).all())
+    assert_true(np.isfinite(lgmm.estimate(x)))
+
+
+def count_calls(obj, name):
+    """ Wraps the method name of obj, so that its calls are recorded in the
+    returned list
+    """
+    calls = []
+    method = getattr(obj, name)
+
+    def counting_method(*args):
+        calls.append(args)
+        return method(*args)
+
+    setattr(obj, name, counting_method)
+    return calls
+
+
+def test_em_high_dimension():
+    # the log-likelihoods of high-dimensional data are far below the log
+    # of any fixed small constant; EM should still iterate and increase
+    # the likelihood
+    dim, k = 60, 2
+    x = nr.randn(300, dim)
+    x[:150] += 1
+    for prec_type in ['full', 'diag']:
+        lgmm = GMM(k, dim, prec_type)
+        lgmm.initialize(x)
+        # start from poor means, so that EM has some work to do
+        lgmm.means = x[[0, 1]].copy()
+        log_like = lgmm._Estep(x)[1]
+        assert_true(np.median(log_like) < np.log(1.e-15))
+        nsteps = count_calls(lgmm, '_Mstep')
+        bic = lgmm.estimate(x, niter=10, delta=0)
+        assert_true(len(nsteps) > 1)
+        assert_true(lgmm._Estep(x)[1].mean() > log_like.mean())
+        assert_true(np.absolute(lgmm.evidence(x) - bic) <
+                    1.e-3 * np.absolute(bic))
+
+
+def test_em_chunks():
+    # the estimation by chunks is the estimation on the whole data
+    dim, k = 2, 3
+    data = nr.randn(10, 8, 6, dim)
+    data[:5] += 3
+    mask = nr.rand(10, 8, 6) > .2
+    chunks = DataChunks(data, mask, 3)
+    assert_array_almost_equal(np.vstack(list(chunks)), data[mask])
+    for prec_type in ['full', 'diag']:
+        lgmm = GMM(k, dim, prec_type)
+        lgmm.initialize(data[mask])
+        lgmm2 = deepcopy(lgmm)
+        bic = lgmm.estimate(data[mask])
+        bic2 = lgmm2.estimate_chunks(chunks)
+        assert_true(np.absolute(bic - bic2) < 1.e-8 * np.absolute(bic))
+        assert_array_almost_equal(lgmm.means, lgmm2.means)
+        assert_array_almost_equal(lgmm.precisions, lgmm2.precisions)
+
+
+def test_em_chunks_high_dimension():
+    # the estimation by chunks is not stalled by the tiny likelihoods of
+    # high-dimensional data either
+    dim, k = 60, 2
+    x = nr.randn(300, dim)
+    x[:150] += 1
+    lgmm = GMM(k, dim, 'diag')
+    lgmm.initialize(x)
+    lgmm.means = x[[0, 1]].copy()
+    lgmm2 = deepcopy(lgmm)
+    nsteps = count_calls(lgmm2, '_Mstep_statistics')
+    lgmm.estimate(x, niter=10)
+    lgmm2.estimate_chunks([x[:100], x[100:]], niter=10)
+    assert_true(len(nsteps) > 1)
+    assert_array_almost_equal(lgmm.means, lgmm2.means)
+    assert_array_almost_equal(lgmm.precisions, lgmm2.precisions)
+
+
+def test_em_minibatch():
+    # the stochastic estimation recovers well-separated components
+    dim, k, n = 2, 2, 10000
+    x = nr.randn(n, dim)
+    x[:3000] += 10
+    lgmm = GMM(k, dim)
+    lgmm.initialize(x[::10])
+    lgmm.estimate_minibatch(x, batch_size=200, niter=100)
+    assert_array_almost_equal(np.sort(lgmm.weights), [.3, .7], 1)
+    means = lgmm.means[np.argsort(lgmm.means[:, 0])]
+    assert_array_almost_equal(means, [[0, 0], [10, 10]], 1)
+
+
 if __name__ == '__main__':
     import nose
     nose.run(argv=['', __file__])
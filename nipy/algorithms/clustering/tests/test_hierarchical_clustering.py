@@ -15,7 +15,8 @@ from ..hierarchical_clustering import (average_link_graph,
                                        ward, ward_quick,
                                        ward_segment, ward_field_segment,
                                        ward_quick_segment)
-from nipy.algorithms.graph.graph import WeightedGraph, knn
+from nipy.algorithms.graph.graph import (WeightedGraph, knn,
+                                         wgraph_from_3d_grid)
 from nipy.algorithms.graph.field import field_from_graph_and_data
 
 from nose.tools import assert_true, assert_equal
@@ -165,6 +166,76 @@ def ward_test_more(n=100, k=5, verbose=0):
     assert_equal(np.sum(u1==u2), n)
 
 
+def ward_test_grid(nx=12, ny=11):
+    # Check ward's algorithm on a grid graph with two connected components
+    np.random.seed(0)
+    xyz = np.reshape(np.indices((nx, ny, 1)), (3, nx * ny)).T
+    xyz = xyz[xyz[:, 0] != nx // 2]
+    n = xyz.shape[0]
+    X = randn(n, 3)
+    G = wgraph_from_3d_grid(xyz, 6)
+    t = ward(G, X)
+    assert_equal(t.V, 2 * n - 2)
+    assert_equal(t.isroot().sum(), 2)
+    # merge costs are the inertia of the union, hence non-decreasing
+    height = t.height[n:]
+    assert_true((np.diff(height) >= - 1.e-12).all())
+    # the two roots are the two connected components
+    u = t.split(2)
+    assert_equal(np.unique(u[xyz[:, 0] < nx // 2]).size, 1)
+    assert_equal(np.unique(u[xyz[:, 0] > nx // 2]).size, 1)
+    inertia = [np.sum(u == l) * np.var(X[u == l], 0).sum() for l in range(2)]
+    assert_true(np.abs(height.max() - max(inertia)) < 1.e-8)
+
+
+def _ward_reference(G, X):
+    # brute force ward: merge the adjacent clusters with the smallest
+    # inertia, ties being broken by the rank of the first edge of G, in
+    # lexicographic order, that joins them
+    n = G.V
+    edges = sorted(set((min(i, j), max(i, j)) for i, j in G.edges if i != j))
+    members = dict((i, [i]) for i in range(n))
+    label = range(n)
+    parent, height = range(n), [0.] * n
+    while True:
+        candidates = {}
+        for rank, (i, j) in enumerate(edges):
+            a, b = sorted((label[i], label[j]))
+            if a != b and (a, b) not in candidates:
+                x = X[members[a] + members[b]]
+                cost = np.sum((x ** 2).sum(0) - x.sum(0) ** 2 / len(x))
+                candidates[(a, b)] = (cost, rank)
+        if not candidates:
+            break
+        a, b = min(candidates, key=candidates.get)
+        k = len(parent)
+        parent[a] = parent[b] = k
+        parent.append(k)
+        height.append(candidates[(a, b)][0])
+        members[k] = members.pop(a) + members.pop(b)
+        for v in members[k]:
+            label[v] = k
+    return np.array(parent), np.array(height)
+
+
+def ward_test_ties():
+    # integer-valued features yield many tied inertias; the merge order
+    # is nevertheless deterministic
+    for seed in range(4):
+        np.random.seed(seed)
+        if seed % 2:
+            xyz = np.reshape(np.indices((5, 5, 2)), (3, 50)).T
+            G = wgraph_from_3d_grid(xyz, 6)
+        else:
+            G = knn(randn(40, 2), 4)
+        X = np.random.randint(0, 3, (G.V, 2)).astype(np.float)
+        t = ward(G, X)
+        parent, height = _ward_reference(G, X)
+        assert_equal(t.V, parent.size)
+        assert_true((t.parents == parent).all())
+        assert_true(np.abs(t.height - height).max() < 1.e-10)
+
+
 if __name__ == '__main__':
     import nose
     nose.run(argv=['', __file__])
@@ -13,6 +13,7 @@ from ..von_mises_fisher_mixture import (VonMisesMixture,
 
 
 from nose.tools import assert_true, assert_equal
+from numpy.testing import assert_array_almost_equal
 
 
 def test_spherical_area():
@@ -71,6 +72,27 @@ def test_dimension_selection_cv():
     assert_true(len(np.unique(z))<4)
 
 
+
+def test_dimension_selection_parallel():
+    # the selected model does not depend on the number of workers
+    x = np.random.randn(60, 3) * .1
+    x[::2] += [1, 0, 0]
+    x = (x.T / np.sqrt(np.sum(x ** 2, 1))).T
+    precision = 50.
+    vmm1 = select_vmm(range(1, 4), precision, False, x, ninit=3, seed=0)
+    vmm2 = select_vmm(range(1, 4), precision, False, x, ninit=3, seed=0,
+                      n_jobs=2)
+    assert_equal(vmm1.k, vmm2.k)
+    assert_array_almost_equal(vmm1.means, vmm2.means)
+    sub = np.repeat(np.arange(5), 12)
+    vmm1 = select_vmm_cv(range(1, 4), precision, x, False, sub, ninit=2,
+                         seed=0)
+    vmm2 = select_vmm_cv(range(1, 4), precision, x, False, sub, ninit=2,
+                         seed=0, n_jobs=2)
+    assert_equal(vmm1.k, vmm2.k)
+    assert_array_almost_equal(vmm1.means, vmm2.means)
+
+
 if __name__ == '__main__':
     import nose
     nose.run(argv=['', __file__])
@@ -5,9 +5,11 @@
 
 import numpy as np
 
+from ..utils.fast_distance import euclidean_distance
+
 
 def kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=0.0001, verbose=0,
-              ninit=1):
+              ninit=1, init='random', batch_size=None):
     """ kmeans clustering algorithm
 
     Parameters
@@ -23,6 +25,13 @@ def kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=0.0001, verbose=0,
            before declaring convergence.
     verbose: verbosity mode, optionall
     ninit: int, optional, number of random initalizations
+    init: string, optional, the random initialization of the centers,
+          either 'random' (uniform sampling of the items, the default)
+          or 'k-means++' (distance-weighted sampling of the items)
+    batch_size: int, optional,
+                if not None, the centers are updated from random batches
+                of batch_size items (mini-batch kmeans) and the items are
+                only all assigned once at the end
 
     Returns
     -------
@@ -30,7 +39,15 @@ def kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=0.0001, verbose=0,
              the centroids of  the resulting clusters
     Labels : array of size n, the discrete labels of the input items
     J (float):  the final value of the inertia criterion
+
+    Notes
+    -----
+    Unless batch_size is provided, the iterations are those of the standard
+    (Lloyd) algorithm, but the triangle inequality is used to skip most of
+    the distance computations (Hamerly, 2010)
     """
+    if init not in ['k-means++', 'random']:
+        raise ValueError("init should be 'k-means++' or 'random'")
     nbitems = X.shape[0]
     if nbitems < 1:
         if verbose:
@@ -84,7 +101,8 @@ def kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=0.0001, verbose=0,
         else:
             if verbose:
                 print "incompatible number of labels provided - ignored"
-    Centers, labels, J = _kmeans(X, nbclusters, Labels, maxiter, delta, ninit)
+    Centers, labels, J = _kmeans(X, nbclusters, Labels, maxiter, delta, ninit,
+                                 init=init, batch_size=batch_size)
     return Centers, labels, J
 
 
@@ -101,15 +119,15 @@ def _MStep(x, z, k):
     Returns
     -------
     centers, array of shape (k,p)
-             the resulting centers
+             the resulting centers; empty clusters are set to the mean of x
     """
     dim = x.shape[1]
     centers = np.repeat(np.reshape(x.mean(0), (1, dim)), k, 0)
-    for q in range(k):
-        if np.sum(z == q) == 0:
-            pass
-        else:
-            centers[q] = np.mean(x[z == q], 0)
+    valid = (z >= 0) & (z < k)
+    pop = np.bincount(z[valid], minlength=k)
+    for d in range(dim):
+        sums = np.bincount(z[valid], x[valid, d], minlength=k)
+        centers[pop > 0, d] = sums[pop > 0] / pop[pop > 0]
     return centers
 
 
@@ -162,7 +180,7 @@ def voronoi(x, centers):
 
 
 def _kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=1.e-4,
-            ninit=1, verbose=0):
+            ninit=1, verbose=0, init='random', batch_size=None):
     """ kmeans clustering algorithm
 
     Parameters
@@ -177,13 +195,16 @@ def _kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=1.e-4,
     delta: float, optional
            the relative increment in the results before declaring convergence.
     verbose=0: verboseity mode
+    init: string, optional, 'random' or 'k-means++', see kmeans
+    batch_size: int, optional, see kmeans
 
     Returns
     -------
     Centers: array of shape (nbclusters, p),
              the centroids of  the resulting clusters
     Labels: array of size n, the discrete labels of the input items
-    J, float,  the final value of the inertia criterion
+    J, float,  the final value of the inertia criterion; the restart
+       with the lowest value is returned
     """
     # fixme: do the checks
     nbitem = X.shape[0]
@@ -193,30 +214,239 @@ def _kmeans(X, nbclusters=2, Labels=None, maxiter=300, delta=1.e-4,
     for it in range(ninit):
         # init
         if Labels == None:
-            seeds = np.argsort(np.random.rand(nbitem))[:nbclusters]
-            centers = X[seeds]
+            if init == 'random':
+                seeds = np.argsort(np.random.rand(nbitem))[:nbclusters]
+                centers = X[seeds]
+            else:
+                centers = _kmeans_plusplus(X, nbclusters)
         else:
             centers = _MStep(X, Labels, nbclusters)
-        centers_old = centers.copy()
 
         # iterations
-        for i in range(maxiter):
-            z, J = _EStep(X, centers)
-            centers = _MStep(X, z, nbclusters)
+        if batch_size is None:
+            centers, z, J = _hamerly(X, centers, maxiter, delta * vdata,
+                                     verbose)
+        else:
+            centers, z, J = _minibatch_kmeans(
+                X, centers, batch_size, maxiter, delta * vdata, verbose)
+        if J < bJ or it == 0:
+            bJ = J
+            centers_output = centers
+            z_output = z
+
+    return centers_output, z_output, bJ
+
+
+def _kmeans_plusplus(X, k):
+    """ k-means++ initialization: the centers are drawn among the items of
+    X, with a probability proportional to the squared distance to the
+    closest center already chosen
+    """
+    n = X.shape[0]
+    centers = np.zeros((k, X.shape[1]))
+    centers[0] = X[np.random.randint(n)]
+    sqdist = np.sum((X - centers[0]) ** 2, 1)
+    for j in range(1, k):
+        cumdist = np.cumsum(sqdist)
+        if cumdist[-1] > 0:
+            idx = np.searchsorted(cumdist, np.random.rand() * cumdist[-1],
+                                  'right')
+            idx = min(idx, n - 1)
+        else:
+            idx = np.random.randint(n)
+        centers[j] = X[idx]
+        sqdist = np.minimum(sqdist, np.sum((X - centers[j]) ** 2, 1))
+    return centers
+
+
+def _two_nearest(x, centers):
+    """ Returns the index of the nearest center of each item of x, and the
+    distances to the nearest and second nearest centers (inf if k = 1)
+    """
+    dist = euclidean_distance(x, centers)
+    z = np.argmin(dist, 1)
+    rows = np.arange(x.shape[0])
+    upper = dist[rows, z]
+    dist[rows, z] = np.inf
+    lower = dist.min(1) if centers.shape[0] > 1 else dist[:, 0]
+    return z, upper, lower
+
+
+def _hamerly(X, centers, maxiter, tol, verbose=0):
+    """ kmeans iterations, with the acceleration of Hamerly (2010)
+
+    An upper bound on the distance of each item to its center and a lower
+    bound on its distance to the other centers are maintained through the
+    center moves, and only the items for which these bounds overlap are
+    reassigned.  This yields the same iterations as the standard algorithm.
+
+    Parameters
+    ----------
+    X: array of shape (n,p), the data
+    centers: array of shape (k,p), the initial centers
+    maxiter: int, the maximum number of iterations
+    tol: float, the squared center displacement at which convergence is
+         declared
+
+    Returns
+    -------
+    centers, z, J: see _kmeans
+    """
+    k = centers.shape[0]
+    z, upper, lower = _two_nearest(X, centers)
+    for i in range(maxiter):
+        new_centers = _MStep(X, z, k)
+        move = np.sqrt(np.sum((new_centers - centers) ** 2, 1))
+        centers = new_centers
+        if np.sum(move ** 2) < tol:
             if verbose:
-                print i, J
-            if np.sum((centers_old - centers) ** 2) < delta * vdata:
-                if verbose:
-                    print i
+                print i
+            break
+
+        # update the bounds with the center displacements
+        upper += move[z]
+        order = np.argsort(move)
+        max_move = np.where(z == order[-1],
+                            move[order[-2]] if k > 1 else 0, move[order[-1]])
+        lower -= max_move
+
+        # half the distance of each center to the closest other one
+        half_gap = euclidean_distance(centers, centers)
+        half_gap[np.arange(k), np.arange(k)] = np.inf
+        half_gap = .5 * half_gap.min(1)
+        bound = np.maximum(half_gap[z], lower)
+
+        # tighten the upper bounds where needed, then reassign
+        cand = np.flatnonzero(upper > bound)
+        upper[cand] = np.sqrt(np.sum((X[cand] - centers[z[cand]]) ** 2, 1))
+        cand = cand[upper[cand] > bound[cand]]
+        if cand.size > 0:
+            z[cand], upper[cand], lower[cand] = _two_nearest(X[cand], centers)
+        if verbose:
+            print i, cand.size
+
+    J = np.sum((X - centers[z]) ** 2)
+    return centers, z, J
+
+
+def _minibatch_kmeans(X, centers, batch_size, maxiter, tol, verbose=0):
+    """ mini-batch kmeans (Sculley, 2010): at each iteration, the centers
+    are moved towards the mean of their items in a random batch, with a
+    rate inversely proportional to their number of items so far.
+    Convergence is tested on the displacement of the centers over as many
+    batches as needed to see the whole data once.
+
+    Parameters
+    ----------
+    X: array of shape (n,p), the data
+    centers: array of shape (k,p), the initial centers
+    batch_size: int, the number of items drawn at each iteration
+    maxiter: int, the maximum number of iterations
+    tol: float, the squared center displacement at which convergence is
+         declared
+
+    Returns
+    -------
+    centers, z, J: see _kmeans
+    """
+    n, k = X.shape[0], centers.shape[0]
+    centers = centers.copy()
+    centers_old = centers.copy()
+    counts = np.zeros(k)
+    n_batches = max(1, n // batch_size)
+    for i in range(maxiter):
+        batch = X[np.random.randint(0, n, batch_size)]
+        zb = _two_nearest(batch, centers)[0]
+        pop = np.bincount(zb, minlength=k)
+        counts += pop
+        valid = pop > 0
+        new_centers = centers.copy()
+        for d in range(X.shape[1]):
+            sums = np.bincount(zb, batch[:, d], minlength=k)
+            new_centers[valid, d] += (sums[valid] - pop[valid] *
+                                      centers[valid, d]) / counts[valid]
+        centers = new_centers
+        if (i + 1) % n_batches == 0:
+            shift = np.sum((centers - centers_old) ** 2)
+            if verbose:
+                print i, shift
+            if shift < tol:
                 break
             centers_old = centers.copy()
 
-            if J < bJ:
-                bJ = J
-                centers_output = centers.copy()
-                z_output = z.copy()
-    else:
-        centers_output = centers
-        z_output = z
+    z, dist, _ = _two_nearest(X, centers)
+    J = np.sum(dist ** 2)
+    return centers, z, J
 
-    return centers_output, z_output, bJ
+
+# Data shared by the worker processes of `_map_seeded` (see `_init_worker`)
+_worker_data = None
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _run_seeded(task):
+    """ Run func(data, *args) for task = (func, seed, args), with the global
+    random generator seeded by seed; its state is restored afterwards
+    """
+    func, seed, args = task
+    state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        return func(_worker_data, *args)
+    finally:
+        np.random.set_state(state)
+
+
+def _map_seeded(func, data, args, n_jobs=1, seed=None):
+    """ Returns the list of func(data, *a) for a in args, computed in
+    n_jobs worker processes
+
+    Each call is run with its own seed of the global random generator.
+    The seeds are drawn from seed (from the global random generator if seed
+    is None) before the calls are dispatched, so that the results do not
+    depend on n_jobs.
+
+    Parameters
+    ----------
+    func: a module-level function, called as func(data, *a)
+    data: the data shared by all the calls, sent once to each worker
+    args: list of tuples, the arguments of the different calls
+    n_jobs: int, optional, the number of worker processes
+    seed: None or int, optional, the seed of the seeds draw
+    """
+    if n_jobs < 1:
+        raise ValueError('n_jobs should be at least 1')
+    if seed is None:
+        seeds = np.random.randint(0, 2 ** 31 - 1, len(args))
+    else:
+        seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, len(args))
+    tasks = [(func, s, a) for s, a in zip(seeds.tolist(), args)]
+    if n_jobs == 1 or len(tasks) < 2:
+        _init_worker(data)
+        try:
+            return map(_run_seeded, tasks)
+        finally:
+            _init_worker(None)
+    import multiprocessing
+    pool = multiprocessing.Pool(min(n_jobs, len(tasks)), _init_worker,
+                                (data,))
+    try:
+        return pool.map(_run_seeded, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _best_fit(fits):
+    """ Returns the model with the highest score among the (model, score)
+    pairs of fits, the first one in case of ties or if no score is finite
+    """
+    best_model, best_score = fits[0][0], - np.inf
+    for model, score in fits:
+        if score > best_score:
+            best_model, best_score = model, score
+    return best_model
@@ -6,6 +6,8 @@ Author: Bertrand Thirion, 2010-2011
 """
 import numpy as np
 
+from .utils import _map_seeded, _best_fit
+
 
 class VonMisesMixture(object):
     """
@@ -258,8 +260,21 @@ class VonMisesMixture(object):
         pylab.show()
 
 
+def _estimate_vmm(x, k, precision, null_class, bias, maxiter, train=None):
+    """ Estimates a von Mises mixture on x (restricted to train if provided)
+    from a random initialization; returns it with the average log-density
+    """
+    if train is not None:
+        x = x[train]
+        if bias is not None:
+            bias = bias[train]
+    model = VonMisesMixture(k, precision, null_class=null_class)
+    ll = model.estimate(x, maxiter=maxiter, bias=bias)
+    return model, ll
+
+
 def estimate_robust_vmm(k, precision, null_class, x, ninit=10, bias=None,
-                        maxiter=100):
+                        maxiter=100, n_jobs=1, seed=None):
     """ Return the best von_mises mixture after severla initialization
 
     Parameters
@@ -276,19 +291,21 @@ def estimate_robust_vmm(k, precision, null_class, x, ninit=10, bias=None,
           prior probability of being in a non-null class
     maxiter: int, optional,
              maximum number of iterations after each initialization
+    n_jobs: int, optional,
+            number of worker processes among which the initializations
+            are distributed
+    seed: int, optional,
+          seed of the random initializations; the result does not depend
+          on n_jobs
     """
-    score = - np.inf
-    for i in range(ninit):
-        aux = VonMisesMixture(k, precision, null_class=null_class)
-        ll = aux.estimate(x, bias=bias)
-        if ll > score:
-            best_model = aux
-            score = ll
-    return best_model
+    fits = _map_seeded(_estimate_vmm, x,
+                       [(k, precision, null_class, bias, maxiter)] * ninit,
+                       n_jobs, seed)
+    return _best_fit(fits)
 
 
 def select_vmm(krange, precision, null_class, x, ninit=10, bias=None,
-               maxiter=100, verbose=0):
+               maxiter=100, verbose=0, n_jobs=1, seed=None):
     """Return the best von_mises mixture after severla initialization
 
     Parameters
@@ -305,11 +322,20 @@ def select_vmm(krange, precision, null_class, x, ninit=10, bias=None,
     bias: array of shape(n),
           a prior probability of not being in the null class
     verbose: Bool, optional
+    n_jobs: int, optional,
+            number of worker processes among which the ninit * len(krange)
+            estimations are distributed
+    seed: int, optional,
+          seed of the random initializations; the result does not depend
+          on n_jobs
     """
+    krange = list(krange)
+    fits = _map_seeded(_estimate_vmm, x,
+                       [(k, precision, null_class, bias, maxiter)
+                        for k in krange for i in range(ninit)], n_jobs, seed)
     score = - np.inf
-    for k in krange:
-        aux = estimate_robust_vmm(k, precision, null_class, x, ninit, bias,
-                                  maxiter)
+    for q, k in enumerate(krange):
+        aux = _best_fit(fits[q * ninit: (q + 1) * ninit])
         ll = aux.estimate(x)
         if null_class:
             bic = ll - np.log(x.shape[0]) * k * 3 / x.shape[0]
@@ -324,7 +350,8 @@ def select_vmm(krange, precision, null_class, x, ninit=10, bias=None,
 
 
 def select_vmm_cv(krange, precision, x, null_class, cv_index,
-                  ninit=5, maxiter=100, bias=None, verbose=0):
+                  ninit=5, maxiter=100, bias=None, verbose=0, n_jobs=1,
+                  seed=None):
     """Return the best von_mises mixture after severla initialization
 
     Parameters
@@ -341,40 +368,47 @@ def select_vmm_cv(krange, precision, x, null_class, cv_index,
            number of iterations
     maxiter: int, optional,
     bias: array of shape (n), prior
+    n_jobs: int, optional,
+            number of worker processes among which the estimations (for
+            each k, each fold and the whole data) are distributed
+    seed: int, optional,
+          seed of the random initializations; the result does not depend
+          on n_jobs
     """
-    score = - np.inf
-    mll = []
+    krange = list(krange)
+    folds = np.unique(cv_index)
+    args = []
     for k in krange:
-        mll.append( - np.inf)
-        for j in range(1):
-            ll = np.zeros_like(cv_index).astype(np.float)
-            for i in np.unique(cv_index):
-                xl = x[cv_index != i]
-                xt = x[cv_index == i]
-                bias_l = None
-                if bias is not None:
-                    bias_l = bias[cv_index != i]
-                aux = estimate_robust_vmm(k, precision, null_class, xl,
-                                          ninit=ninit, bias=bias_l,
-                                          maxiter=maxiter)
-                if bias is None:
-                    ll[cv_index == i] = np.log(aux.mixture_density(xt))
-                else:
-                    bias_t = bias[cv_index == i]
-                    lwd = aux.weighted_density(xt)
-                    ll[cv_index == i] = np.log(lwd[:, 0] * (1 - bias_t) +  \
-                        lwd[:, 1:].sum(1) * bias_t)
-            if ll.mean() > mll[-1]:
-                mll[-1] = ll.mean()
-
-        aux = estimate_robust_vmm(k, precision, null_class, x,
-                                  ninit, bias=bias, maxiter=maxiter)
+        for i in folds:
+            args += [(k, precision, null_class, bias, maxiter,
+                      cv_index != i)] * ninit
+        args += [(k, precision, null_class, bias, maxiter)] * ninit
+    fits = _map_seeded(_estimate_vmm, x, args, n_jobs, seed)
+
+    score = - np.inf
+    nfits = ninit * (len(folds) + 1)
+    for q, k in enumerate(krange):
+        kfits = fits[q * nfits: (q + 1) * nfits]
+        ll = np.zeros_like(cv_index).astype(np.float)
+        for j, i in enumerate(folds):
+            aux = _best_fit(kfits[j * ninit: (j + 1) * ninit])
+            xt = x[cv_index == i]
+            if bias is None:
+                ll[cv_index == i] = np.log(aux.mixture_density(xt))
+            else:
+                bias_t = bias[cv_index == i]
+                lwd = aux.weighted_density(xt)
+                ll[cv_index == i] = np.log(lwd[:, 0] * (1 - bias_t) +  \
+                    lwd[:, 1:].sum(1) * bias_t)
+        mll = ll.mean()
+
+        aux = _best_fit(kfits[- ninit:])
 
         if verbose:
-            print k, mll[ - 1]
-        if mll[ - 1] > score:
+            print k, mll
+        if mll > score:
             best_model = aux
-            score = mll[ - 1]
+            score = mll
 
     return best_model
 
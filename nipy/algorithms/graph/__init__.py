@@ -3,7 +3,7 @@
 from .graph import (Graph, WeightedGraph, wgraph_from_coo_matrix,
                     wgraph_from_adjacency, complete_graph, mst, knn, eps_nn,
                     lil_cc, graph_3d_grid, wgraph_from_3d_grid,
-                    concatenate_graphs)
+                    concatenate_graphs, cc_from_3d_grid, cc_summary)
 
 from nipy.testing import Tester
 test = Tester().test
@@ -1,9 +1,15 @@
 import numpy as np
 cimport numpy as np
 cimport cython
+
+from nipy.utils.threads import run_threads
+
 ctypedef np.float64_t DOUBLE
 ctypedef np.int_t INT
 
+cdef extern from "math.h":
+    double INFINITY
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -27,3 +33,515 @@ def dilation(np.ndarray[DOUBLE, ndim=2] field,\
         for i in range(size_max):
             field[i, d] = res[i]
     return res
+
+
+cdef inline INT _find(INT* parent, INT i):
+    # root lookup with path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def grid_cc(np.ndarray[INT, ndim=2] xyz, int k=18):
+    """ Connected components labelling of a set of 3d grid points
+    by union-find over the implicit k-connectivity lattice.
+
+    Components are numbered by increasing index of their first point,
+    which matches `Graph.cc` on the corresponding grid graph.
+    """
+    cdef int n = xyz.shape[0]
+    cdef int i, j, o, noffsets = 0, x, y, z, xx, yy, zz
+    cdef INT ri, rj, nlabels = 0
+    cdef int dx, dy, dz, sx, sy, sz
+    cdef int offsets[13][3]
+    cdef np.ndarray[INT, ndim=1] parent = np.arange(n)
+    cdef np.ndarray[INT, ndim=1] labels = np.zeros(n, np.int)
+    cdef np.ndarray[INT, ndim=2] lxyz
+    cdef np.ndarray[INT, ndim=3] index
+    if n == 0:
+        return labels
+    # half of the neighbourhood, i.e. offsets that precede the
+    # origin in lexicographic order
+    for dx in range(-1, 1):
+        for dy in range(-1, 2):
+            for dz in range(-1, 2):
+                if dx == 0 and (dy > 0 or (dy == 0 and dz >= 0)):
+                    continue
+                o = dx * dx + dy * dy + dz * dz
+                if (k == 6 and o > 1) or (k == 18 and o > 2):
+                    continue
+                offsets[noffsets][0] = dx
+                offsets[noffsets][1] = dy
+                offsets[noffsets][2] = dz
+                noffsets += 1
+    lxyz = xyz - xyz.min(0)
+    sx, sy, sz = [d + 1 for d in lxyz.max(0)]
+    index = - np.ones((sx, sy, sz), np.int)
+    for i in range(n):
+        index[lxyz[i, 0], lxyz[i, 1], lxyz[i, 2]] = i
+    for i in range(n):
+        x, y, z = lxyz[i, 0], lxyz[i, 1], lxyz[i, 2]
+        for o in range(noffsets):
+            xx = x + offsets[o][0]
+            yy = y + offsets[o][1]
+            zz = z + offsets[o][2]
+            if xx < 0 or yy < 0 or zz < 0 or yy >= sy or zz >= sz:
+                continue
+            j = index[xx, yy, zz]
+            if j < 0:
+                continue
+            ri = _find(<INT*> parent.data, i)
+            rj = _find(<INT*> parent.data, j)
+            # keep the smallest index as root
+            if ri < rj:
+                parent[rj] = ri
+            elif rj < ri:
+                parent[ri] = rj
+    for i in range(n):
+        ri = _find(<INT*> parent.data, i)
+        if ri == i:
+            labels[i] = nlabels
+            nlabels += 1
+        else:
+            labels[i] = labels[ri]
+    return labels
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def cc_stats(np.ndarray[INT, ndim=1] labels,
+             np.ndarray[DOUBLE, ndim=1] values):
+    """ Size, sum of values and index of the maximum value of each
+    connected component, computed in a single pass. Negative labels
+    are ignored.
+    """
+    cdef int n = labels.shape[0]
+    cdef int i
+    cdef INT l, nlabels = 0
+    for i in range(n):
+        if labels[i] >= nlabels:
+            nlabels = labels[i] + 1
+    cdef np.ndarray[INT, ndim=1] size = np.zeros(nlabels, np.int)
+    cdef np.ndarray[DOUBLE, ndim=1] mass = np.zeros(nlabels)
+    cdef np.ndarray[INT, ndim=1] peak = - np.ones(nlabels, np.int)
+    for i in range(n):
+        l = labels[i]
+        if l < 0:
+            continue
+        size[l] += 1
+        mass[l] += values[i]
+        if peak[l] < 0 or values[i] > values[peak[l]]:
+            peak[l] = i
+    return size, mass, peak
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tfce(np.ndarray[DOUBLE, ndim=1] field,
+         np.ndarray[INT, ndim=1] idx,
+         np.ndarray[INT, ndim=1] neighb,
+         double dh, double E, double H):
+    """ Threshold-free cluster enhancement of a field defined on a graph
+    given in compact form (idx, neighb), see WeightedGraph.compact_neighb
+
+    The enhanced value of a vertex is the sum over thresholds h = dh,
+    2 dh, ... below its field value of e(h) ** E * h ** H * dh, where
+    e(h) is the size of its connected component above h.  Thresholds are
+    visited in decreasing order and components are merged incrementally;
+    each component accumulates its contribution lazily, only when it
+    changes, and vertices inherit the contributions of the components
+    they are merged into.
+    """
+    cdef int n = field.shape[0]
+    cdef int i, j, v, w, a, b, r, nadded = 0, norder = 0
+    cdef INT kk, K
+    cdef np.ndarray[INT, ndim=1] order = np.argsort(- field)
+    cdef np.ndarray[INT, ndim=1] parent = np.arange(n)
+    cdef np.ndarray[INT, ndim=1] tparent = np.arange(n)
+    cdef np.ndarray[INT, ndim=1] merged = np.zeros(n, np.int)
+    cdef np.ndarray[INT, ndim=1] size = np.zeros(n, np.int)
+    cdef np.ndarray[INT, ndim=1] last = np.zeros(n, np.int)
+    cdef np.ndarray[INT, ndim=1] added = np.zeros(n, np.int)
+    cdef np.ndarray[DOUBLE, ndim=1] acc = np.zeros(n)
+    cdef np.ndarray[DOUBLE, ndim=1] res = np.zeros(n)
+    cdef np.ndarray[DOUBLE, ndim=1] C
+    cdef INT* p = <INT*> parent.data
+    if n == 0 or dh <= 0:
+        return res
+    K = <INT> (field[order[0]] / dh)
+    if K < 1:
+        return res
+    # C[k] = sum of h ** H * dh for h = dh .. k * dh
+    C = np.hstack((0, np.cumsum((dh * np.arange(1, K + 1)) ** H * dh)))
+    for kk in range(K, 0, -1):
+        while nadded < n and field[order[nadded]] >= kk * dh:
+            v = order[nadded]
+            nadded += 1
+            added[v] = 1
+            size[v] = 1
+            last[v] = kk
+            for j in range(idx[v], idx[v + 1]):
+                w = neighb[j]
+                if not added[w]:
+                    continue
+                a = _find(p, v)
+                b = _find(p, w)
+                if a == b:
+                    continue
+                # flush the pending contributions of both components
+                acc[a] += size[a] ** E * (C[last[a]] - C[kk])
+                acc[b] += size[b] ** E * (C[last[b]] - C[kk])
+                if size[a] > size[b]:
+                    a, b = b, a
+                # a is merged into b
+                acc[a] -= acc[b]
+                parent[a] = b
+                tparent[a] = b
+                merged[norder] = a
+                norder += 1
+                size[b] += size[a]
+                last[b] = kk
+    # flush the remaining components down to the lowest threshold
+    for i in range(nadded):
+        v = order[i]
+        if parent[v] == v:
+            acc[v] += size[v] ** E * C[last[v]]
+            res[v] = acc[v]
+    for i in range(norder - 1, -1, -1):
+        a = merged[i]
+        res[a] = acc[a] + res[tparent[a]]
+    return res
+
+
+cdef inline bint _heap_less(DOUBLE* key, INT* vertex, INT a, INT b) nogil:
+    # lexicographic order on (key, vertex), as for heapq tuples
+    return key[a] < key[b] or (key[a] == key[b] and vertex[a] < vertex[b])
+
+
+cdef inline void _heap_swap(DOUBLE* key, INT* vertex, INT a, INT b) nogil:
+    cdef DOUBLE k = key[a]
+    cdef INT v = vertex[a]
+    key[a], vertex[a] = key[b], vertex[b]
+    key[b], vertex[b] = k, v
+
+
+cdef inline INT _heap_push(DOUBLE* key, INT* vertex, INT size, DOUBLE k,
+                           INT v) nogil:
+    cdef INT i = size, parent
+    key[i], vertex[i] = k, v
+    while i > 0:
+        parent = (i - 1) / 2
+        if not _heap_less(key, vertex, i, parent):
+            break
+        _heap_swap(key, vertex, i, parent)
+        i = parent
+    return size + 1
+
+
+cdef inline INT _heap_pop(DOUBLE* key, INT* vertex, INT size) nogil:
+    # moves the smallest item to position size - 1
+    cdef INT i = 0, child
+    size -= 1
+    _heap_swap(key, vertex, 0, size)
+    while True:
+        child = 2 * i + 1
+        if child >= size:
+            break
+        if child + 1 < size and _heap_less(key, vertex, child + 1, child):
+            child += 1
+        if not _heap_less(key, vertex, child, i):
+            break
+        _heap_swap(key, vertex, i, child)
+        i = child
+    return size
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _dijkstra(INT V, INT* idx, INT* neighb, DOUBLE* weight,
+                    INT* seeds, INT nseeds, double radius, DOUBLE* dist,
+                    INT* label, DOUBLE* key, INT* vertex, char* done) nogil:
+    # multi-source Dijkstra with a binary heap and lazy deletion; key and
+    # vertex need room for nseeds + E items. label may be NULL
+    cdef INT i, j, v, w, size = 0
+    cdef DOUBLE d, nd
+    for i in range(V):
+        dist[i] = INFINITY
+        done[i] = 0
+    for i in range(nseeds):
+        v = seeds[i]
+        dist[v] = 0
+        if label != NULL:
+            label[v] = i
+        size = _heap_push(key, vertex, size, 0, v)
+    while size > 0:
+        size = _heap_pop(key, vertex, size)
+        d, v = key[size], vertex[size]
+        if done[v]:
+            continue
+        done[v] = 1
+        for j in range(idx[v], idx[v + 1]):
+            w = neighb[j]
+            nd = d + weight[j]
+            if nd < dist[w] and nd <= radius:
+                dist[w] = nd
+                if label != NULL:
+                    label[w] = label[v]
+                size = _heap_push(key, vertex, size, nd, w)
+
+
+def _check_csr(idx, neighb, weight, seeds):
+    """ Contiguous copies of the compact graph and of the seeds
+    """
+    idx = np.ascontiguousarray(idx, np.int)
+    seeds = np.ascontiguousarray(np.ravel(seeds), np.int)
+    V = idx.shape[0] - 1
+    if seeds.shape[0] > 0 and ((seeds < 0).any() or (seeds >= V).any()):
+        raise ValueError('seeds should be in [0, %d)' % V)
+    return (idx, np.ascontiguousarray(neighb, np.int),
+            np.ascontiguousarray(weight, np.double), seeds)
+
+
+def dijkstra(idx, neighb, weight, seeds, double radius=np.inf,
+             return_label=False):
+    """ Geodesic distances from the nearest of the seeds on a graph given
+    in compact form (idx, neighb, weight), see WeightedGraph.compact_neighb
+
+    Vertices farther than radius from all the seeds are given an infinite
+    distance. If return_label is True, the index (within seeds) of the
+    nearest seed of each vertex is also returned, -1 for unreached ones.
+    The weights must be non-negative.
+    """
+    cdef np.ndarray[INT, ndim=1] _idx, _neighb, _seeds, label, vertex
+    cdef np.ndarray[DOUBLE, ndim=1] _weight, dist, key
+    cdef np.ndarray[np.int8_t, ndim=1] done
+    _idx, _neighb, _weight, _seeds = _check_csr(idx, neighb, weight, seeds)
+    cdef INT V = _idx.shape[0] - 1
+    dist = np.empty(V)
+    label = - np.ones(V, np.int)
+    key = np.empty(_neighb.shape[0] + _seeds.shape[0])
+    vertex = np.empty(_neighb.shape[0] + _seeds.shape[0], np.int)
+    done = np.empty(V, np.int8)
+    with nogil:
+        _dijkstra(V, <INT*> _idx.data, <INT*> _neighb.data,
+                  <DOUBLE*> _weight.data, <INT*> _seeds.data,
+                  _seeds.shape[0], radius, <DOUBLE*> dist.data,
+                  <INT*> label.data, <DOUBLE*> key.data,
+                  <INT*> vertex.data, <char*> done.data)
+    if return_label:
+        return dist, label
+    return dist
+
+
+cdef class _DijkstraRows:
+    """ Fills the rows start:stop of the (nseeds, V) distance array, one
+    Dijkstra per seed, without the GIL
+    """
+    cdef np.ndarray idx, neighb, weight, seeds, out
+    cdef double radius
+
+    def __init__(self, idx, neighb, weight, seeds, out, radius):
+        self.idx, self.neighb, self.weight = idx, neighb, weight
+        self.seeds, self.out, self.radius = seeds, out, radius
+
+    def __call__(self, start, stop):
+        cdef INT V = self.idx.shape[0] - 1
+        cdef INT i, E = self.neighb.shape[0]
+        cdef INT a = start, b = stop
+        cdef np.ndarray[DOUBLE, ndim=1] key = np.empty(E + 1)
+        cdef np.ndarray[INT, ndim=1] vertex = np.empty(E + 1, np.int)
+        cdef np.ndarray[np.int8_t, ndim=1] done = np.empty(V, np.int8)
+        cdef INT* idx = <INT*> self.idx.data
+        cdef INT* neighb = <INT*> self.neighb.data
+        cdef DOUBLE* weight = <DOUBLE*> self.weight.data
+        cdef INT* seeds = <INT*> self.seeds.data
+        cdef DOUBLE* out = <DOUBLE*> self.out.data
+        cdef DOUBLE* _key = <DOUBLE*> key.data
+        cdef INT* _vertex = <INT*> vertex.data
+        cdef char* _done = <char*> done.data
+        cdef double radius = self.radius
+        with nogil:
+            for i in range(a, b):
+                _dijkstra(V, idx, neighb, weight, seeds + i, 1, radius,
+                          out + i * V, NULL, _key, _vertex, _done)
+
+
+def dijkstra_batch(idx, neighb, weight, seeds, double radius=np.inf,
+                   out=None, nthreads=1):
+    """ Geodesic distances from each of the seeds on a graph given in
+    compact form (idx, neighb, weight), see WeightedGraph.compact_neighb
+
+    Returns an array of shape (nseeds, V), written in out if provided
+    (it should then be a C-contiguous double array). Distances larger
+    than radius are set to infinity. The seeds are shared between
+    `nthreads` threads.
+    """
+    idx, neighb, weight, seeds = _check_csr(idx, neighb, weight, seeds)
+    V = idx.shape[0] - 1
+    if out is None:
+        out = np.empty((seeds.shape[0], V))
+    elif (out.shape != (seeds.shape[0], V) or out.dtype != np.double
+          or not out.flags.c_contiguous):
+        raise ValueError('out should be a C-contiguous double array '
+                         'of shape (%d, %d)' % (seeds.shape[0], V))
+    run_threads(_DijkstraRows(idx, neighb, weight, seeds, out, radius),
+                seeds.shape[0], nthreads)
+    return out
+
+
+def lattice_offsets(int k=18):
+    """ Offsets of the 6, 18 or 26 neighbours of a point of the 3d grid,
+    in lexicographic order, and the corresponding edge lengths
+    """
+    offsets = np.array([(dx, dy, dz) for dx in (-1, 0, 1)
+                        for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                        if 0 < dx * dx + dy * dy + dz * dz <= {6: 1, 18: 2,
+                                                               26: 3}[k]],
+                       np.int)
+    return offsets, np.sqrt(np.sum(offsets ** 2, 1))
+
+
+def _lattice_strides(index, offsets):
+    # flat index shifts corresponding to the offsets
+    return np.ascontiguousarray(np.dot(offsets, np.array(index.strides) //
+                                       index.itemsize), np.int)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def lattice_neighbors(np.ndarray[INT, ndim=1] pos,
+                      np.ndarray[INT, ndim=3] index,
+                      np.ndarray offsets,
+                      np.ndarray[DOUBLE, ndim=1] lengths):
+    """ Compact representation (idx, neighb, weights) of the lattice graph,
+    see WeightedGraph.compact_neighb; the neighbours of each vertex are in
+    the order of the offsets, whose lengths are the weights.
+
+    pos are the flat positions of the vertices in the C-contiguous volume
+    index, that holds the vertex numbers and -1 outside of the vertex
+    set; index should have a margin of at least one -1 voxel.
+    """
+    cdef np.ndarray[INT, ndim=1] shifts = _lattice_strides(index, offsets)
+    cdef int n = pos.shape[0], ns = shifts.shape[0]
+    cdef int i, o, q = 0
+    cdef INT j
+    cdef INT* flat = <INT*> index.data
+    cdef np.ndarray[INT, ndim=1] idx = np.zeros(n + 1, np.int)
+    for i in range(n):
+        for o in range(ns):
+            if flat[pos[i] + shifts[o]] >= 0:
+                q += 1
+        idx[i + 1] = q
+    cdef np.ndarray[INT, ndim=1] neighb = np.zeros(q, np.int)
+    cdef np.ndarray[DOUBLE, ndim=1] weights = np.zeros(q)
+    q = 0
+    for i in range(n):
+        for o in range(ns):
+            j = flat[pos[i] + shifts[o]]
+            if j >= 0:
+                neighb[q] = j
+                weights[q] = lengths[o]
+                q += 1
+    return idx, neighb, weights
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def lattice_morphology(field,
+                       np.ndarray[INT, ndim=1] pos,
+                       np.ndarray[INT, ndim=3] index,
+                       np.ndarray offsets, int erode=0):
+    """ Dilation (maximum over the vertex and its neighbours) or erosion
+    (minimum over the neighbours only, the vertex value being kept for
+    isolated vertices) of a field of shape (n, dim) on the lattice, see
+    lattice_neighbors
+    """
+    cdef np.ndarray[INT, ndim=1] shifts = _lattice_strides(index, offsets)
+    cdef np.ndarray[DOUBLE, ndim=2] src = np.ascontiguousarray(field,
+                                                               np.double)
+    cdef np.ndarray[DOUBLE, ndim=2] res = src.copy()
+    cdef int n = pos.shape[0], ns = shifts.shape[0], dim = src.shape[1]
+    cdef int i, o, d, found
+    cdef INT j
+    cdef INT* flat = <INT*> index.data
+    cdef INT* shift = <INT*> shifts.data
+    cdef DOUBLE* f = <DOUBLE*> src.data
+    cdef DOUBLE* r = <DOUBLE*> res.data
+    cdef DOUBLE* fj
+    cdef DOUBLE* ri
+    for i in range(n):
+        found = 0
+        ri = r + i * dim
+        for o in range(ns):
+            j = flat[pos[i] + shift[o]]
+            if j < 0:
+                continue
+            fj = f + j * dim
+            if erode:
+                for d in range(dim):
+                    if not found or fj[d] < ri[d]:
+                        ri[d] = fj[d]
+            else:
+                for d in range(dim):
+                    if fj[d] > ri[d]:
+                        ri[d] = fj[d]
+            found = 1
+    return res
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def lattice_diffusion(np.ndarray[DOUBLE, ndim=2] field,
+                      np.ndarray[INT, ndim=1] pos,
+                      np.ndarray[INT, ndim=3] index,
+                      np.ndarray offsets,
+                      np.ndarray[DOUBLE, ndim=1] weights):
+    """ Product of the weighted adjacency matrix of the lattice with the
+    field, see lattice_neighbors
+    """
+    cdef np.ndarray[INT, ndim=1] shifts = _lattice_strides(index, offsets)
+    cdef int n = pos.shape[0], ns = shifts.shape[0], dim = field.shape[1]
+    cdef int i, o, d
+    cdef INT j
+    cdef INT* flat = <INT*> index.data
+    cdef np.ndarray[DOUBLE, ndim=2] res = np.zeros_like(field)
+    for i in range(n):
+        for o in range(ns):
+            j = flat[pos[i] + shifts[o]]
+            if j < 0:
+                continue
+            for d in range(dim):
+                res[i, d] += weights[o] * field[j, d]
+    return res
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def lattice_highest_neighbor(np.ndarray[DOUBLE, ndim=1] values,
+                             np.ndarray[INT, ndim=1] pos,
+                             np.ndarray[INT, ndim=3] index,
+                             np.ndarray offsets):
+    """ Index of the vertex with highest value among each vertex and its
+    neighbours on the lattice, the lowest index winning ties
+    """
+    cdef np.ndarray[INT, ndim=1] shifts = _lattice_strides(index, offsets)
+    cdef int n = pos.shape[0], ns = shifts.shape[0]
+    cdef int i, o
+    cdef INT j, best
+    cdef INT* flat = <INT*> index.data
+    cdef np.ndarray[INT, ndim=1] res = np.zeros(n, np.int)
+    for i in range(n):
+        best = i
+        for o in range(ns):
+            j = flat[pos[i] + shifts[o]]
+            if j < 0:
+                continue
+            if values[j] > values[best] or (values[j] == values[best]
+                                            and j < best):
+                best = j
+        res[i] = best
+    return res
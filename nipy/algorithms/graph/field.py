@@ -173,7 +173,7 @@ class Field(WeightedGraph):
                     dilation(self.field, idx, neighb)
         else:
             from scipy.sparse import dia_matrix
-            adj = self.to_coo_matrix() + dia_matrix(
+            adj = self.to_csr_matrix() + dia_matrix(
                 (np.ones(self.V), 0), (self.V, self.V))
             rows = adj.tolil().rows
             for i in range(nbiter):
@@ -195,7 +195,7 @@ class Field(WeightedGraph):
         from scipy.sparse import dia_matrix
         refdim = int(refdim)
         # add self-edges to avoid singularities, when taking the maximum
-        adj = self.to_coo_matrix() + dia_matrix(
+        adj = self.to_csr_matrix() + dia_matrix(
             (np.ones(self.V), 0), (self.V, self.V))
         rows = adj.tolil().rows
         hneighb = np.array([row[self.field[row].argmax()] for row in rows])
@@ -209,7 +209,7 @@ class Field(WeightedGraph):
         nbiter: int, optional, the number of iterations required
         """
         nbiter = int(nbiter)
-        lil = self.to_coo_matrix().tolil().rows.tolist()
+        lil = self.list_of_neighbors()
         for i in range(nbiter):
             nf = np.zeros_like(self.field)
             for k, neighbors in enumerate(lil):
@@ -297,7 +297,7 @@ class Field(WeightedGraph):
         The process is run for all the dimensions of the field
         """
         nbiter = int(nbiter)
-        adj = self.to_coo_matrix()
+        adj = self.to_csr_matrix()
         for i in range(nbiter):
             self.field = adj * self.field
 
@@ -387,7 +387,7 @@ class Field(WeightedGraph):
 
         # explore the subfield
         order = np.argsort(- initial_field)
-        rows = sf.to_coo_matrix().tolil().rows
+        rows = sf.list_of_neighbors()
         llabel = - np.ones(sf.V, np.int)
         parent, root =  np.arange(2 * self.V), np.arange(2 * self.V)
         # q will denote the region index
@@ -573,4 +573,8 @@ class Field(WeightedGraph):
             edges = np.array([[], []]).T
         else:
             edges = G.edges
-        return Field(G.V, edges, G.weights, field)
+        F = Field(G.V, edges, G.weights, field)
+        # F shares the edges and weights of G, hence its compact
+        # representation, which is checked against them before use
+        F._csr = getattr(G, '_csr', None)
+        return F
@@ -16,12 +16,21 @@ instantiate WeightedGraphs from data:
 - k nearest neighbours (where samples are rows of a 2D-array)
 - epsilon-neighbors (where sample rows of a 2D-array)
 - representation of the neighbors on a 3d grid (6-, 18- and 26-neighbors)
+- connected components of a set of 3d grid points, without building
+  the graph
 - Minimum Spanning Tree (where samples are rows of a 2D-array)
 
 Author: Bertrand Thirion, 2006--2011
 """
 import numpy as np
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.spatial import cKDTree
+
+from ._graph import grid_cc, cc_stats, dijkstra, dijkstra_batch
+
+# number of samples above which the neighbours graphs are built from a
+# kd-tree rather than from the dense distance matrix
+TREE_MIN_SAMPLES = 1000
 
 class Graph(object):
     """ Basic topological (non-weighted) directed Graph class
@@ -151,14 +160,7 @@ class Graph(object):
         -------
         label: array of shape(self.V), labelling of the vertices
         """
-        try:
-            from scipy.sparse import cs_graph_components
-            _, label = cs_graph_components(self.adjacency())
-        except:
-            pass
-        lil = self.to_coo_matrix().tolil().rows.tolist()
-        label = lil_cc(lil)
-        return label
+        return lil_cc(self.list_of_neighbors())
 
     def degrees(self):
         """Returns the degree of the graph vertices.
@@ -205,6 +207,11 @@ class Graph(object):
             sm = coo_matrix((self.V, self.V))
         return sm
 
+    def list_of_neighbors(self):
+        """ returns the set of neighbors of self as a list of arrays
+        """
+        return self.to_coo_matrix().tolil().rows.tolist()
+
     def show(self, ax=None):
         """Shows the graph as a planar one.
 
@@ -331,13 +338,66 @@ def mst(X):
     return WeightedGraph(n, edges, d)
 
 
-def knn(X, k=1):
+def _symmetric_wgraph(X, i, j, keep_zeros=False):
+    """ Returns the symmetric WeightedGraph with edges (i, j) and (j, i),
+    weighted by the euclidean distance between the corresponding rows of X
+
+    Duplicate edges are merged, self-loops removed, and the edges are
+    sorted as those of wgraph_from_adjacency(dense_distance_matrix).
+    Zero-length edges are dropped unless keep_zeros is True, in which case
+    they are given a tiny weight
+    """
+    n = X.shape[0]
+    i, j = np.asarray(i, np.int), np.asarray(j, np.int)
+    keys = np.unique(np.hstack((i * n + j, j * n + i)))
+    edges = np.vstack((keys // n, keys % n)).T
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    weights = np.sqrt(np.sum((X[edges[:, 0]] - X[edges[:, 1]]) ** 2, 1))
+    if keep_zeros:
+        weights = np.maximum(weights, 1.e-16)
+    else:
+        edges, weights = edges[weights > 0], weights[weights > 0]
+    return WeightedGraph(n, edges, weights)
+
+
+def _knn_tree(X, k):
+    """ kd-tree implementation of knn, see knn
+    """
+    n = X.shape[0]
+    dist, idx = cKDTree(X).query(X, min(k + 2, n))
+    dist, idx = np.reshape(dist, (n, -1)), np.reshape(idx, (n, -1))
+    if idx.shape[1] > k + 1:
+        # as in the brute force approach, the neighbours are the samples
+        # strictly closer than the (k + 1)-th neighbour
+        neighb = dist[:, :k + 1] < dist[:, k + 1:k + 2]
+        idx = idx[:, :k + 1]
+    else:
+        neighb = np.ones(idx.shape, np.bool)
+    i = np.repeat(np.arange(n), idx.shape[1]).reshape(idx.shape)
+    return _symmetric_wgraph(X, i[neighb], idx[neighb])
+
+
+def _eps_nn_tree(X, eps):
+    """ kd-tree implementation of eps_nn, see eps_nn
+    """
+    pairs = np.array(list(cKDTree(X).query_pairs(eps)), np.int)
+    pairs = np.reshape(pairs, (-1, 2))
+    dist = np.sqrt(np.sum((X[pairs[:, 0]] - X[pairs[:, 1]]) ** 2, 1))
+    pairs = pairs[dist < eps]
+    return _symmetric_wgraph(X, pairs[:, 0], pairs[:, 1], keep_zeros=True)
+
+
+def knn(X, k=1, method='auto'):
     """returns the k-nearest-neighbours graph of the data
 
     Parameters
     ----------
     X, array of shape (n_samples, n_features): the input data
     k, int, optional:  is the number of neighbours considered
+    method, string, optional: one of 'brute', which uses the dense
+            distance matrix, 'tree', which uses a kd-tree and does not
+            require O(n_samples ** 2) memory, or 'auto', which uses a kd-tree
+            for more than TREE_MIN_SAMPLES samples
 
     Returns
     -------
@@ -361,6 +421,11 @@ def knn(X, k=1):
     if np.isinf(k):
         raise ValueError('k is inf')
     k = min(k, X.shape[0] - 1)
+    if method not in ['auto', 'brute', 'tree']:
+        raise ValueError('unknown method %s' % method)
+    if method == 'tree' or (method == 'auto' and
+                            X.shape[0] > TREE_MIN_SAMPLES):
+        return _knn_tree(X, k)
 
     # create the distance matrix
     dist = euclidean_distance(X)
@@ -375,13 +440,14 @@ def knn(X, k=1):
     return wgraph_from_adjacency(dist)
 
 
-def eps_nn(X, eps=1.):
+def eps_nn(X, eps=1., method='auto'):
     """Returns the eps-nearest-neighbours graph of the data
 
     Parameters
     ----------
     X, array of shape (n_samples, n_features), input data
     eps, float, optional: the neighborhood width
+    method, string, optional: one of 'brute', 'tree' or 'auto', see knn
 
     Returns
     -------
@@ -398,6 +464,11 @@ def eps_nn(X, eps=1.):
         raise ValueError('eps is nan')
     if np.isinf(eps):
         raise ValueError('eps is inf')
+    if method not in ['auto', 'brute', 'tree']:
+        raise ValueError('unknown method %s' % method)
+    if method == 'tree' or (method == 'auto' and
+                            X.shape[0] > TREE_MIN_SAMPLES):
+        return _eps_nn_tree(X, eps)
     dist = euclidean_distance(X)
     dist = np.maximum(dist, 1.e-16)
     dist[dist >= eps] = 0
@@ -529,6 +600,54 @@ def wgraph_from_3d_grid(xyz, k=18):
     return WeightedGraph(xyz.shape[0], edges, d)
 
 
+def cc_from_3d_grid(xyz, k=18):
+    """Connected components of the three-dimensional coordinates set xyz
+    in the k-connectivity scheme
+
+    This gives the same result as wgraph_from_3d_grid(xyz, k).cc(), but
+    relies on union-find over the grid instead of building the graph
+
+    Parameters
+    ----------
+    xyz: array of shape (nsamples, 3) and type np.int,
+    k = 18: the number of neighbours considered. (6, 18 or 26)
+
+    Returns
+    -------
+    labels: array of shape (nsamples), the component labels, numbered by
+            order of first appearance in xyz
+    """
+    xyz = np.asarray(xyz)
+    if xyz.ndim != 2 or xyz.shape[1] != 3:
+        raise ValueError('xyz should have shape n * 3')
+    if k not in [6, 18, 26]:
+        raise ValueError('k should be equal to 6, 18 or 26')
+    return grid_cc(xyz.astype(np.int), k)
+
+
+def cc_summary(labels, values):
+    """Size, sum of values and peak of each connected component
+
+    Parameters
+    ----------
+    labels: array of shape (n), component labels; negative labels
+            are ignored
+    values: array of shape (n), values defined on the vertices
+
+    Returns
+    -------
+    size: array of shape (ncc), number of vertices of each component
+    mass: array of shape (ncc), sum of values over each component
+    peak: array of shape (ncc), index of the maximum value within each
+          component
+    """
+    labels = np.asarray(labels).astype(np.int)
+    values = np.asarray(values).astype(np.float64)
+    if labels.shape != values.shape:
+        raise ValueError('labels and values should have the same shape')
+    return cc_stats(labels.ravel(), values.ravel())
+
+
 def concatenate_graphs(G1, G2):
     """Returns  the concatenation of the graphs G1 and G2
     It is thus assumed that the vertices of G1 and G2 represent disjoint sets
@@ -567,6 +686,11 @@ class WeightedGraph(Graph):
     * edges (list, type=int, shape=(E,2)): edges as vertices id tuples
     * weights (list, type=int, shape=(E,)): weights / lengths
       of the graph's edges
+
+    The compact (CSR) representation of the graph is built once and cached
+    until the edges or weights are reset (set_edges, set_weights,
+    remove_edges or assignment); after modifying them in place, call
+    set_edges or set_weights to refresh it.
     """
 
     ### Constructor
@@ -603,6 +727,13 @@ class WeightedGraph(Graph):
             raise ValueError('The weight size is not the edges size')
         else:
             self.weights = np.reshape(weights, (self.E))
+        self._csr = None
+
+    def set_edges(self, edges):
+        """Sets the graph's edges, see Graph.set_edges
+        """
+        Graph.set_edges(self, edges)
+        self._csr = None
 
     def get_weights(self):
         return self.weights
@@ -649,60 +780,99 @@ class WeightedGraph(Graph):
         -------
         the resulting WeightedGraph
         """
-        A = self.to_coo_matrix().tocsr().tocoo()
+        A = self.to_csr_matrix().tocoo()
         return wgraph_from_coo_matrix(A)
 
-    def dijkstra(self, seed=0):
+    def dijkstra(self, seed=0, radius=np.inf):
         """ Returns all the [graph] geodesic distances starting from seed
 x
         Parameters
         ----------
         seed (int, >-1, <self.V) or array of shape(p)
              edge(s) from which the distances are computed
+        radius: float, optional,
+                the search is stopped at this distance from the seeds
 
         Returns
         -------
         dg: array of shape (self.V),
-            the graph distance dg from ant vertex to the nearest seed
+            the graph distance dg from ant vertex to the nearest seed,
+            np.inf for the vertices that are not reached
 
         Notes
         -----
         It is mandatory that the graph weights are non-negative
         """
-        import heapq
         if hasattr(seed, '__iter__') == False:
             seed = [seed]
+        self._check_positive_weights()
+        idx, neighb, weight = self.compact_neighb()
+        return dijkstra(idx, neighb, weight, seed, radius)
+
+    def _check_positive_weights(self):
+        """ Raises a ValueError if the weights are undefined or negative
+        """
         try:
             if (self.weights < 0).any():
                 raise ValueError('some weights are non-positive')
         except:
             raise ValueError('undefined weights')
-        dist, active = np.inf * np.ones(self.V), np.ones(self.V)
-        idx, neighb, weight = self.compact_neighb()
-        dist[seed] = 0
-        dg = zip(np.zeros_like(seed), seed)
-        heapq.heapify(dg)
-        for j in range(self.V):
-            end = False
-            while True:
-                if len(dg) == 0:
-                    end = True
-                    break
-                node = heapq.heappop(dg)
-                if active[node[1]]:
-                    break
-            if end:
-                break
-            dwin, win = node
-            active[win] = False
-            # the folllowing loop might be vectorized
-            l = neighb[idx[win]: idx[win + 1]]
-            newdist = dwin + weight[idx[win]: idx[win + 1]]
-            who = newdist < dist[l]
-            for  z in zip(newdist[who], l[who]):
-                heapq.heappush(dg, z)
-            dist[l[who]] = newdist[who]
-        return dist
+
+    def _compact(self):
+        """ Returns the cached compact representation of self, rebuilt
+        if the edges or weights have been reset since it was computed
+
+        Returns
+        -------
+        order: array of shape(self.E),
+               the permutation that sorts the edges of self
+        idx, neighb, weights: see compact_neighb
+        csr: the corresponding scipy.sparse.csr_matrix
+        """
+        cache = getattr(self, '_csr', None)
+        if (cache is None or cache[0] is not self.edges or
+            cache[1] is not self.weights):
+            if self.E > 0:
+                order = np.argsort(self.edges[:, 0] * float(self.V) +
+                                   self.edges[:, 1])
+            else:
+                order = np.zeros(0, np.int)
+            self._set_compact(order)
+        return self._csr[2:]
+
+    def _set_compact(self, order):
+        """ Caches the compact representation of self
+
+        Parameters
+        ----------
+        order: array of shape(self.E),
+               permutation that sorts the edges of self by origin,
+               then by destination vertex
+        """
+        if self.E > 0:
+            rows = self.edges[order, 0].astype(np.int)
+            neighb = self.edges[order, 1].astype(np.int)
+            weights = self.weights[order]
+            degree = np.bincount(rows, minlength=self.V)
+            duplicates = ((np.diff(rows) == 0) &
+                          (np.diff(neighb) == 0)).any()
+        else:
+            neighb, weights = np.zeros(0, np.int), np.zeros(0)
+            degree = np.zeros(self.V, np.int)
+            duplicates = False
+        idx = np.hstack((0, np.cumsum(degree))).astype(np.int)
+        csr = csr_matrix((weights, neighb, idx), shape=(self.V, self.V))
+        if duplicates:
+            # summing the duplicates works in place, on a copy so that the
+            # compact arrays are preserved
+            csr = csr.copy()
+            csr.sum_duplicates()
+        else:
+            # the indices are sorted and unique: let scipy know, to spare
+            # the format checks of the later conversions
+            csr.has_canonical_format = True
+        self._csr = (self.edges, self.weights, order, idx, neighb, weights,
+                     csr)
 
     def compact_neighb(self):
         """ returns a compact representation of self
@@ -714,15 +884,32 @@ x
              within neighb and weights
         neighb: array of shape(self.E), concatenated list of neighbors
         weights: array of shape(self.E), concatenated list of weights
+
+        Notes
+        -----
+        The arrays are cached and shared, they should not be modified
         """
-        order = np.argsort(self.edges[:, 0] * float(self.V) + self.edges[:, 1])
-        neighb = self.edges[order, 1].astype(np.int)
-        weights = self.weights[order]
-        degree, _ = self.degrees()
-        idx = np.hstack((0, np.cumsum(degree))).astype(np.int)
-        return idx, neighb, weights
+        return self._compact()[1:4]
+
+    def to_csr_matrix(self):
+        """ Return adjacency matrix as a (cached) csr sparse matrix
 
-    def floyd(self, seed=None):
+        Returns
+        -------
+        sp: scipy.sparse.csr_matrix instance, that encodes the adjacency
+            matrix of self; it is shared and should not be modified
+        """
+        return self._compact()[4]
+
+    def degrees(self):
+        """Returns the degree of the graph vertices, see Graph.degrees
+        """
+        idx, neighb, _ = self.compact_neighb()
+        right = np.diff(idx)
+        left = np.bincount(neighb, minlength=self.V)
+        return right, left
+
+    def floyd(self, seed=None, radius=np.inf, nthreads=1):
         """ Compute all the geodesic distances starting from seeds
 
         Parameters
@@ -730,11 +917,16 @@ x
         seed= None: array of shape (nbseed), type np.int
              vertex indexes from which the distances are computed
              if seed==None, then every edge is a seed point
+        radius: float, optional,
+                distances larger than radius are not computed (np.inf)
+        nthreads: int, optional,
+                  number of threads among which the seeds are shared
 
         Returns
         -------
         dg array of shape (nbseed, self.V)
-                the graph distance dg from each seed to any vertex
+                the graph distance dg from each seed to any vertex,
+                or of shape (self.V) if there is only one seed
 
         Notes
         -----
@@ -744,12 +936,12 @@ x
         """
         if seed == None:
             seed = np.arange(self.V)
-        dg = None
-        for s in seed:
-            if dg == None:
-                dg = self.dijkstra(s)
-            else:
-                dg = np.vstack((dg, self.dijkstra(s)))
+        self._check_positive_weights()
+        idx, neighb, weight = self.compact_neighb()
+        dg = dijkstra_batch(idx, neighb, weight, seed, radius,
+                            nthreads=nthreads)
+        if dg.shape[0] == 1:
+            return dg[0]
         return dg
 
     def normalize(self, c=0):
@@ -779,7 +971,7 @@ x
                 return np.zeros(self.V)
             else:
                 return np.zeros(self.V), np.zeros(self.V)
-        adj = self.to_coo_matrix().tocsr()
+        adj = self.to_csr_matrix()
         s1 = adj.sum(0)
         s2 = adj.sum(1)
         if c == 1:
@@ -884,42 +1076,11 @@ x
         -------
         labels: array of shape (self.V) the labelling of the vertices
         """
-        import heapq
         if hasattr(seed, '__iter__') == False:
             seed = [seed]
-        try:
-            if (self.weights < 0).any():
-                raise ValueError('some weights are non-positive')
-        except:
-            raise ValueError('undefined weights')
-        dist, active = np.inf * np.ones(self.V), np.ones(self.V)
-        label = - np.ones(self.V, np.int)
+        self._check_positive_weights()
         idx, neighb, weight = self.compact_neighb()
-        dist[seed] = 0
-        label[seed] = np.arange(len(seed))
-        dg = zip(np.zeros_like(seed), seed)
-        heapq.heapify(dg)
-        for j in range(self.V):
-            end = False
-            while True:
-                if len(dg) == 0:
-                    end = True
-                    break
-                node = heapq.heappop(dg)
-                if active[node[1]]:
-                    break
-            if end:
-                break
-            dwin, win = node
-            active[win] = False
-            # the folllowing loop might be vectorized
-            for i in range(idx[win], idx[win + 1]):
-                l, newdist = neighb[i], dwin + weight[i]
-                if  newdist < dist[l]:
-                    heapq.heappush(dg, (newdist, l))
-                    dist[l] = newdist
-                    label[l] = label[win]
-        return label
+        return dijkstra(idx, neighb, weight, seed, return_label=True)[1]
 
     def cliques(self):
         """ Extraction of the graphe cliques
@@ -1010,6 +1171,11 @@ x
             renumb = np.hstack((0, np.cumsum(valid > 0)))
             edges = renumb[edges]
             G = WeightedGraph(np.sum(valid > 0), edges, weights)
+            # the retained edges keep their relative order, hence the
+            # sorting permutation of G is that of self, restricted
+            order = self._compact()[0]
+            position = np.cumsum(win_edges) - 1
+            G._set_compact(position[order[win_edges[order]]])
         else:
             G = WeightedGraph(np.sum(valid > 0))
 
@@ -1196,11 +1362,12 @@ x
         self.E = int(valid.sum())
         self.edges = self.edges[valid != 0]
         self.weights = self.weights[valid != 0]
+        self._csr = None
 
     def list_of_neighbors(self):
         """ returns the set of neighbors of self as a list of arrays
         """
-        return self.to_coo_matrix().tolil().rows.tolist()
+        return self.to_csr_matrix().tolil().rows.tolist()
 
     def copy(self):
         """ returns a copy of self
@@ -1266,9 +1433,4 @@ x
         sp: scipy.sparse matrix instance
             that encodes the adjacency matrix of self
         """
-        if self.E > 0:
-            i, j = self.edges.T
-            sm = coo_matrix((self.weights, (i, j)), shape=(self.V, self.V))
-        else:
-            sm = coo_matrix((self.V, self.V))
-        return sm
+        return self.to_csr_matrix().tocoo()
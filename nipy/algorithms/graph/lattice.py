@@ -0,0 +1,224 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+This module implements the LatticeField class, i.e. a Field defined on a
+set of points of the 3d grid, in the 6-, 18- or 26-connectivity scheme.
+
+Unlike Field instances built with wgraph_from_3d_grid, the edges of the
+graph are not stored: only the grid coordinates and a volume that maps
+the grid to the vertex indexes are kept, and the neighbours are obtained
+by applying a stencil to this volume. The morphology (dilation, erosion,
+local maxima), diffusion, watershed and connected components computations
+are performed in this implicit form. The other Field methods rely on the
+edges, which are then built on demand.
+
+Author: Bertrand Thirion, 2006--2011
+"""
+import numpy as np
+
+from .graph import WeightedGraph, graph_3d_grid, cc_from_3d_grid
+from .field import Field
+from ._graph import (lattice_offsets, lattice_neighbors, lattice_morphology,
+                     lattice_diffusion, lattice_highest_neighbor)
+
+
+class LatticeField(Field):
+    """
+    Field defined on a set of points of the 3d grid, whose graph structure
+    (the k-neighbours system on the grid) is implicit.
+
+    The edges, weights and E attributes are read-only and only computed
+    when needed; the edges and weights are those of wgraph_from_3d_grid.
+    Use to_field to get an explicit Field instance that can be modified.
+    """
+
+    def __init__(self, xyz, k=18, field=None):
+        """
+        Parameters
+        ----------
+        xyz: array of shape (V, 3), the grid coordinates of the vertices
+        k: int, optional, the neighbouring system, equal to 6, 18 or 26
+        field=None: array of shape (V) or (V, dim), the field data itself
+        """
+        xyz = np.asarray(xyz)
+        if xyz.ndim != 2 or xyz.shape[1] != 3:
+            raise ValueError('xyz should have shape n * 3')
+        if k not in [6, 18, 26]:
+            raise ValueError('k should be equal to 6, 18 or 26')
+        V = xyz.shape[0]
+        if V < 1:
+            raise ValueError('cannot create graph with no vertex')
+        self.V = V
+        self.k = k
+        self.xyz = xyz.astype(np.int)
+        self.vertices = np.arange(self.V)
+        self._wgraph = None
+
+        # grid to vertex map, with a margin so that the stencils never
+        # leave the volume
+        lxyz = self.xyz - self.xyz.min(0) + 1
+        self._index = - np.ones(lxyz.max(0) + 2, np.int)
+        self._index[tuple(lxyz.T)] = np.arange(self.V)
+        if (np.sort(self._index[tuple(lxyz.T)]) != np.arange(self.V)).any():
+            raise ValueError('xyz should not contain duplicate points')
+        self._pos = np.ravel_multi_index(tuple(lxyz.T), self._index.shape)
+        self._offsets, self._lengths = lattice_offsets(k)
+
+        self.field = []
+        if field is not None:
+            self.set_field(field)
+
+    def _explicit(self):
+        """ Returns the WeightedGraph with the edges of self, built once
+        """
+        if self._wgraph is None:
+            if self.V > 1:
+                i, j, d = graph_3d_grid(self.xyz, self.k)
+                self._wgraph = WeightedGraph(
+                    self.V, np.vstack((i, j)).T, d)
+            else:
+                self._wgraph = WeightedGraph(self.V)
+        return self._wgraph
+
+    edges = property(lambda self: self._explicit().edges,
+                     doc="The edges of the graph, computed on demand")
+    weights = property(lambda self: self._explicit().weights,
+                       doc="The weights of the graph, computed on demand")
+    E = property(lambda self: self._explicit().E,
+                 doc="The number of edges, computed on demand")
+
+    def _check_field(self):
+        if np.size(self.field) == 0:
+            raise ValueError('No field has been defined so far')
+        if self.field.size == self.V:
+            self.field = self.field.reshape((self.V, 1))
+
+    def to_field(self):
+        """ Returns the explicit Field instance equivalent to self
+        """
+        G = self._explicit()
+        field = None
+        if np.size(self.field) > 0:
+            field = self.field.copy()
+        return Field(self.V, G.edges.copy(), G.weights.copy(), field)
+
+    def compact_neighb(self):
+        """ returns a compact representation of self, see
+        WeightedGraph.compact_neighb
+        """
+        idx, neighb, weights = lattice_neighbors(
+            self._pos, self._index, self._offsets, self._lengths)
+        order = np.lexsort((neighb, np.repeat(self.vertices, np.diff(idx))))
+        return idx, neighb[order], weights[order]
+
+    def list_of_neighbors(self):
+        """ returns the set of neighbors of self as a list of arrays
+        """
+        idx, neighb, _ = self.compact_neighb()
+        return [neighb[idx[i]:idx[i + 1]] for i in range(self.V)]
+
+    def cc(self):
+        """Compte the different connected components of the graph.
+
+        Returns
+        -------
+        label: array of shape(self.V), labelling of the vertices
+        """
+        return cc_from_3d_grid(self.xyz, self.k)
+
+    def dilation(self, nbiter=1, fast=True):
+        """Morphological dilation of the field data, changed in place
+
+        Parameters
+        ----------
+        nbiter: int, optional, the number of iterations required
+        """
+        self._check_field()
+        field = np.asarray(self.field, np.float64)
+        for i in range(int(nbiter)):
+            field = lattice_morphology(field, self._pos, self._index,
+                                       self._offsets)
+        self.field = field.astype(self.field.dtype)
+
+    def erosion(self, nbiter=1):
+        """Morphological erosion of the field, changed in place
+
+        Parameters
+        ----------
+        nbiter: int, optional, the number of iterations required
+
+        Notes
+        -----
+        As in Field.erosion, the minimum is taken over the neighbours of
+        each vertex only; isolated vertices keep their value
+        """
+        self._check_field()
+        field = np.asarray(self.field, np.float64)
+        for i in range(int(nbiter)):
+            field = lattice_morphology(field, self._pos, self._index,
+                                       self._offsets, 1)
+        self.field = field.astype(self.field.dtype)
+
+    def diffusion(self, nbiter=1):
+        """diffusion of the field data in the weighted graph structure
+        self.field is changed inplace
+
+        Parameters
+        ----------
+        nbiter: int, optional the number of iterations required
+        """
+        self._check_field()
+        field = np.asarray(self.field, np.float64)
+        for i in range(int(nbiter)):
+            field = lattice_diffusion(field, self._pos, self._index,
+                                      self._offsets, self._lengths)
+        self.field = field
+
+    def highest_neighbor(self, refdim=0):
+        """Computes the neighbor with highest field value along refdim
+
+        Parameters
+        ----------
+        refdim: int, optional,
+                the dimension of the field under consideration
+
+        Returns
+        -------
+        hneighb: array of shape(self.V),
+                 index of the neighbor with highest value
+        """
+        self._check_field()
+        values = self.field[:, int(refdim)].astype(np.float64)
+        return lattice_highest_neighbor(values, self._pos, self._index,
+                                        self._offsets)
+
+    def copy(self):
+        """ copy function
+        """
+        field = None
+        if np.size(self.field) > 0:
+            field = self.field.copy()
+        return LatticeField(self.xyz.copy(), self.k, field)
+
+    def subfield(self, valid):
+        """Returns a subfield of self, with only vertices such that valid > 0
+
+        Parameters
+        ----------
+        valid: array of shape (self.V),
+               nonzero for vertices to be retained
+
+        Returns
+        -------
+        F: LatticeField instance, the desired subfield of self,
+           None if sum(valid) == 0
+        """
+        if np.size(valid) != self.V:
+            raise ValueError("incompatible size for self anf valid")
+        valid = np.ravel(valid) > 0
+        if valid.sum() == 0:
+            return None
+        field = None
+        if np.size(self.field) > 0:
+            field = self.field[valid]
+        return LatticeField(self.xyz[valid], self.k, field)
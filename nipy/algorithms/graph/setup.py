@@ -7,7 +7,7 @@ def configuration(parent_package='', top_path=None):
     config = Configuration('graph', parent_package, top_path)
     config.add_subpackage('tests')
     config.add_extension('_graph',
-                         sources=['_graph.c'],
+                         sources=['_graph.pyx'],
                          include_dirs=[numpy.get_include()])
     return config
 
@@ -8,7 +8,8 @@ from nose.tools import assert_true, assert_equal
 
 from ..graph import (WeightedGraph, complete_graph, mst, knn, eps_nn, 
                      wgraph_from_adjacency, wgraph_from_coo_matrix, 
-                     concatenate_graphs, wgraph_from_3d_grid)
+                     concatenate_graphs, wgraph_from_3d_grid, cc_from_3d_grid,
+                     cc_summary)
 
 
 
@@ -49,6 +50,27 @@ def test_knn_1():
     A = G.get_edges()[:, 0]
     assert_equal(np.shape(A)[0], 14)
 
+
+def test_knn_tree():
+    """ check that the kd-tree and brute force knn graphs are equal
+    """
+    x = nr.randn(200, 3)
+    for k in [1, 5, 198]:
+        G1 = knn(x, k, method='brute')
+        G2 = knn(x, k, method='tree')
+        assert_array_equal(G1.edges, G2.edges)
+        assert_array_almost_equal(G1.weights, G2.weights)
+
+
+def test_eps_tree():
+    """ check that the kd-tree and brute force eps graphs are equal
+    """
+    x = nr.randn(200, 3)
+    G1 = eps_nn(x, .5, method='brute')
+    G2 = eps_nn(x, .5, method='tree')
+    assert_array_equal(G1.edges, G2.edges)
+    assert_array_almost_equal(G1.weights, G2.weights)
+
     
 def test_set_euclidian():
     G, x = basic_graph_2()
@@ -192,6 +214,25 @@ def test_grid_3d_7():
     assert_equal((adj - adj.T).nnz, 0)
         
     
+def test_cc_from_3d_grid():
+    """ Check that grid labelling matches the connected components of
+    the grid graph
+    """
+    xyz = np.array(np.where(np.random.rand(8, 7, 6) > 0.6)).T
+    for k in [6, 18, 26]:
+        assert_array_equal(cc_from_3d_grid(xyz, k),
+                           wgraph_from_3d_grid(xyz, k).cc())
+
+
+def test_cc_summary():
+    labels = np.array([0, 1, -1, 0, 1, 1])
+    values = np.array([1., 2., 10., 3., 5., 4.])
+    size, mass, peak = cc_summary(labels, values)
+    assert_array_equal(size, [2, 3])
+    assert_array_almost_equal(mass, [4., 11.])
+    assert_array_equal(peak, [3, 4])
+
+
 def test_cut_redundancies():
     G = basic_graph()
     e = G.E
@@ -286,6 +327,16 @@ def test_dijkstra2():
     assert_true(np.abs(l[10] - 20 * np.sin(np.pi / 20)) < 1.e-7)
 
 
+def test_dijkstra_radius():
+    """ Test dijkstra's algorithm with a bounded search radius
+    """
+    G = basic_graph()
+    l = G.dijkstra(0)
+    lr = G.dijkstra(0, radius=1.)
+    assert_array_equal(lr[l <= 1], l[l <= 1])
+    assert_true(np.isinf(lr[l > 1]).all())
+
+
 def test_compact_representation():
     """ Test that the compact representation of the graph is indeed correct
     """
@@ -298,6 +349,44 @@ def test_compact_representation():
     assert_equal(len(we), G.E)
 
 
+def test_compact_cache():
+    """ Test that the cached compact representation follows the changes
+    of the graph
+    """
+    G = basic_graph()
+    idx, ne, we = G.compact_neighb()
+    assert_true(G.compact_neighb()[1] is ne)
+    G.set_weights(2 * G.weights)
+    assert_array_equal(G.compact_neighb()[2], 2 * we)
+    assert_array_equal(G.to_csr_matrix().toarray(),
+                       G.to_coo_matrix().toarray())
+    G.weights = G.weights / 2
+    assert_array_equal(G.compact_neighb()[2], we)
+    G.remove_edges(G.edges[:, 0] != 0)
+    idx, ne, we = G.compact_neighb()
+    assert_equal(idx[1], 0)
+    assert_equal(len(ne), G.E)
+    assert_array_equal(G.to_csr_matrix().toarray(),
+                       G.to_coo_matrix().toarray())
+
+
+def test_subgraph_compact():
+    """ Test the compact representation inherited by the subgraphs
+    """
+    G = knn(nr.randn(30, 2), 5)
+    G.edges = G.edges[nr.permutation(G.E)]
+    valid = nr.rand(G.V) > .3
+    sg = G.subgraph(valid)
+    idx, ne, we = sg.compact_neighb()
+    sg._csr = None
+    idx_, ne_, we_ = sg.compact_neighb()
+    assert_array_equal(idx, idx_)
+    assert_array_equal(ne, ne_)
+    assert_array_equal(we, we_)
+    assert_array_equal(sg.to_csr_matrix().toarray(),
+                       G.to_coo_matrix().toarray()[valid][:, valid])
+
+
 def test_floyd_1():
     """ Test Floyd's algo without seed
     """
@@ -307,6 +396,18 @@ def test_floyd_1():
         plop = np.abs(np.diag(l, i) - 2 * i * np.sin(2 * np.pi / 40))
         assert_true(plop.max() < 1.e-4)
         
+def test_floyd_nthreads():
+    """ Test Floyd's algo with several threads and a bounded radius
+    """
+    G = basic_graph()
+    l = G.floyd()
+    assert_array_equal(G.floyd(nthreads=3), l)
+    assert_array_equal(G.floyd(np.arange(5), nthreads=2), l[:5])
+    lr = G.floyd(radius=1.)
+    assert_array_equal(lr[l <= 1], l[l <= 1])
+    assert_true(np.isinf(lr[l > 1]).all())
+    
+
 def test_floyd_2():
     """ Test Floyd's algo, with seed
     """
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import numpy as np
+import numpy.random as nr
+
+from ..field import field_from_graph_and_data
+from ..graph import wgraph_from_3d_grid
+from ..lattice import LatticeField
+
+from nose.tools import assert_true, assert_equal
+
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+
+
+def basic_fields(k=18, dim=2, nx=8, ny=9, nz=7):
+    """ the same field on an irregular grid domain, as a LatticeField and
+    as an explicit Field
+    """
+    xyz = np.reshape(np.indices((nx, ny, nz)), (3, nx * ny * nz)).T
+    xyz = xyz[nr.rand(xyz.shape[0]) > .1]
+    data = nr.randn(xyz.shape[0], dim)
+    lf = LatticeField(xyz, k, data.copy())
+    f = field_from_graph_and_data(wgraph_from_3d_grid(xyz, k), data.copy())
+    return lf, f
+
+
+def test_lattice_graph():
+    """ the implicit graph is that of wgraph_from_3d_grid
+    """
+    for k in [6, 18, 26]:
+        lf, f = basic_fields(k)
+        assert_equal(lf.E, f.E)
+        assert_array_equal(lf.edges, f.edges)
+        for a, b in zip(lf.compact_neighb(), f.compact_neighb()):
+            assert_array_equal(a, b)
+        assert_array_equal(lf.cc(), f.cc())
+
+
+def test_lattice_morphology():
+    """ dilation, erosion and diffusion are those of the explicit field
+    """
+    for k in [6, 18, 26]:
+        lf, f = basic_fields(k)
+        lf.dilation(2)
+        f.dilation(2)
+        assert_array_equal(lf.field, f.field)
+        lf.erosion(2)
+        f.erosion(2)
+        assert_array_equal(lf.field, f.field)
+        lf.diffusion(2)
+        f.diffusion(2)
+        assert_array_almost_equal(lf.field, f.field)
+
+
+def test_lattice_maxima():
+    """ local maxima, watershed and bifurcations are those of the explicit
+    field
+    """
+    lf, f = basic_fields(dim=1)
+    for a, b in zip(lf.get_local_maxima(th=0), f.get_local_maxima(th=0)):
+        assert_array_equal(a, b)
+    for a, b in zip(lf.custom_watershed(0, 0), f.custom_watershed(0, 0)):
+        assert_array_equal(a, b)
+    for a, b in zip(lf.threshold_bifurcations(0, 0),
+                    f.threshold_bifurcations(0, 0)):
+        assert_array_equal(a, b)
+    sf = lf.subfield(lf.field[:, 0] > 0)
+    assert_true(isinstance(sf, LatticeField))
+    assert_equal(sf.V, (lf.field[:, 0] > 0).sum())
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(argv=['', __file__])
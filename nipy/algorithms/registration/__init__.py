@@ -6,9 +6,10 @@ from .histogram_registration import (HistogramRegistration, clamp,
 from .affine import (threshold, rotation_mat2vec, rotation_vec2mat, to_matrix44,
                      preconditioner, inverse_affine, subgrid_affine, Affine,
                      Affine2D, Rigid, Rigid2D, Similarity, Similarity2D,
-                     affine_transforms)
+                     affine_transforms, apply_affines)
 from .groupwise_registration import (interp_slice_order, scanner_coords,
-                                     make_grid, Image4d, Realign4dAlgorithm,
+                                     multiple_scanner_coords, make_grid,
+                                     Image4d, Realign4dAlgorithm,
                                      resample4d, adjust_subsampling,
                                      single_run_realign4d, realign4d, Realign4d,
                                      FmriRealign4d)
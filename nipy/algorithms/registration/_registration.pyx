@@ -12,7 +12,7 @@ __version__ = '0.3'
 # Includes
 from numpy cimport (import_array, ndarray, flatiter, broadcast, 
                     PyArray_MultiIterNew, PyArray_MultiIter_DATA, 
-                    PyArray_MultiIter_NEXT)
+                    PyArray_MultiIter_NEXT, PyArrayObject, npy_intp)
 
 
 # Externals
@@ -25,22 +25,32 @@ cdef extern from "joint_histogram.h":
 
 cdef extern from "cubic_spline.h":
     void cubic_spline_import_array()
-    void cubic_spline_transform(ndarray res, ndarray src)
     double cubic_spline_sample1d(double x, ndarray coef, 
                                  int mode) 
     double cubic_spline_sample2d(double x, double y, ndarray coef, 
                                  int mode_x, int mode_y) 
-    double cubic_spline_sample3d(double x, double y, double z, ndarray coef,
-                                 int mode_x, int mode_y, int mode_z) 
-    double cubic_spline_sample4d(double x, double y, double z, double t, ndarray coef, 
-                                 int mode_x, int mode_y, int mode_z, int mode_t)
-    void cubic_spline_resample3d(ndarray im_resampled, ndarray im, 
-                                 double* Tvox, int cast_integer,
-                                 int mode_x, int mode_y, int mode_z)
+    int cubic_spline_transform_lines(double* data, npy_intp* offsets,
+                                     npy_intp nlines, unsigned int dim,
+                                     unsigned int stride) nogil
+    void cubic_spline_sample3d_array(double* res, double* x, double* y,
+                                     double* z, npy_intp size,
+                                     PyArrayObject* coef,
+                                     int mode_x, int mode_y, int mode_z) nogil
+    void cubic_spline_sample4d_array(double* res, double* x, double* y,
+                                     double* z, double* t, npy_intp size,
+                                     PyArrayObject* coef, int mode_x,
+                                     int mode_y, int mode_z, int mode_t) nogil
+    void cubic_spline_resample3d_range(double* res, npy_intp start,
+                                       npy_intp stop, unsigned int dimY,
+                                       unsigned int dimZ, PyArrayObject* coef,
+                                       double* Tvox, int cast_integer,
+                                       int mode_x, int mode_y, int mode_z) nogil
 
 cdef extern from "polyaffine.h": 
     void polyaffine_import_array()
     void apply_polyaffine(ndarray XYZ, ndarray Centers, ndarray Affines, ndarray Sigma)
+    int apply_polyaffine_truncated(ndarray XYZ, ndarray Centers, ndarray Affines,
+                                   ndarray Sigma, double cutoff)
 
 
 # Initialize numpy
@@ -50,9 +60,15 @@ polyaffine_import_array()
 import_array()
 import numpy as np
 
+from nipy.utils.threads import run_threads
+
 # Globals
 modes = {'zero': 0, 'nearest': 1, 'reflect': 2}
 
+# Number of values computed at once by the spline workers when the
+# output is not a double array
+CAST_BLOCK_SIZE = 8192
+
 
 def _joint_histogram(ndarray H, flatiter iterI, ndarray imJ, ndarray Tvox, long interp):
     """
@@ -91,15 +107,76 @@ def _L1_moments(ndarray H):
     return n[0], median[0], dev[0]
 
 
-def _cspline_transform(ndarray x):
-    c = np.zeros([x.shape[i] for i in range(x.ndim)], dtype=np.double)
-    cubic_spline_transform(c, x)
+cdef class _SplineTransformLines:
+    """
+    Apply the 1d cubic spline transform to a subset of the lines of a
+    double array along a given axis.
+    """
+    cdef ndarray data, offsets
+    cdef unsigned int dim, stride
+
+    def __init__(self, ndarray data, ndarray offsets, unsigned int dim,
+                 unsigned int stride):
+        self.data = data
+        self.offsets = offsets
+        self.dim = dim
+        self.stride = stride
+
+    def __call__(self, npy_intp start, npy_intp stop):
+        cdef double* data = <double*>self.data.data
+        cdef npy_intp* offsets = <npy_intp*>self.offsets.data + start
+        cdef npy_intp nlines = stop - start
+        cdef unsigned int dim = self.dim, stride = self.stride
+        cdef int ret
+        with nogil:
+            ret = cubic_spline_transform_lines(data, offsets, nlines, dim,
+                                               stride)
+        if ret < 0:
+            raise MemoryError('Could not allocate cubic spline buffer')
+
+
+def _line_offsets(ndarray x, int axis):
+    """
+    Offsets, in number of items, of the first element of every line of
+    the C-contiguous array `x` along `axis`.
+    """
+    offsets = np.zeros(1, dtype=np.intp)
+    for i in range(x.ndim):
+        if i == axis:
+            continue
+        steps = np.arange(x.shape[i], dtype=np.intp) * (x.strides[i] // x.itemsize)
+        offsets = (offsets[:, None] + steps).ravel()
+    return offsets
+
+
+def _cspline_transform(ndarray x, nthreads=1):
+    """
+    Compute the cubic spline coefficients of an array `x` of arbitrary
+    dimension. The separable transform is computed along each axis in
+    turn, distributing the independent lines over `nthreads` threads.
+    """
+    cdef ndarray c = np.array(x, dtype=np.double, order='C')
+    cdef int axis
+    for axis in range(c.ndim):
+        offsets = _line_offsets(c, axis)
+        worker = _SplineTransformLines(c, offsets, c.shape[axis],
+                                       c.strides[axis] // c.itemsize)
+        run_threads(worker, offsets.size, nthreads)
     return c
 
 cdef ndarray _reshaped_double(object in_arr, ndarray sh_arr):
     shape = [sh_arr.shape[i] for i in range(sh_arr.ndim)]
     return np.reshape(in_arr, shape).astype(np.double)
 
+cdef ndarray _contiguous_double(object in_arr, ndarray sh_arr):
+    shape = [sh_arr.shape[i] for i in range(sh_arr.ndim)]
+    return np.ascontiguousarray(np.reshape(in_arr, shape), dtype=np.double)
+
+cdef ndarray _output_buffer(ndarray R):
+    if R.flags['C_CONTIGUOUS']:
+        return R
+    return np.empty([R.shape[i] for i in range(R.ndim)], dtype=R.dtype)
+
 def _cspline_sample1d(ndarray R, ndarray C, X=0, mode='zero'):
     cdef double *r, *x
     cdef broadcast multi
@@ -127,49 +204,157 @@ def _cspline_sample2d(ndarray R, ndarray C, X=0, Y=0,
         PyArray_MultiIter_NEXT(multi)
     return R
 
+cdef class _SplineOutput:
+    """
+    Compute double values at a range of flat indices of a C-contiguous
+    output array of any dtype. Double outputs are written in place;
+    other outputs are filled through a buffer of CAST_BLOCK_SIZE
+    doubles, so that no double copy of the whole output is needed.
+    """
+    cdef ndarray r, flat
+
+    def __init__(self, ndarray r):
+        self.r = r
+        self.flat = r.reshape(-1)
+
+    cdef void fill(self, double* res, npy_intp start, npy_intp stop) nogil:
+        # write the values at flat indices [start, stop) into res
+        pass
+
+    def __call__(self, npy_intp start, npy_intp stop):
+        cdef double* res
+        cdef npy_intp b0, b1, block = CAST_BLOCK_SIZE
+        if self.r.dtype == np.double:
+            res = <double*>self.r.data + start
+            with nogil:
+                self.fill(res, start, stop)
+            return
+        buf = np.empty(min(block, stop - start), dtype=np.double)
+        res = <double*>(<ndarray>buf).data
+        b0 = start
+        while b0 < stop:
+            b1 = min(b0 + block, stop)
+            with nogil:
+                self.fill(res, b0, b1)
+            self.flat[b0:b1] = buf[:b1 - b0]
+            b0 = b1
+
+
+cdef class _SplineSample3d(_SplineOutput):
+    """
+    Sample a 3d spline at points indexed by a range of flat indices
+    into contiguous coordinate buffers.
+    """
+    cdef ndarray x, y, z, coef
+    cdef int mx, my, mz
+
+    def __init__(self, ndarray r, ndarray x, ndarray y, ndarray z,
+                 ndarray coef, int mx, int my, int mz):
+        _SplineOutput.__init__(self, r)
+        self.x, self.y, self.z = x, y, z
+        self.coef = coef
+        self.mx, self.my, self.mz = mx, my, mz
+
+    cdef void fill(self, double* res, npy_intp start, npy_intp stop) nogil:
+        cubic_spline_sample3d_array(res, <double*>self.x.data + start,
+                                    <double*>self.y.data + start,
+                                    <double*>self.z.data + start,
+                                    stop - start,
+                                    <PyArrayObject*>self.coef,
+                                    self.mx, self.my, self.mz)
+
+
+cdef class _SplineSample4d(_SplineOutput):
+    """
+    Sample a 4d spline at points indexed by a range of flat indices
+    into contiguous coordinate buffers.
+    """
+    cdef ndarray x, y, z, t, coef
+    cdef int mx, my, mz, mt
+
+    def __init__(self, ndarray r, ndarray x, ndarray y, ndarray z,
+                 ndarray t, ndarray coef, int mx, int my, int mz, int mt):
+        _SplineOutput.__init__(self, r)
+        self.x, self.y, self.z, self.t = x, y, z, t
+        self.coef = coef
+        self.mx, self.my, self.mz, self.mt = mx, my, mz, mt
+
+    cdef void fill(self, double* res, npy_intp start, npy_intp stop) nogil:
+        cubic_spline_sample4d_array(res, <double*>self.x.data + start,
+                                    <double*>self.y.data + start,
+                                    <double*>self.z.data + start,
+                                    <double*>self.t.data + start,
+                                    stop - start,
+                                    <PyArrayObject*>self.coef,
+                                    self.mx, self.my, self.mz, self.mt)
+
+
+cdef class _SplineResample3d(_SplineOutput):
+    """
+    Resample a 3d spline through an affine transform on a range of
+    flat indices of the output grid.
+    """
+    cdef ndarray coef, Tvox
+    cdef int cast_integer, mx, my, mz
+    cdef unsigned int dimY, dimZ
+
+    def __init__(self, ndarray r, ndarray coef, ndarray Tvox,
+                 int cast_integer, int mx, int my, int mz):
+        _SplineOutput.__init__(self, r)
+        self.coef = coef
+        self.Tvox = Tvox
+        self.cast_integer = cast_integer
+        self.mx, self.my, self.mz = mx, my, mz
+        self.dimY, self.dimZ = r.shape[1], r.shape[2]
+
+    cdef void fill(self, double* res, npy_intp start, npy_intp stop) nogil:
+        cubic_spline_resample3d_range(res, start, stop, self.dimY, self.dimZ,
+                                      <PyArrayObject*>self.coef,
+                                      <double*>self.Tvox.data,
+                                      self.cast_integer,
+                                      self.mx, self.my, self.mz)
+
+
 def _cspline_sample3d(ndarray R, ndarray C, X=0, Y=0, Z=0, 
-                      mx='zero', my='zero', mz='zero'):
-    cdef double *r, *x, *y, *z
-    cdef broadcast multi
-    Xa = _reshaped_double(X, R)
-    Ya = _reshaped_double(Y, R)
-    Za = _reshaped_double(Z, R)
-    multi = PyArray_MultiIterNew(4, <void*>R, <void*>Xa, <void*>Ya, <void*>Za)
-    while(multi.index < multi.size):
-        r = <double*>PyArray_MultiIter_DATA(multi, 0)
-        x = <double*>PyArray_MultiIter_DATA(multi, 1)
-        y = <double*>PyArray_MultiIter_DATA(multi, 2)
-        z = <double*>PyArray_MultiIter_DATA(multi, 3)
-        r[0] = cubic_spline_sample3d(x[0], y[0], z[0], C, modes[mx], modes[my], modes[mz])
-        PyArray_MultiIter_NEXT(multi)
+                      mx='zero', my='zero', mz='zero', nthreads=1):
+    """
+    In-place cubic spline sampling. The output voxels are distributed
+    over `nthreads` threads.
+    """
+    cdef ndarray Ra = _output_buffer(R)
+    Xa = _contiguous_double(X, R)
+    Ya = _contiguous_double(Y, R)
+    Za = _contiguous_double(Z, R)
+    worker = _SplineSample3d(Ra, Xa, Ya, Za, C,
+                             modes[mx], modes[my], modes[mz])
+    run_threads(worker, Ra.size, nthreads)
+    if not Ra is R:
+        R[...] = Ra
     return R
 
 
 def _cspline_sample4d(ndarray R, ndarray C, X=0, Y=0, Z=0, T=0, 
-                      mx='zero', my='zero', mz='zero', mt='zero'):
+                      mx='zero', my='zero', mz='zero', mt='zero',
+                      nthreads=1):
     """
-    In-place cubic spline sampling. R.dtype must be 'double'. 
+    In-place cubic spline sampling. The output voxels are distributed
+    over `nthreads` threads.
     """
-    cdef double *r, *x, *y, *z, *t
-    cdef broadcast multi
-    Xa = _reshaped_double(X, R)
-    Ya = _reshaped_double(Y, R)
-    Za = _reshaped_double(Z, R)
-    Ta = _reshaped_double(T, R)
-    multi = PyArray_MultiIterNew(5, <void*>R, <void*>Xa, <void*>Ya, <void*>Za, <void*>Ta)
-    while(multi.index < multi.size):
-        r = <double*>PyArray_MultiIter_DATA(multi, 0)
-        x = <double*>PyArray_MultiIter_DATA(multi, 1)
-        y = <double*>PyArray_MultiIter_DATA(multi, 2)
-        z = <double*>PyArray_MultiIter_DATA(multi, 3)
-        t = <double*>PyArray_MultiIter_DATA(multi, 4)
-        r[0] = cubic_spline_sample4d(x[0], y[0], z[0], t[0], C, modes[mx], modes[my], modes[mz], modes[mt])
-        PyArray_MultiIter_NEXT(multi)
+    cdef ndarray Ra = _output_buffer(R)
+    Xa = _contiguous_double(X, R)
+    Ya = _contiguous_double(Y, R)
+    Za = _contiguous_double(Z, R)
+    Ta = _contiguous_double(T, R)
+    worker = _SplineSample4d(Ra, Xa, Ya, Za, Ta, C,
+                             modes[mx], modes[my], modes[mz], modes[mt])
+    run_threads(worker, Ra.size, nthreads)
+    if not Ra is R:
+        R[...] = Ra
     return R
 
 
 def _cspline_resample3d(ndarray im, dims, ndarray Tvox, dtype=None,
-                        mx='zero', my='zero', mz='zero'):
+                        mx='zero', my='zero', mz='zero', nthreads=1):
     """
     Perform cubic spline resampling of a 3d input image `im` into a
     grid with shape `dims` according to an affine transform
@@ -182,20 +367,22 @@ def _cspline_resample3d(ndarray im, dims, ndarray Tvox, dtype=None,
     'nearest': extrapolate intensity by the closest grid point along the axis
     'reflect': extrapolate intensity by mirroring the input image along the axis
 
+    Both the spline transform and the resampling loop are split over
+    `nthreads` threads. The resampled values are written directly into
+    an array of the output data type.
+
     Note that `Tvox` will be re-ordered in C convention if needed.
     """
-    cdef double *tvox
     cdef int cast_integer
 
-    # Create output array
+    # Output data type
     if dtype == None:
         dtype = im.dtype
-    im_resampled = np.zeros(tuple(dims), dtype=dtype)
+    dtype = np.dtype(dtype)
 
     # Ensure that the Tvox array is C-contiguous (required by the
     # underlying C routine)
     Tvox = np.asarray(Tvox, dtype='double', order='C')
-    tvox = <double*>Tvox.data
 
     # Actual resampling 
     if dtype.kind == 'i':
@@ -204,8 +391,11 @@ def _cspline_resample3d(ndarray im, dims, ndarray Tvox, dtype=None,
         cast_integer = 2
     else:
         cast_integer = 0
-    cubic_spline_resample3d(im_resampled, im, tvox, cast_integer,
-                            modes[mx], modes[my], modes[mz])
+    coef = _cspline_transform(im, nthreads=nthreads)
+    im_resampled = np.zeros(tuple(dims), dtype=dtype)
+    worker = _SplineResample3d(im_resampled, coef, Tvox, cast_integer,
+                               modes[mx], modes[my], modes[mz])
+    run_threads(worker, im_resampled.size, nthreads)
 
     return im_resampled
 
@@ -216,7 +406,13 @@ def check_array(ndarray x, int dim, int exp_dim, xname):
     if not dim == exp_dim: 
         raise ValueError('%s has size %d in last dimension, %d expected' % (xname, dim, exp_dim))
 
-def _apply_polyaffine(ndarray xyz, ndarray centers, ndarray affines, ndarray sigma): 
+def _apply_polyaffine(ndarray xyz, ndarray centers, ndarray affines, ndarray sigma,
+                      cutoff=None): 
+    """
+    Apply a polyaffine transform in place to the points `xyz`. If
+    `cutoff` is not None, Gaussian weights are truncated at `cutoff`
+    times `sigma` and only nearby centers are visited for each point.
+    """
 
     check_array(xyz, xyz.shape[1], 3, 'xyz') 
     check_array(centers, centers.shape[1], 3, 'centers')
@@ -225,4 +421,10 @@ def _apply_polyaffine(ndarray xyz, ndarray centers, ndarray affines, ndarray sig
     if not centers.shape[0] == affines.shape[0]: 
         raise ValueError('centers and affines arrays should have same shape[0]')
 
-    apply_polyaffine(xyz, centers, affines, sigma) 
+    if cutoff is None:
+        apply_polyaffine(xyz, centers, affines, sigma) 
+        return
+    if not cutoff > 0:
+        raise ValueError('cutoff should be positive')
+    if apply_polyaffine_truncated(xyz, centers, affines, sigma, cutoff) < 0:
+        raise MemoryError('Could not allocate polyaffine center buckets')
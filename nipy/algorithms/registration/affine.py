@@ -201,6 +201,52 @@ def subgrid_affine(affine, slices):
     return np.dot(affine, slices_aff)
 
 
+def apply_affines(affines, xyz, out=None):
+    """ Apply a stack of affine transforms to the same set of points
+
+    Parameters
+    ----------
+    affines : sequence
+        Either a (N, 4, 4) array-like of affine matrices, or a sequence
+        of N transforms having an `as_affine` method, such as `Affine`
+        or `Rigid` instances.
+    xyz : (P, 3) array-like
+        Points to transform.
+    out : None or (N, P, 3) array, optional
+        If not None, array into which the transformed points are
+        written.
+
+    Returns
+    -------
+    XYZ : (N, P, 3) array
+        Transformed points, such that ``XYZ[n]`` is equal to
+        ``apply_affine(affines[n], xyz)``. If `out` is None, this is a
+        view on a (N, 3, P) array, so that each coordinate of each
+        transformed set of points, e.g. ``XYZ[n, :, 0]``, is contiguous
+        in memory. Otherwise, `out` is returned.
+    """
+    if not isinstance(affines, np.ndarray):
+        affines = [a.as_affine() if hasattr(a, 'as_affine') else a
+                   for a in affines]
+    affines = np.asarray(affines, dtype=np.double)
+    xyz = np.asarray(xyz, dtype=np.double)
+    if not affines.ndim == 3 or not affines.shape[1:] == (4, 4):
+        raise ValueError('affines should be a stack of 4x4 matrices')
+    if not xyz.ndim == 2 or not xyz.shape[1] == 3:
+        raise ValueError('xyz should be a (P, 3) array')
+    shape = (affines.shape[0], xyz.shape[0], 3)
+    if out is None:
+        out = np.zeros((shape[0], 3, shape[1])).transpose((0, 2, 1))
+    elif not out.shape == shape:
+        raise ValueError('out should have shape %s' % str(shape))
+    # One matrix product per output coordinate for all transforms
+    xyz_t = xyz.T
+    for i in range(3):
+        out[..., i] = np.dot(affines[:, i, 0:3], xyz_t)
+        out[..., i] += affines[:, i, 3:4]
+    return out
+
+
 class Affine(Transform):
     param_inds = range(12)
 
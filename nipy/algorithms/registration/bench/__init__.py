@@ -0,0 +1 @@
+# Init for benchmarks for registration algorithms
@@ -0,0 +1,60 @@
+""" Benchmarks for multi-threaded cubic spline routines
+"""
+import sys
+
+import numpy as np
+
+from .._registration import (_cspline_transform,
+                             _cspline_sample3d,
+                             _cspline_resample3d)
+
+import numpy.testing as npt
+
+NTHREADS = (1, 2, 4)
+
+
+def bench_cspline_transform():
+    np.random.seed(20130101)
+    repeat = 3
+    data = np.random.rand(64, 64, 30, 40)
+    sys.stdout.flush()
+    print('\nCubic spline transform 4D')
+    print('-------------------------')
+    for nthreads in NTHREADS:
+        t = npt.measure('_cspline_transform(data, nthreads=nthreads)',
+                        repeat)
+        print('%d thread(s) %6.2f' % (nthreads, t))
+    sys.stdout.flush()
+
+
+def bench_cspline_sample3d():
+    np.random.seed(20130101)
+    repeat = 3
+    coef = _cspline_transform(np.random.rand(128, 128, 64))
+    npts = 10 ** 6
+    x, y, z = np.random.rand(3, npts) * np.array([[127], [127], [63]])
+    res = np.zeros(npts)
+    sys.stdout.flush()
+    print('\nCubic spline sampling 3D')
+    print('------------------------')
+    for nthreads in NTHREADS:
+        t = npt.measure('_cspline_sample3d(res, coef, x, y, z, '
+                        'nthreads=nthreads)', repeat)
+        print('%d thread(s) %6.2f' % (nthreads, t))
+    sys.stdout.flush()
+
+
+def bench_cspline_resample3d():
+    np.random.seed(20130101)
+    repeat = 3
+    data = np.random.rand(128, 128, 64)
+    T = np.eye(4)
+    T[0:3, 3] = [.3, -.2, .7]
+    sys.stdout.flush()
+    print('\nCubic spline resampling 3D')
+    print('--------------------------')
+    for nthreads in NTHREADS:
+        t = npt.measure('_cspline_resample3d(data, data.shape, T, '
+                        'nthreads=nthreads)', repeat)
+        print('%d thread(s) %6.2f' % (nthreads, t))
+    sys.stdout.flush()
@@ -31,18 +31,9 @@
   if (!_mirror_grid_neighbors(x, ddim, &nx, &px))	\
     return 0.0; 
 
-/* 
-   The following marco forces numpy to consider a PyArrayIterObject
-   non-contiguous. Otherwise, coordinates won't be updated - don't
-   know whether this is a bug or not. 
-*/
-#define UPDATE_ITERATOR_COORDS(iter)		\
-  iter->contiguous = 0;
-
 
 static void _cubic_spline_transform1d(double* res, double* src, unsigned int dim, 
 				      unsigned int res_stride, unsigned int src_stride); 
-static void _cubic_spline_transform(PyArrayObject* res, int axis, double* work); 
 static inline void _copy_double_buffer(double* res, double* src, unsigned int dim,
 				       unsigned int src_stride);
 static inline int _mirrored_position(int x, unsigned int ddim);
@@ -170,65 +161,6 @@ static inline void _copy_double_buffer(double* res, double* src, unsigned int di
   return; 
 }
 
-/*
-  res array must be double. 
-  res and src must be of the same size. 
-  work needs be 1d C-style contiguous double with size (at least) equal to res in the axis direction
-*/
-
-static void _cubic_spline_transform(PyArrayObject* res, int axis, double* work)
-{
-  PyArrayIterObject* iter;
-  unsigned int dim, stride;
-
-  /* Instantiate iterator and views */ 
-  iter = (PyArrayIterObject*)PyArray_IterAllButAxis((PyObject*)res, &axis);
-  dim = PyArray_DIM((PyArrayObject*)iter->ao, axis); 
-  stride = PyArray_STRIDE((PyArrayObject*)iter->ao, axis)/sizeof(double); 
-
-  /* Apply the cubic spline transform along given axis */ 
-  while(iter->index < iter->size) {
-    _copy_double_buffer(work, PyArray_ITER_DATA(iter), dim, stride); 
-    _cubic_spline_transform1d(PyArray_ITER_DATA(iter), work, dim, stride, 1); 
-    PyArray_ITER_NEXT(iter); 
-  }
-
-  /* Free local structures */ 
-  Py_DECREF(iter); 
-
-  return; 
-}
-
-
-void cubic_spline_transform(PyArrayObject* res, const PyArrayObject* src)
-{
-  double* work; 
-  unsigned int axis, aux=0, dimmax=0; 
-
-  /* Copy src into res */ 
-  PyArray_CastTo(res, (PyArrayObject*)src); 
-
-  /* Compute the maximum array dimension over axes */ 
-  for(axis=0; axis<res->nd; axis++) {
-    aux = PyArray_DIM(res, axis);
-    if (aux > dimmax) 
-      dimmax = aux; 
-  }
-
-  /* Allocate auxiliary buffer */ 
-  work = (double*)malloc(sizeof(double)*dimmax); 
-
-  /* Apply separable cubic spline transforms */ 
-  for(axis=0; axis<res->nd; axis++) 
-    _cubic_spline_transform(res, axis, work);
-
-  /* Free auxiliary buffer */ 
-  free(work); 
-
-  return; 
-}
-
-
 double cubic_spline_sample1d (double x, const PyArrayObject* Coef, int mode) 
 {
 
@@ -556,62 +488,108 @@ double cubic_spline_sample4d (double x, double y, double z, double t, const PyAr
 
 
 /* 
-   Resample a 3d image submitted to an affine transformation.
-   Tvox is the voxel transformation from the image to the destination grid.  
+   Apply the cubic spline transform in place to `nlines` independent
+   lines of a double buffer. Line i starts at data + offsets[i] and
+   has `dim` samples separated by `stride` doubles. Each call uses its
+   own auxiliary buffer, so that disjoint sets of lines can be
+   processed concurrently. Returns 0 on success, -1 if the buffer
+   could not be allocated.
+*/
+int cubic_spline_transform_lines(double* data, const npy_intp* offsets, npy_intp nlines,
+				 unsigned int dim, unsigned int stride)
+{
+  npy_intp i; 
+  double *line, *work; 
+
+  /* Allocate auxiliary buffer */ 
+  work = (double*)malloc(sizeof(double)*dim); 
+  if (work == NULL)
+    return -1; 
+
+  for (i=0; i<nlines; i++) {
+    line = data + offsets[i]; 
+    _copy_double_buffer(work, line, dim, stride); 
+    _cubic_spline_transform1d(line, work, dim, stride, 1); 
+  }
+
+  /* Free auxiliary buffer */ 
+  free(work); 
+
+  return 0; 
+}
+
+
+/* 
+   Sample the spline at `size` points whose coordinates are stored in
+   contiguous double buffers, and write the values into `res`.
 */
-void cubic_spline_resample3d(PyArrayObject* im_resampled, const PyArrayObject* im,   
-			     const double* Tvox, int cast_integer, 
-			     int mode_x, int mode_y, int mode_z)
+void cubic_spline_sample3d_array(double* res, const double* x, const double* y, 
+				 const double* z, npy_intp size, const PyArrayObject* coef,
+				 int mode_x, int mode_y, int mode_z)
 {
-  double i1;
-  PyObject* py_i1;
-  PyArrayObject* im_spline_coeff;
-  PyArrayIterObject* imIter = (PyArrayIterObject*)PyArray_IterNew((PyObject*)im_resampled); 
-  unsigned int x, y, z;
-  unsigned dimX = PyArray_DIM(im, 0);
-  unsigned dimY = PyArray_DIM(im, 1);
-  unsigned dimZ = PyArray_DIM(im, 2);
-  npy_intp dims[3] = {dimX, dimY, dimZ}; 
-  double Tx, Ty, Tz;
-
-  /* Compute the spline coefficient image */
-  im_spline_coeff = (PyArrayObject*)PyArray_SimpleNew(3, dims, NPY_DOUBLE);
-  cubic_spline_transform(im_spline_coeff, im);
-
-  /* Force iterator coordinates to be updated */
-  UPDATE_ITERATOR_COORDS(imIter); 
-
-  /* Resampling loop */
-  while(imIter->index < imIter->size) {
-    x = imIter->coordinates[0];
-    y = imIter->coordinates[1]; 
-    z = imIter->coordinates[2]; 
+  npy_intp i; 
+
+  for (i=0; i<size; i++)
+    res[i] = cubic_spline_sample3d(x[i], y[i], z[i], coef, mode_x, mode_y, mode_z); 
+
+  return; 
+}
+
+
+void cubic_spline_sample4d_array(double* res, const double* x, const double* y, 
+				 const double* z, const double* t, npy_intp size, 
+				 const PyArrayObject* coef, 
+				 int mode_x, int mode_y, int mode_z, int mode_t)
+{
+  npy_intp i; 
+
+  for (i=0; i<size; i++)
+    res[i] = cubic_spline_sample4d(x[i], y[i], z[i], t[i], coef, 
+				   mode_x, mode_y, mode_z, mode_t); 
+
+  return; 
+}
+
+
+/* 
+   Resample a 3d image submitted to an affine transformation over the
+   output voxels with (C-order) flat indices in [start, stop) of a
+   grid with dimensions (dimX, dimY, dimZ). Tvox is the voxel
+   transformation from the image to the destination grid, and `coef`
+   holds the spline coefficients of the input image. The value of
+   voxel i is written into res[i - start]. Values are rounded if
+   `cast_integer` is nonzero, and also clipped at zero if it is 2.
+*/
+void cubic_spline_resample3d_range(double* res, npy_intp start, npy_intp stop, 
+				   unsigned int dimY, unsigned int dimZ, 
+				   const PyArrayObject* coef, const double* Tvox, 
+				   int cast_integer, int mode_x, int mode_y, int mode_z)
+{
+  npy_intp i, yz; 
+  npy_intp dimYZ = (npy_intp)dimY * (npy_intp)dimZ; 
+  size_t x, y, z;
+  double Tx, Ty, Tz, i1;
+
+  for (i=start; i<stop; i++) {
+    x = i / dimYZ; 
+    yz = i % dimYZ; 
+    y = yz / dimZ; 
+    z = yz % dimZ; 
     _apply_affine_transform(&Tx, &Ty, &Tz, Tvox, x, y, z); 
-    i1 = cubic_spline_sample3d(Tx, Ty, Tz, im_spline_coeff, mode_x, mode_y, mode_z); 
+    i1 = cubic_spline_sample3d(Tx, Ty, Tz, coef, mode_x, mode_y, mode_z); 
     if (cast_integer) {
       i1 = ROUND(i1);
       if (cast_integer == 2)
 	if (i1 < 0)
 	  i1 = 0;
-     }
-
-    /* Copy interpolated value into numpy array */
-    py_i1 = PyFloat_FromDouble(i1); 
-    PyArray_SETITEM(im_resampled, PyArray_ITER_DATA(imIter), py_i1); 
-    Py_DECREF(py_i1); 
-    
-    /* Increment iterator */
-    PyArray_ITER_NEXT(imIter); 
-
+    }
+    res[i - start] = i1; 
   }
 
-  /* Free memory */
-  Py_DECREF(imIter);
-  Py_DECREF(im_spline_coeff); 
-    
-  return;
+  return; 
 }
 
+
 static inline void _apply_affine_transform(double* Tx, double* Ty, double* Tz, 
 					   const double* Tvox,
 					   size_t x, size_t y, size_t z)
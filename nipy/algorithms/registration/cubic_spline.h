@@ -35,13 +35,6 @@ extern "C" {
     \param x input value 
   */
   extern double cubic_spline_basis(double x); 
-  /*! 
-    \brief Cubic spline transform of a one-dimensional signal 
-    \param src input signal 
-    \param res output signal (same size)
-  */
-  extern void cubic_spline_transform(PyArrayObject* res, const PyArrayObject* src);
-
   extern double cubic_spline_sample1d(double x, const PyArrayObject* coef, 
 				      int mode); 
   extern double cubic_spline_sample2d(double x, double y, const PyArrayObject* coef,
@@ -50,9 +43,25 @@ extern "C" {
 				      int mode_x, int mode_y, int mode_z);
   extern double cubic_spline_sample4d(double x, double y, double z, double t, const PyArrayObject* coef,
 				      int mode_x, int mode_y, int mode_z, int mode_t); 
-  extern void cubic_spline_resample3d(PyArrayObject* im_resampled, const PyArrayObject* im, 
-				      const double* Tvox, int cast_integer,
-				      int mode_x, int mode_y, int mode_z);
+
+  /*
+    The following functions do not call the Python C-API, hence they
+    may be called without holding the GIL, e.g. from several threads
+    working on disjoint parts of the output.
+  */
+  extern int cubic_spline_transform_lines(double* data, const npy_intp* offsets, npy_intp nlines,
+					  unsigned int dim, unsigned int stride);
+  extern void cubic_spline_sample3d_array(double* res, const double* x, const double* y, 
+					  const double* z, npy_intp size, const PyArrayObject* coef,
+					  int mode_x, int mode_y, int mode_z);
+  extern void cubic_spline_sample4d_array(double* res, const double* x, const double* y, 
+					  const double* z, const double* t, npy_intp size, 
+					  const PyArrayObject* coef,
+					  int mode_x, int mode_y, int mode_z, int mode_t);
+  extern void cubic_spline_resample3d_range(double* res, npy_intp start, npy_intp stop, 
+					    unsigned int dimY, unsigned int dimZ, 
+					    const PyArrayObject* coef, const double* Tvox, 
+					    int cast_integer, int mode_x, int mode_y, int mode_z);
 
     
 
@@ -12,7 +12,7 @@ from ...core.image.image_spaces import (make_xyz_image,
                                         xyz_affine,
                                         as_xyz_image)
 from .optimizer import configure_optimizer, use_derivatives
-from .affine import Rigid, Affine
+from .affine import Rigid, Affine, apply_affines
 from ._registration import (_cspline_transform,
                             _cspline_sample3d,
                             _cspline_sample4d)
@@ -34,6 +34,8 @@ BORDERS = 1, 1, 1
 REFSCAN = 0
 EXTRAPOLATE_SPACE = 'reflect'
 EXTRAPOLATE_TIME = 'reflect'
+NTHREADS = 1  # threads used for cubic spline transforms and sampling
+BLOCK_SIZE = 2 ** 21  # max number of scanner coordinates computed at once
 
 LOOPS = 5  # loops within each run
 BETWEEN_LOOPS = 5  # loops used to realign different runs
@@ -65,6 +67,22 @@ def scanner_coords(xyz, affine, from_world, to_world):
     return XYZ[:, 0], XYZ[:, 1], XYZ[:, 2]
 
 
+def multiple_scanner_coords(xyz, affines, from_world, to_world, out=None):
+    """
+    Scanner coordinates of the grid points `xyz` for a stack of N
+    transforms `affines`, as a (N, P, 3) array such that ``XYZ[n]``
+    stacks the coordinates returned by ``scanner_coords(xyz,
+    affines[n], from_world, to_world)``. See `apply_affines` for the
+    meaning of `affines` and `out`.
+    """
+    if not isinstance(affines, np.ndarray):
+        affines = [a.as_affine() if hasattr(a, 'as_affine') else a
+                   for a in affines]
+    affines = np.asarray(affines, dtype=np.double)
+    Tv = np.dot(from_world, np.dot(affines, to_world)).swapaxes(0, 1)
+    return apply_affines(Tv, xyz, out=out)
+
+
 def make_grid(dims, subsampling=(1, 1, 1), borders=(0, 0, 0)):
     slices = [slice(b, d - b, s)\
                   for d, s, b in zip(dims, subsampling, borders)]
@@ -226,12 +244,14 @@ class Realign4dAlgorithm(object):
         # Compute the 4d cubic spline transform
         self.time_interp = time_interp
         if time_interp:
-            self.cbspline = _cspline_transform(im4d.get_data())
+            self.cbspline = _cspline_transform(im4d.get_data(),
+                                               nthreads=NTHREADS)
         else:
             self.cbspline = np.zeros(self.dims, dtype='double')
             for t in range(self.dims[3]):
                 self.cbspline[:, :, :, t] =\
-                    _cspline_transform(im4d.get_data()[:, :, :, t])
+                    _cspline_transform(im4d.get_data()[:, :, :, t],
+                                       nthreads=NTHREADS)
 
         # The reference scan conventionally defines the head
         # coordinate system
@@ -257,16 +277,22 @@ class Realign4dAlgorithm(object):
                           dtype='double')
         self._pc = None
 
-    def resample(self, t):
+    def resample(self, t, XYZ=None):
         """
         Resample a particular time frame on the (sub-sampled) working
         grid.
 
         x,y,z,t are "head" grid coordinates
         X,Y,Z,T are "scanner" grid coordinates
+
+        If provided, `XYZ` is a (P, 3) array of precomputed scanner
+        coordinates of the working grid for time frame `t`.
         """
-        X, Y, Z = scanner_coords(self.xyz, self.transforms[t].as_affine(),
-                                 self.inv_affine, self.affine)
+        if XYZ is None:
+            X, Y, Z = scanner_coords(self.xyz, self.transforms[t].as_affine(),
+                                     self.inv_affine, self.affine)
+        else:
+            X, Y, Z = XYZ[:, 0], XYZ[:, 1], XYZ[:, 2]
         if self.time_interp:
             T = self.scanner_time(Z, self.timestamps[t])
             _cspline_sample4d(self.data[:, t],
@@ -275,14 +301,16 @@ class Realign4dAlgorithm(object):
                               mx=EXTRAPOLATE_SPACE,
                               my=EXTRAPOLATE_SPACE,
                               mz=EXTRAPOLATE_SPACE,
-                              mt=EXTRAPOLATE_TIME)
+                              mt=EXTRAPOLATE_TIME,
+                              nthreads=NTHREADS)
         else:
             _cspline_sample3d(self.data[:, t],
                               self.cbspline[:, :, :, t],
                               X, Y, Z,
                               mx=EXTRAPOLATE_SPACE,
                               my=EXTRAPOLATE_SPACE,
-                              mz=EXTRAPOLATE_SPACE)
+                              mz=EXTRAPOLATE_SPACE,
+                              nthreads=NTHREADS)
 
     def resample_full_data(self):
         if VERBOSE:
@@ -299,11 +327,13 @@ class Realign4dAlgorithm(object):
                 _cspline_sample4d(res[:, :, :, t],
                                   self.cbspline,
                                   X, Y, Z, T,
-                                  mt='nearest')
+                                  mt='nearest',
+                                  nthreads=NTHREADS)
             else:
                 _cspline_sample3d(res[:, :, :, t],
                                   self.cbspline[:, :, :, t],
-                                  X, Y, Z)
+                                  X, Y, Z,
+                                  nthreads=NTHREADS)
         return res
 
     def set_fmin(self, optimizer, stepsize, **kwargs):
@@ -445,10 +475,18 @@ class Realign4dAlgorithm(object):
         space/time transformation, the parameters of which are further
         optimized sequentially.
         """
-        for t in range(self.nscans):
-            if VERBOSE:
-                print('Resampling scan %d/%d' % (t + 1, self.nscans))
-            self.resample(t)
+        # The scanner coordinates are computed for blocks of frames, so
+        # as to use at most BLOCK_SIZE coordinates at a time
+        nframes = max(1, BLOCK_SIZE // (3 * self.xyz.shape[0]))
+        for start in range(0, self.nscans, nframes):
+            stop = min(start + nframes, self.nscans)
+            XYZ = multiple_scanner_coords(self.xyz, self.transforms[start:stop],
+                                          self.inv_affine, self.affine)
+            for t in range(start, stop):
+                if VERBOSE:
+                    print('Resampling scan %d/%d' % (t + 1, self.nscans))
+                self.resample(t, XYZ[t - start])
+            del XYZ
 
         # Set the template as the reference scan (will be overwritten
         # if template is to be optimized)
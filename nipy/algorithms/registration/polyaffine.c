@@ -121,3 +121,188 @@ void apply_polyaffine(PyArrayObject* XYZ,
 
 
 
+/* 
+   Accumulate the weighted affine matrix and total weight at point
+   xyz over all K centers (exact evaluation).
+*/
+static void _accumulate_all_centers(double* mat, double* W, double* xyz, 
+				    const double* centers, const double* affines, 
+				    const double* sigma, npy_intp K)
+{
+  npy_intp k; 
+  double w; 
+
+  for (k=0; k<K; k++) {
+    w = _gaussian(xyz, (double*)centers+3*k, (double*)sigma); 
+    *W += w; 
+    _add_weighted_affine(mat, affines+12*k, w); 
+  }
+
+  return; 
+}
+
+
+/* 
+   Integer range of grid cells [lo, hi] along one axis that may
+   contain centers within one cell of the scaled coordinate u. Returns
+   0 if the range does not intersect the grid.
+*/
+static int _cell_range(double u, double origin, double h, npy_intp dim, 
+		       npy_intp* lo, npy_intp* hi)
+{
+  double c = floor((u-origin)/h); 
+
+  if ((c+1 < 0) || (c-1 > dim-1))
+    return 0; 
+  *lo = (c-1 < 0) ? 0 : (npy_intp)(c-1); 
+  *hi = (c+1 > dim-1) ? dim-1 : (npy_intp)(c+1);
+
+  return 1; 
+}
+
+
+/*
+  XYZ assumed contiguous double (N, 3)
+  Centers assumed contiguous double (K, 3)
+  Affines assumed contiguous double (K, 12)
+
+  Centers are sorted into the cells of a regular grid in coordinates
+  normalized by sigma, with cell size at least `cutoff`, so that the
+  centers within `cutoff` of a point lie in the 27 cells surrounding
+  the point's cell. Points having no center within `cutoff` are
+  evaluated exactly.
+ */
+int apply_polyaffine_truncated(PyArrayObject* XYZ, 
+			       const PyArrayObject* Centers, 
+			       const PyArrayObject* Affines, 
+			       const PyArrayObject* Sigma, 
+			       double cutoff)
+{
+  npy_intp N = PyArray_DIM(XYZ, 0); 
+  npy_intp K = PyArray_DIM(Centers, 0); 
+  double *xyz = PyArray_DATA(XYZ); 
+  const double *centers = PyArray_DATA(Centers); 
+  const double *affines = PyArray_DATA(Affines); 
+  const double *sigma = PyArray_DATA(Sigma); 
+  double cutoff2 = cutoff*cutoff, h = cutoff; 
+  double origin[3], corner[3], u[3]; 
+  double ncells_d, w, W, d2, aux; 
+  double mat[12], t_xyz[3]; 
+  npy_intp dims[3], lo[3], hi[3]; 
+  npy_intp ncells, i, j, k, a, b, c, cell, found; 
+  npy_intp *center_cell = NULL, *cell_start = NULL, *cell_fill = NULL, *cell_items = NULL; 
+  int d, ok = 0; 
+  size_t bytes_mat = 12*sizeof(double); 
+  size_t bytes_xyz = 3*sizeof(double); 
+
+  if (K == 0) {
+    apply_polyaffine(XYZ, Centers, Affines, Sigma); 
+    return 0; 
+  }
+
+  /* Bounding box of the centers in normalized coordinates */ 
+  for (d=0; d<3; d++) 
+    origin[d] = corner[d] = centers[d]/sigma[d]; 
+  for (k=1; k<K; k++) 
+    for (d=0; d<3; d++) {
+      aux = centers[3*k+d]/sigma[d]; 
+      if (aux < origin[d])
+	origin[d] = aux; 
+      else if (aux > corner[d])
+	corner[d] = aux; 
+    }
+
+  /* Grow the cell size until the grid has no more than 8 cells per
+     center on average, to bound memory for sparse centers */ 
+  while (1) {
+    ncells_d = 1; 
+    for (d=0; d<3; d++) 
+      ncells_d *= floor((corner[d]-origin[d])/h) + 1; 
+    if (ncells_d <= 8*K)
+      break; 
+    h *= 2; 
+  }
+  ncells = 1; 
+  for (d=0; d<3; d++) {
+    dims[d] = (npy_intp)floor((corner[d]-origin[d])/h) + 1; 
+    ncells *= dims[d]; 
+  }
+
+  /* Sort centers by cell (counting sort) */ 
+  center_cell = (npy_intp*)malloc(K*sizeof(npy_intp)); 
+  cell_start = (npy_intp*)calloc(ncells+1, sizeof(npy_intp)); 
+  cell_fill = (npy_intp*)malloc(ncells*sizeof(npy_intp)); 
+  cell_items = (npy_intp*)malloc(K*sizeof(npy_intp)); 
+  if ((center_cell == NULL) || (cell_start == NULL) || 
+      (cell_fill == NULL) || (cell_items == NULL)) {
+    ok = -1; 
+    goto cleanup; 
+  }
+  for (k=0; k<K; k++) {
+    cell = 0; 
+    for (d=0; d<3; d++) {
+      j = (npy_intp)floor((centers[3*k+d]/sigma[d]-origin[d])/h); 
+      if (j > dims[d]-1) 
+	j = dims[d]-1; 
+      cell = cell*dims[d] + j; 
+    }
+    center_cell[k] = cell; 
+    cell_start[cell+1] ++; 
+  }
+  for (cell=0; cell<ncells; cell++) {
+    cell_start[cell+1] += cell_start[cell]; 
+    cell_fill[cell] = cell_start[cell]; 
+  }
+  for (k=0; k<K; k++) 
+    cell_items[cell_fill[center_cell[k]]++] = k; 
+
+  /* Loop over input points */ 
+  for (i=0; i<N; i++, xyz+=3) {
+    memset((void*)mat, 0, bytes_mat); 
+    W = 0.0; 
+    found = 0; 
+
+    /* Visit centers in neighboring cells */
+    for (d=0; d<3; d++) 
+      u[d] = xyz[d]/sigma[d]; 
+    if (_cell_range(u[0], origin[0], h, dims[0], &lo[0], &hi[0]) && 
+	_cell_range(u[1], origin[1], h, dims[1], &lo[1], &hi[1]) && 
+	_cell_range(u[2], origin[2], h, dims[2], &lo[2], &hi[2])) {
+      for (a=lo[0]; a<=hi[0]; a++) 
+	for (b=lo[1]; b<=hi[1]; b++) 
+	  for (c=lo[2]; c<=hi[2]; c++) {
+	    cell = (a*dims[1] + b)*dims[2] + c; 
+	    for (j=cell_start[cell]; j<cell_start[cell+1]; j++) {
+	      k = cell_items[j]; 
+	      d2 = 0.0; 
+	      for (d=0; d<3; d++) {
+		aux = u[d] - centers[3*k+d]/sigma[d]; 
+		d2 += aux*aux; 
+	      }
+	      if (d2 > cutoff2)
+		continue; 
+	      w = exp(-.5*d2); 
+	      W += w; 
+	      _add_weighted_affine(mat, affines+12*k, w); 
+	      found ++; 
+	    }
+	  }
+    }
+
+    /* Fall back to exact evaluation for isolated points */ 
+    if (!found) 
+      _accumulate_all_centers(mat, &W, xyz, centers, affines, sigma, K); 
+
+    /* Apply matrix */ 
+    _apply_affine(t_xyz, mat, xyz, W); 
+    memcpy((void*)xyz, (void*)t_xyz, bytes_xyz); 
+  }
+
+ cleanup: 
+  free(center_cell); 
+  free(cell_start); 
+  free(cell_fill); 
+  free(cell_items); 
+
+  return ok; 
+}
@@ -15,6 +15,18 @@ extern "C" {
 			       const PyArrayObject* Affines, 
 			       const PyArrayObject* Sigma); 
 
+  /*
+    Same as `apply_polyaffine`, except that Gaussian weights are
+    truncated at `cutoff` times sigma. Centers are bucketed on a
+    regular grid, so that each point only visits nearby centers.
+    Returns -1 if memory allocation fails, 0 otherwise.
+  */
+  extern int apply_polyaffine_truncated(PyArrayObject* XYZ, 
+					const PyArrayObject* Centers, 
+					const PyArrayObject* Affines, 
+					const PyArrayObject* Sigma, 
+					double cutoff); 
+
 
 #ifdef __cplusplus
 }
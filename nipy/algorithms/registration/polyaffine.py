@@ -11,7 +11,8 @@ TINY_SIGMA = 1e-200
 
 class PolyAffine(Transform):
 
-    def __init__(self, centers, affines, sigma, glob_affine=None):
+    def __init__(self, centers, affines, sigma, glob_affine=None,
+                 cutoff=None):
         """
         centers: N times 3 array
 
@@ -23,12 +24,19 @@ class PolyAffine(Transform):
 
         where w_i(x) = g(x-x_i)/Z(x) are normalized Gaussian weights
         that sum up to one for every x.
+
+        If `cutoff` is not None, the Gaussian kernel is truncated at
+        `cutoff` times `sigma` along each axis (in the sense of the
+        sigma-normalized distance), so that only the centers close to
+        each point need to be visited. Points with no center within
+        the cutoff distance are evaluated exactly.
         """
 
         # Format input arguments
         self.centers = np.asarray(centers, dtype='double', order='C')
         self.sigma = np.zeros(3)
         self.sigma[:] = np.maximum(TINY_SIGMA, sigma)
+        self.cutoff = cutoff
         if hasattr(affines[0], 'as_affine'):
             affines = np.array([a.as_affine() for a in affines])
         else:
@@ -62,7 +70,8 @@ class PolyAffine(Transform):
             txyz = np.array(xyz, copy=True, dtype='double', order='C')
         else:
             txyz = apply_affine(self.glob_affine, xyz)
-        _apply_polyaffine(txyz, self.centers, self._affines, self.sigma)
+        _apply_polyaffine(txyz, self.centers, self._affines, self.sigma,
+                          cutoff=self.cutoff)
         return txyz
 
     def compose(self, other):
@@ -91,7 +100,7 @@ class PolyAffine(Transform):
             glob_affine = np.dot(self.glob_affine, other.as_affine())
 
         return self.__class__(self.centers, self.affines(), self.sigma,
-                              glob_affine=glob_affine)
+                              glob_affine=glob_affine, cutoff=self.cutoff)
 
     def left_compose(self, other):
 
@@ -105,4 +114,5 @@ class PolyAffine(Transform):
         affines = [np.dot(other_affine, self.affine(i)) \
                        for i in range(len(self.centers))]
         return self.__class__(self.centers, affines, self.sigma,
-                              glob_affine=self.glob_affine)
+                              glob_affine=self.glob_affine,
+                              cutoff=self.cutoff)
@@ -18,7 +18,7 @@ INTERP_ORDER = 3
 
 def resample(moving, transform=None, reference=None,
              mov_voxel_coords=False, ref_voxel_coords=False,
-             dtype=None, interp_order=INTERP_ORDER):
+             dtype=None, interp_order=INTERP_ORDER, nthreads=1):
     """ Resample `movimg` into voxel space of `reference` using `transform`
 
     Apply a transformation to the image considered as 'moving' to
@@ -54,6 +54,9 @@ def resample(moving, transform=None, reference=None,
       maps from world coordinates.
     interp_order: int, optional
       Spline interpolation order, defaults to 3.
+    nthreads: int, optional
+      Number of threads used by the cubic spline implementation
+      (`interp_order==3`), defaults to 1.
 
     Returns
     -------
@@ -92,8 +95,8 @@ def resample(moving, transform=None, reference=None,
             Tv = np.dot(inverse_affine(mov_aff), Tv)
         if interp_order == 3:
             output = _cspline_resample3d(data, ref_shape,
-                                         Tv, dtype=dtype)
-            output = output.astype(dtype)
+                                         Tv, dtype=dtype,
+                                         nthreads=nthreads)
         else:
             output = np.zeros(ref_shape, dtype=dtype)
             affine_transform(data, Tv[0:3, 0:3], offset=Tv[0:3, 3],
@@ -111,10 +114,10 @@ def resample(moving, transform=None, reference=None,
         coords = np.reshape(coords, (np.prod(ref_shape), 3))
         coords = Tv.apply(coords).T
         if interp_order == 3:
-            cbspline = _cspline_transform(data)
-            output = np.zeros(ref_shape, dtype='double')
-            output = _cspline_sample3d(output, cbspline, *coords)
-            output = output.astype(dtype)
+            cbspline = _cspline_transform(data, nthreads=nthreads)
+            output = np.zeros(ref_shape, dtype=dtype)
+            output = _cspline_sample3d(output, cbspline, *coords,
+                                       nthreads=nthreads)
         else:
             output = map_coordinates(data, coords, order=interp_order,
                                      cval=0, output=dtype)
@@ -9,6 +9,7 @@ def configuration(parent_package='', top_path=None):
 
     config = Configuration('registration', parent_package, top_path)
     config.add_subpackage('tests')
+    config.add_subpackage('bench')
     config.add_include_dirs(config.name.replace('.', os.sep))
     config.add_extension(
         '_registration',
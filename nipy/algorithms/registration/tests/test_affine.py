@@ -4,7 +4,10 @@ import numpy as np
 
 from ..affine import (Affine, Affine2D, Rigid, Rigid2D,
                       Similarity, Similarity2D,
-                      rotation_mat2vec, subgrid_affine, slices2aff)
+                      rotation_mat2vec, subgrid_affine, slices2aff,
+                      apply_affines)
+
+from nibabel.affines import apply_affine
 
 from nose.tools import assert_true, assert_false, assert_raises
 from numpy.testing import assert_array_equal, assert_array_almost_equal
@@ -163,3 +166,22 @@ def test_subgrid_affine():
     # Raises error for non-integer slice arguments
     slices[0] = slice(2.1, 11, 4)
     assert_raises(ValueError, subgrid_affine, np.eye(4), slices)
+
+
+def test_apply_affines():
+    xyz = np.random.rand(50, 3)
+    transforms = [Rigid(random_vec12('rigid')) for i in range(4)]
+    transforms.append(Affine(random_vec12('affine')))
+    XYZ = apply_affines(transforms, xyz)
+    assert_array_equal(XYZ.shape, (5, 50, 3))
+    assert_true(XYZ[0, :, 0].flags['C_CONTIGUOUS'])
+    for T, pts in zip(transforms, XYZ):
+        assert_array_almost_equal(pts, apply_affine(T.as_affine(), xyz))
+    # Stack of matrices and caller supplied buffer
+    affines = np.array([T.as_affine() for T in transforms])
+    out = np.zeros((5, 50, 3))
+    res = apply_affines(affines, xyz, out=out)
+    assert_true(res is out)
+    assert_array_almost_equal(out, XYZ)
+    assert_raises(ValueError, apply_affines, affines, xyz, np.zeros((5, 3)))
+    assert_raises(ValueError, apply_affines, affines[0], xyz)
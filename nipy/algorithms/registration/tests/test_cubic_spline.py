@@ -3,11 +3,14 @@
 
 import numpy as np
 
+from .. import _registration
 from .._registration import (_cspline_transform,
                              _cspline_sample1d,
-                             _cspline_sample4d)
+                             _cspline_sample3d,
+                             _cspline_sample4d,
+                             _cspline_resample3d)
 
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_array_equal
 
 from nose.tools import assert_true, assert_equal, assert_raises
 
@@ -34,3 +37,82 @@ def test_sample4d():
     args = list(x) + ['nearest' for i in range(4)]
     b = _cspline_sample4d(b, c, *args)
     assert_array_almost_equal(a, b)
+
+
+def test_transform_threads():
+    a = np.random.rand(9, 10, 11, 3)
+    c = _cspline_transform(a)
+    for nthreads in (2, 5, 100):
+        assert_array_almost_equal(_cspline_transform(a, nthreads=nthreads), c)
+    # Non-contiguous, non-double input
+    b = a[::2, :, ::-1].astype('float32')
+    assert_array_almost_equal(_cspline_transform(b, nthreads=3),
+                              _cspline_transform(b))
+
+
+def test_sample3d_threads():
+    a = np.random.rand(6, 7, 8)
+    c = _cspline_transform(a)
+    x, y, z = 7 * np.random.rand(3, 500) - 1
+    b = _cspline_sample3d(np.zeros(500), c, x, y, z)
+    b1 = _cspline_sample3d(np.zeros(500), c, x, y, z, mx='reflect')
+    for nthreads in (2, 3):
+        b2 = _cspline_sample3d(np.zeros(500), c, x, y, z, mx='reflect',
+                               nthreads=nthreads)
+        assert_array_almost_equal(b1, b2)
+    # Non-contiguous output array
+    r = np.zeros((500, 2))
+    _cspline_sample3d(r[:, 1], c, x, y, z, nthreads=2)
+    assert_array_almost_equal(r[:, 1], b)
+    assert_array_almost_equal(r[:, 0], 0)
+
+
+def test_sample4d_threads():
+    a = np.random.rand(4, 5, 6, 7)
+    c = _cspline_transform(a, nthreads=2)
+    x = np.mgrid[0:4, 0:5, 0:6, 0:7]
+    b = np.zeros(a.shape)
+    b = _cspline_sample4d(b, c, *x, nthreads=4)
+    assert_array_almost_equal(a, b)
+
+
+def test_resample3d_threads():
+    a = (100 * np.random.rand(10, 11, 12)).astype('int16')
+    T = np.eye(4)
+    T[0:3, 3] = [.5, -1.2, 2.1]
+    r1 = _cspline_resample3d(a, (8, 9, 10), T)
+    r2 = _cspline_resample3d(a, (8, 9, 10), T, nthreads=3)
+    assert_equal(r2.dtype, a.dtype)
+    assert_array_almost_equal(r1, r2)
+    # Identity resampling
+    r = _cspline_resample3d(a, a.shape, np.eye(4), nthreads=2)
+    assert_array_almost_equal(r, a)
+
+
+def test_output_dtype():
+    # non-double outputs get the cast values of a double output, whatever
+    # the size of the cast blocks
+    a = 100 * np.random.rand(10, 11, 12)
+    T = np.eye(4)
+    T[0:3, 3] = [.5, -1.2, 2.1]
+    c = _cspline_transform(a)
+    x = np.random.rand(3, 500) * 10
+    rd = _cspline_resample3d(a, (8, 9, 10), T, dtype='double')
+    bd = _cspline_sample3d(np.zeros(500), c, *x)
+    block_size = _registration.CAST_BLOCK_SIZE
+    try:
+        for size in (block_size, 7):
+            _registration.CAST_BLOCK_SIZE = size
+            r = _cspline_resample3d(a, (8, 9, 10), T, dtype='float32',
+                                    nthreads=3)
+            assert_equal(r.dtype, np.float32)
+            assert_array_equal(r, rd.astype('float32'))
+            r = _cspline_resample3d(a, (8, 9, 10), T, dtype='uint8',
+                                    nthreads=3)
+            expected = np.maximum(np.floor(rd + .5), 0).astype('uint8')
+            assert_array_equal(r, expected)
+            b = np.zeros(500, dtype='int16')
+            _cspline_sample3d(b, c, *x, nthreads=2)
+            assert_array_equal(b, bd.astype('int16'))
+    finally:
+        _registration.CAST_BLOCK_SIZE = block_size
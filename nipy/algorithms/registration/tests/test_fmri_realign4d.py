@@ -12,7 +12,11 @@ from ....fixes.nibabel import io_orientation
 from ....core.image.image_spaces import (make_xyz_image,
                                         xyz_affine)
 
-from ..groupwise_registration import Image4d, resample4d, FmriRealign4d
+from .. import groupwise_registration
+from ..groupwise_registration import (Image4d, resample4d, FmriRealign4d,
+                                      Realign4dAlgorithm,
+                                      scanner_coords, multiple_scanner_coords,
+                                      make_grid)
 from ..affine import Rigid
 
 im = load_image(funcfile)
@@ -26,6 +30,44 @@ def test_scanner_time():
     assert_equal(im4d.scanner_time(1, im4d.tr_slices), 0.)
 
 
+def test_multiple_scanner_coords():
+    xyz = make_grid((6, 7, 8), subsampling=(2, 2, 2))
+    transforms = [Rigid() for t in range(3)]
+    for T in transforms:
+        T.param = np.random.rand(6)
+    aff = xyz_affine(im)
+    inv_aff = np.linalg.inv(aff)
+    XYZ = multiple_scanner_coords(xyz, transforms, inv_aff, aff)
+    for T, pts in zip(transforms, XYZ):
+        X, Y, Z = scanner_coords(xyz, T.as_affine(), inv_aff, aff)
+        assert_array_almost_equal(pts[:, 0], X)
+        assert_array_almost_equal(pts[:, 1], Y)
+        assert_array_almost_equal(pts[:, 2], Z)
+
+
+def test_estimate_motion_blocks():
+    # the initial resampling pass is the same for any block size
+    im4d = Image4d(im.get_data(), xyz_affine(im), tr=2.)
+    transforms = [Rigid() for t in range(im.shape[3])]
+    for T in transforms:
+        T.param = .1 * np.random.rand(6)
+    R = Realign4dAlgorithm(im4d, transforms=transforms)
+    R.estimate_instant_motion = lambda t: None
+    data = np.zeros(R.data.shape)
+    for t in range(R.nscans):
+        R.resample(t)
+        data[:, t] = R.data[:, t]
+    block_size = groupwise_registration.BLOCK_SIZE
+    try:
+        for nframes in (1, 3, R.nscans):
+            groupwise_registration.BLOCK_SIZE = 3 * R.xyz.shape[0] * nframes
+            R.data[:] = 0
+            R.estimate_motion()
+            assert_array_almost_equal(R.data, data)
+    finally:
+        groupwise_registration.BLOCK_SIZE = block_size
+
+
 def test_slice_info():
     im4d = Image4d(im.get_data(), im.affine, tr=2.,
                    slice_info=(1, -1))
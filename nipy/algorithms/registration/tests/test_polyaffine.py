@@ -1,5 +1,8 @@
 import numpy as np
 
+from numpy.testing import assert_array_almost_equal
+from nose.tools import assert_raises
+
 from ..polyaffine import PolyAffine
 from ..affine import Affine
 
@@ -45,3 +48,46 @@ AT = A.compose(T)
 
 z = AT.apply(xyz)
 za = A.compose(Affine(raf)).apply(xyz)
+
+
+def test_truncated_kernel():
+    # Dense grid of centers, each with its own affine
+    centers = np.mgrid[0:30:3, 0:40:4, 0:20:2.5].reshape((3, -1)).T
+    affines = [random_affine() for i in range(len(centers))]
+    sigma = np.array([3., 4., 2.5])
+    xyz = np.random.rand(500, 3) * [30, 40, 20]
+    T = PolyAffine(centers, affines, sigma)
+    t = T.apply(xyz)
+    # Wide cutoff: same as exact evaluation
+    Tc = PolyAffine(centers, affines, sigma, cutoff=12)
+    assert_array_almost_equal(Tc.apply(xyz), t, decimal=10)
+    # Typical cutoff: close to exact evaluation
+    Tc = PolyAffine(centers, affines, sigma, cutoff=6)
+    assert_array_almost_equal(Tc.apply(xyz), t, decimal=4)
+    # Composition preserves the cutoff
+    A = Affine(np.array([[1, 0, 0, 1.],
+                         [0, 1, 0, -2.],
+                         [0, 0, 1, .5],
+                         [0, 0, 0, 1.]]))
+    assert_array_almost_equal(Tc.compose(A).apply(xyz),
+                              T.compose(A).apply(xyz), decimal=4)
+    assert_array_almost_equal(A.compose(Tc).apply(xyz),
+                              A.compose(T).apply(xyz), decimal=4)
+
+
+def test_truncated_kernel_isolated_points():
+    # Points far from all centers fall back to exact evaluation
+    centers = np.random.rand(NCENTERS, 3)
+    affines = [random_affine() for i in range(NCENTERS)]
+    xyz = np.random.rand(NPTS, 3) + [3, 0, 0]
+    T = PolyAffine(centers, affines, .5)
+    Tc = PolyAffine(centers, affines, .5, cutoff=2)
+    assert_array_almost_equal(Tc.apply(xyz), T.apply(xyz))
+    # Sparse centers: grid is coarsened
+    centers = np.array([[0, 0, 0], [1e4, 1e4, 1e4], [1e4, 0, 0]])
+    T = PolyAffine(centers, affines[0:3], 1.)
+    Tc = PolyAffine(centers, affines[0:3], 1., cutoff=3)
+    xyz = np.random.rand(NPTS, 3)
+    assert_array_almost_equal(Tc.apply(xyz), T.apply(xyz))
+    Tc = PolyAffine(centers, affines[0:3], 1., cutoff=0)
+    assert_raises(ValueError, Tc.apply, xyz)
@@ -25,6 +25,12 @@ Author : Bertrand Thirion, Yaroslav Halchenko, 2008-2012
 import numpy as np
 from numpy.linalg import pinv
 import scipy.stats as st
+from scipy.special import ndtr
+
+from .histogram import histogram
+
+# default number of bins of HistogramEmpiricalNull
+DEF_HIST_NBINS = 2 ** 16
 
 
 def check_p_values(p_values):
@@ -57,13 +63,27 @@ def check_p_values(p_values):
     return p_values
 
 
-def gaussian_fdr(x):
+def gaussian_fdr(x, axis=None):
     """Return the FDR associated with each value assuming a Gaussian distribution
+
+    Parameters
+    ----------
+    x : ndarray
+        input data, explicitly assumed to be normal distributed under H_0
+    axis : int, optional
+        if None, x is considered as a single map, otherwise each 1d slice
+        along axis is handled as a separate map
+
+    Returns
+    -------
+    q : ndarray
+        The corresponding fdr values, of shape (x.size) if axis is None,
+        of the shape of x otherwise
     """
-    return fdr(st.norm.sf(np.squeeze(x)))
+    return BenjaminiHochberg.from_normal(x, axis).q_values()
 
 
-def gaussian_fdr_threshold(x, alpha=0.05):
+def gaussian_fdr_threshold(x, alpha=0.05, axis=None):
     """Return FDR threshold given normal variates
 
     Given an array x of normal variates, this function returns the
@@ -76,18 +96,20 @@ def gaussian_fdr_threshold(x, alpha=0.05):
         input data
     alpha: float, optional
         desired significance
+    axis : int, optional
+        if None, x is considered as a single map, otherwise one threshold
+        is returned for each 1d slice along axis
 
     Returns
     -------
-    threshold : float
+    threshold : float or ndarray
         threshold, given as a Gaussian critical value
     """
-    pvals = st.norm.sf(x)
-    pth = fdr_threshold(pvals, alpha)
+    pth = BenjaminiHochberg.from_normal(x, axis).threshold(alpha)
     return st.norm.isf(pth)
 
 
-def fdr_threshold(p_values, alpha=0.05):
+def fdr_threshold(p_values, alpha=0.05, axis=None):
     """Return FDR threshold given p values
 
     Parameters
@@ -96,62 +118,171 @@ def fdr_threshold(p_values, alpha=0.05):
         The samples p-value
     alpha : float, optional
         The desired FDR significance
+    axis : int, optional
+        if None, p_values is considered as a single map, otherwise one
+        threshold is returned for each 1d slice along axis
 
     Returns
     -------
-    critical_p_value: float
+    critical_p_value: float or ndarray
         The p value corresponding to the FDR alpha
     """
-    p_values = check_p_values(p_values)
-    n_samples = np.size(p_values)
-    p_corr = alpha / n_samples
-    sp_values = np.sort(p_values)
-    critical_set = sp_values[
-        sp_values < p_corr * np.arange(1, n_samples + 1)]
-    if len(critical_set) > 0:
-        critical_p_value = critical_set.max()
-    else:
-        critical_p_value = p_corr
-    return critical_p_value
+    return BenjaminiHochberg(p_values, axis).threshold(alpha)
 
 
-def fdr(p_values=None, verbose=0):
+def fdr(p_values=None, verbose=0, axis=None):
     """Returns the FDR associated with each p value
 
     Parameters
     -----------
     p_values : ndarray of shape (n)
         The samples p-value
+    axis : int, optional
+        if None, p_values is considered as a single map, otherwise each
+        1d slice along axis is handled as a separate map
 
     Returns
     -------
     q : array of shape(n)
         The corresponding fdr values
     """
-    p_values = check_p_values(p_values)
-    n_samples = p_values.size
-    order = p_values.argsort()
-    sp_values = p_values[order]
-
-    # compute q while in ascending order
-    q = np.minimum(1, n_samples * sp_values / np.arange(1, n_samples + 1))
-    for i in range(n_samples - 1, 0, - 1):
-        q[i - 1] = min(q[i], q[i - 1])
-
-    # reorder the results
-    inverse_order = np.arange(n_samples)
-    inverse_order[order] = np.arange(n_samples)
-    q = q[inverse_order]
+    q = BenjaminiHochberg(p_values, axis).q_values()
 
     if verbose:
         import matplotlib.pylab as mp
         mp.figure()
         mp.xlabel('Input p-value')
-        mp.plot(p_values, q, '.')
+        mp.plot(np.ravel(p_values), np.ravel(q), '.')
         mp.ylabel('Associated fdr')
     return q
 
 
+class BenjaminiHochberg(object):
+    """Benjamini-Hochberg FDR control of one or several maps of p-values
+
+    The p-values are ordered at most once, when the q-values are first
+    requested, and the ordering is reused by subsequent calls.  When only
+    the threshold is needed, only the p-values below alpha are sorted.
+    Floating point input is used in its own precision, without copy when
+    possible.
+    """
+
+    def __init__(self, p_values, axis=None):
+        """Initialize the FDR control object
+
+        Parameters
+        ----------
+        p_values : ndarray
+            The samples p-values
+        axis : int, optional
+            if None, p_values is considered as a single map, otherwise
+            each 1d slice along axis is handled as a separate map
+        """
+        p_values = np.atleast_1d(np.asarray(p_values))
+        if p_values.dtype.kind != 'f':
+            p_values = p_values.astype(np.float64)
+        check_p_values(p_values)
+        if axis is None:
+            p_values = np.ravel(p_values)
+        else:
+            axis = axis % p_values.ndim
+            p_values = np.rollaxis(p_values, axis, p_values.ndim)
+        self.axis = axis
+        self.shape = p_values.shape
+        self.n = self.shape[-1]
+        self.p_values = np.reshape(p_values, (-1, self.n))
+        self._order = None
+        self._sorted = None
+
+    @classmethod
+    def from_normal(cls, x, axis=None):
+        """Build the FDR control object from normal variates
+
+        Parameters
+        ----------
+        x : ndarray
+            input data, explicitly assumed to be normal distributed
+            under H_0
+        axis : int, optional
+            see BenjaminiHochberg
+        """
+        x = np.asarray(x)
+        if x.dtype.kind != 'f':
+            x = x.astype(np.float64)
+        return cls(ndtr(- x), axis)
+
+    def _sort(self):
+        """Order the p-values of each map, only once
+        """
+        if self._order is None:
+            self._order = np.argsort(self.p_values, 1)
+            rows = np.arange(self.p_values.shape[0])[:, np.newaxis]
+            self._sorted = self.p_values[rows, self._order]
+        return self._order, self._sorted
+
+    def _unfold(self, values):
+        """Give values computed on the (n_maps, n) layout the input shape
+        """
+        values = np.reshape(values, self.shape)
+        if self.axis is not None:
+            values = np.rollaxis(values, values.ndim - 1, self.axis)
+        return values
+
+    def q_values(self):
+        """Returns the FDR associated with each p value
+
+        Returns
+        -------
+        q : ndarray
+            the q-values, of shape (n) if axis is None, of the shape of
+            the input p-values otherwise
+        """
+        order, sp_values = self._sort()
+        n_samples = sp_values.dtype.type(self.n)
+        ranks = np.arange(1, self.n + 1, dtype=sp_values.dtype)
+
+        # compute q while in ascending order
+        q = np.minimum(1, n_samples * sp_values / ranks)
+        q = np.minimum.accumulate(q[:, ::-1], 1)[:, ::-1]
+
+        # reorder the results
+        rows = np.arange(q.shape[0])[:, np.newaxis]
+        q_values = np.empty_like(q)
+        q_values[rows, order] = q
+        return self._unfold(q_values)
+
+    def threshold(self, alpha=0.05):
+        """Return the FDR threshold on the p-values
+
+        Parameters
+        ----------
+        alpha : float, optional
+            The desired FDR significance
+
+        Returns
+        -------
+        critical_p_value: float or ndarray
+            The p value corresponding to the FDR alpha, for each map
+        """
+        p_corr = alpha / self.n
+        critical_p_values = np.empty(self.p_values.shape[0])
+        for i, p_values in enumerate(self.p_values):
+            if self._sorted is not None:
+                sp_values = self._sorted[i]
+            else:
+                # p-values above alpha can never be critical
+                sp_values = np.sort(p_values[p_values < alpha])
+            critical_set = sp_values[
+                sp_values < p_corr * np.arange(1, sp_values.size + 1)]
+            if len(critical_set) > 0:
+                critical_p_values[i] = critical_set.max()
+            else:
+                critical_p_values[i] = p_corr
+        if self.axis is None:
+            return critical_p_values[0]
+        return np.reshape(critical_p_values, self.shape[:-1])
+
+
 class NormalEmpiricalNull(object):
     """Class to compute the empirical null normal fit to the data.
 
@@ -171,6 +302,7 @@ class NormalEmpiricalNull(object):
         self.x = np.sort(x)
         self.n = np.size(x)
         self.learned = 0
+        self._efp = None
 
     def learn(self, left=0.2, right=0.8):
         """
@@ -200,10 +332,22 @@ class NormalEmpiricalNull(object):
 
         # generate the histogram
         step = 3.5 * np.std(self.x) / np.exp(np.log(self.n) / 3)
-        bins = max(10, (self.x.max() - self.x.min()) / step)
+        bins = max(10, int((self.x.max() - self.x.min()) / step))
         hist, ledge = np.histogram(x, bins=bins)
+        self._fit_histogram(hist, ledge)
+
+    def _fit_histogram(self, hist, ledge):
+        """Fit the normal null to the histogram of the central data
+
+        Parameters
+        ----------
+        hist: array of shape (bins)
+            the histogram counts
+        ledge: array of shape (bins + 1)
+            the bins edges
+        """
         step = ledge[1] - ledge[0]
-        medge = ledge + 0.5 * step
+        medge = ledge[:-1] + 0.5 * step
 
         # remove null bins
         hist, medge = hist[hist > 0].astype(np.float), medge[hist > 0]
@@ -222,23 +366,39 @@ class NormalEmpiricalNull(object):
         self.p0 = min(1, np.exp(lp0))
         self.sigma = np.sqrt(sqsigma)
         self.sqsigma = sqsigma
+        self.learned = 1
+        self._efp = None
 
     def fdrcurve(self):
         """
         Returns the FDR associated with any point of self.x
+
+        The curve is computed once per fit and reused by later calls.
         """
-        import scipy.stats as st
         if self.learned == 0:
             self.learn()
-        efp = (self.p0 * st.norm.sf(self.x, self.mu, self.sigma)
-               * self.n / np.arange(self.n, 0, - 1))
-        efp = np.minimum(efp, 1)
-        ix = np.argsort(self.x)
-        for i in range(np.size(efp) - 1, 0, - 1):
-            efp[ix[i - 1]] = np.maximum(efp[ix[i]], efp[ix[i - 1]])
-        self.sorted_x = self.x[ix]
-        self.sorted_fdr = efp[ix]
-        return efp
+        if self._efp is None:
+            sorted_x, n_above = self._fdr_support()
+            efp = (self.p0 * st.norm.sf(sorted_x, self.mu, self.sigma)
+                   * self.n / n_above)
+            efp = np.minimum(efp, 1)
+            self._efp = np.maximum.accumulate(efp[::-1])[::-1]
+            self.sorted_x = sorted_x
+            self.sorted_fdr = self._efp
+            self._n_above = n_above
+        return self._efp
+
+    def _fdr_support(self):
+        """Return the points where the FDR curve is computed, in ascending
+        order, and the number of samples greater or equal to each of them
+        """
+        # self.x is sorted, hence x >= self.x[i] for n - i samples
+        return self.x, np.arange(self.n, 0, - 1)
+
+    def _histogram(self, bins):
+        """Return the histogram of the data with the given number of bins
+        """
+        return np.histogram(self.x, bins=bins)
 
     def threshold(self, alpha=0.05, verbose=0):
         """
@@ -263,10 +423,10 @@ class NormalEmpiricalNull(object):
 
         if efp[-1] > alpha:
             print "the maximal value is %f , the corresponding FDR is %f " \
-                    % (self.x[ - 1], efp[ - 1])
+                    % (self.sorted_x[ - 1], efp[ - 1])
             return np.inf
         j = np.argmin(efp[:: - 1] < alpha) + 1
-        return 0.5 * (self.x[ - j] + self.x[ - j + 1])
+        return 0.5 * (self.sorted_x[ - j] + self.sorted_x[ - j + 1])
 
     def uncorrected_threshold(self, alpha=0.001, verbose=0):
         """Compute the threshold corresponding to a specificity alpha for x
@@ -304,26 +464,16 @@ class NormalEmpiricalNull(object):
         -------
         afp : value of array of shape(n)
         """
-        from scipy.stats import norm
         self.fdrcurve()
-        if np.isscalar(theta):
-            if theta > self.sorted_x[ - 1]:
-                return 0
-            maj = np.where(self.sorted_x >= theta)[0][0]
-            efp = (self.p0 * norm.sf(theta, self.mu, self.sigma) * self.n\
-                  / np.sum(self.x >= theta))
-            efp = np.maximum(self.sorted_fdr[maj], efp)
-        else:
-            efp = []
-            for th in theta:
-                if th > self.sorted_x[ - 1]:
-                    efp.append(0)
-                    continue
-                maj = self.sorted_fdr[np.where(self.sorted_x >= th)[0][0]]
-                efp.append(np.maximum(maj, self.p0 * st.norm.sf(th, self.mu,
-                           self.sigma) * self.n / np.sum(self.x >= th)))
-            efp = np.array(efp)
-            #
+        if np.isscalar(theta) and theta > self.sorted_x[ - 1]:
+            return 0
+        # index of the first sample above each theta
+        maj = np.searchsorted(self.sorted_x, theta, 'left')
+        above = maj < self.sorted_x.size
+        maj = np.minimum(maj, self.sorted_x.size - 1)
+        efp = np.maximum(self.sorted_fdr[maj], self.p0 * st.norm.sf(
+                theta, self.mu, self.sigma) * self.n / self._n_above[maj])
+        efp = np.where(above, efp, 0)
         efp = np.minimum(efp, 1)
         return efp
 
@@ -344,9 +494,8 @@ class NormalEmpiricalNull(object):
         """
         if not self.learned:
             self.learn()
-        n = np.size(self.x)
-        bins = max(10, int(2 * np.exp(np.log(n) / 3.)))
-        hist, ledge = np.histogram(self.x, bins=bins)
+        bins = max(10, int(2 * np.exp(np.log(self.n) / 3.)))
+        hist, ledge = self._histogram(bins)
         hist = hist.astype('f') / hist.sum()
         step = ledge[1] - ledge[0]
         medge = ledge + 0.5 * step
@@ -375,7 +524,125 @@ class NormalEmpiricalNull(object):
         ax.set_yticklabels(ax.get_yticks(), fontsize=12)
 
         if efp != None:
-            ax.plot(self.x, np.minimum(alpha, efp), 'k')
+            ax.plot(self.sorted_x, np.minimum(alpha, efp), 'k')
+
+
+class HistogramEmpiricalNull(NormalEmpiricalNull):
+    """Empirical null normal fit computed on a fine histogram of the data.
+
+    The data is binned on a regular grid of nbins bins instead of being
+    kept and sorted, so that very large samples can be handled, possibly
+    streamed in chunks through the update method. The estimated null and
+    FDR curve are then those of the data rounded to the bin centers.
+    """
+
+    def __init__(self, x=None, bounds=None, nbins=DEF_HIST_NBINS):
+        """Initialize a histogram-based empirical null normal object.
+
+        Parameters
+        -----------
+        x : ndarray, optional
+            The data used to estimate the empirical null.
+        bounds : (float, float), optional
+            the range of the histogram. If None, it is set to the range
+            of the first data passed. Values passed later have to be
+            within this range.
+        nbins : int, optional
+            the number of bins of the histogram
+        """
+        self.nbins = int(nbins)
+        self.bounds = bounds
+        self.counts = np.zeros(self.nbins, dtype='uintp')
+        self.n = 0
+        self.min, self.max = np.inf, - np.inf
+        self.learned = 0
+        self._efp = None
+        if x is not None:
+            self.update(x)
+
+    def update(self, x):
+        """Add data to the histogram
+
+        Parameters
+        -----------
+        x : ndarray
+            data within self.bounds
+        """
+        x = np.ravel(x)
+        if x.size == 0:
+            return
+        xmin, xmax = x.min(), x.max()
+        if self.bounds is None:
+            if xmax == xmin:
+                xmax = xmin + 1
+            self.bounds = (float(xmin), float(xmax))
+        elif xmin < self.bounds[0] or xmax > self.bounds[1]:
+            raise ValueError('data out of the histogram bounds')
+        lower, upper = self.bounds
+        index = ((x - lower) * (self.nbins / (upper - lower))).astype('uintp')
+        np.minimum(index, self.nbins - 1, index)
+        h = histogram(index)
+        self.counts[:h.size] += h
+        self.n += x.size
+        self.min = min(self.min, xmin)
+        self.max = max(self.max, xmax)
+        self.learned = 0
+        self._efp = None
+
+    def _centers(self):
+        lower, upper = self.bounds
+        step = (upper - lower) / float(self.nbins)
+        return lower + step * (np.arange(self.nbins) + 0.5)
+
+    def _rebin(self, counts, lower, upper, bins):
+        """Histogram with bins regular bins over [lower, upper] of data
+        with the given fine counts, located at the fine bin centers
+        """
+        ledge = np.linspace(lower, upper, bins + 1)
+        index = np.floor((self._centers() - lower) *
+                         (bins / (upper - lower))).astype(np.int)
+        inside = (counts > 0) & (index >= 0)
+        index = np.minimum(index[inside], bins - 1)
+        hist = np.bincount(index, weights=counts[inside], minlength=bins)
+        return hist, ledge
+
+    def learn(self, left=0.2, right=0.8):
+        """
+        Estimate the proportion, mean and variance of a Gaussian distribution
+        for a fraction of the data, see NormalEmpiricalNull.learn
+        """
+        counts = self.counts.astype(np.float)
+        centers = self._centers()
+        cumcounts = np.cumsum(counts)
+
+        # count the central subsample of x in each fine bin
+        ranks = int(self.n * left), int(self.n * right)
+        central = (np.clip(cumcounts, ranks[0], ranks[1]) -
+                   np.clip(cumcounts - counts, ranks[0], ranks[1]))
+
+        # generate the histogram
+        mean = np.dot(counts, centers) / self.n
+        std = np.sqrt(np.dot(counts, (centers - mean) ** 2) / self.n)
+        step = 3.5 * std / np.exp(np.log(self.n) / 3)
+        bins = max(10, int((self.max - self.min) / step))
+        fine_step = centers[1] - centers[0] if self.nbins > 1 else 1.
+        nonzero = np.where(central > 0)[0]
+        lower = max(self.min, centers[nonzero[0]] - 0.5 * fine_step)
+        upper = min(self.max, centers[nonzero[-1]] + 0.5 * fine_step)
+        hist, ledge = self._rebin(central, lower, upper, bins)
+        self._fit_histogram(hist, ledge)
+
+    def _fdr_support(self):
+        """Return the centers of the non-empty bins and the number of
+        samples in these bins and above
+        """
+        nonzero = self.counts > 0
+        n_above = self.n - np.cumsum(self.counts) + self.counts
+        return self._centers()[nonzero], n_above[nonzero].astype(np.float)
+
+    def _histogram(self, bins):
+        return self._rebin(self.counts.astype(np.float), self.min, self.max,
+                           bins)
 
 
 def three_classes_GMM_fit(x, test=None, alpha=0.01, prior_strength=100,
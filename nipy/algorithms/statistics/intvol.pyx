@@ -16,6 +16,7 @@ from scipy.sparse import dok_matrix
 
 # Array helper
 from nipy.utils.arrays import strides_from
+from nipy.utils.threads import run_threads
 
 # local imports
 from utils import cube_with_strides_center, join_complexes
@@ -337,7 +338,312 @@ cpdef double mu1_edge(double D00, double D01, double D11) nogil:
   return sqrt(D00 - 2*D01 + D11)
 
 
-def EC3d(mask):
+# The slab routines below loop over the cubes (squares) whose first
+# corner lies in rows [i0, i1) of the padded mask, and write the
+# contribution of each row i to out[i * nout:(i + 1) * nout]. A slab
+# reads the mask one row beyond i1, but simplices are only ever counted
+# by the cube at their first corner, so that faces shared by two slabs
+# are counted once, and summing the rows gives the same result
+# whatever the slab decomposition.
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _ec3d_slab(np.npy_intp i0, np.npy_intp i1, np.npy_intp s1,
+                     np.npy_intp s2, np.npy_intp ss0, np.npy_intp ss1,
+                     np.npy_intp ss2, np.npy_intp* fpmask,
+                     np.npy_intp* d4, np.npy_intp ds4,
+                     np.npy_intp* d3, np.npy_intp ds3,
+                     np.npy_intp* d2, np.npy_intp ds2,
+                     double* out) nogil:
+    cdef np.npy_intp i, j, k, l, index, m, l0
+    for i in range(i0, i1):
+        l0 = 0
+        for j in range(s1-1):
+            for k in range(s2-1):
+                index = i*ss0+j*ss1+k*ss2
+                for l in range(ds4):
+                    m = fpmask[index + d4[4*l]]
+                    if m:
+                        m = m * fpmask[index + d4[4*l+1]] \
+                            * fpmask[index + d4[4*l+2]] \
+                            * fpmask[index + d4[4*l+3]]
+                        l0 = l0 - m
+                for l in range(ds3):
+                    m = fpmask[index + d3[3*l]]
+                    if m:
+                        m = m * fpmask[index + d3[3*l+1]] \
+                            * fpmask[index + d3[3*l+2]]
+                        l0 = l0 + m
+                for l in range(ds2):
+                    m = fpmask[index + d2[2*l]]
+                    if m:
+                        m = m * fpmask[index + d2[2*l+1]]
+                        l0 = l0 - m
+        out[i] = l0
+
+
+cdef class _EC3dSlabs:
+    cdef np.ndarray fpmask, d4, d3, d2, out
+    cdef np.npy_intp s1, s2, ss0, ss1, ss2
+
+    def __init__(self, fpmask, d4, d3, d2, out, s1, s2, ss0, ss1, ss2):
+        self.fpmask = fpmask
+        self.d4, self.d3, self.d2 = d4, d3, d2
+        self.out = out
+        self.s1, self.s2 = s1, s2
+        self.ss0, self.ss1, self.ss2 = ss0, ss1, ss2
+
+    def __call__(self, np.npy_intp start, np.npy_intp stop):
+        cdef np.npy_intp* fpmask = <np.npy_intp*>self.fpmask.data
+        cdef np.npy_intp* d4 = <np.npy_intp*>self.d4.data
+        cdef np.npy_intp* d3 = <np.npy_intp*>self.d3.data
+        cdef np.npy_intp* d2 = <np.npy_intp*>self.d2.data
+        cdef np.npy_intp ds4 = self.d4.shape[0], ds3 = self.d3.shape[0]
+        cdef np.npy_intp ds2 = self.d2.shape[0]
+        cdef double* out = <double*>self.out.data
+        with nogil:
+            _ec3d_slab(start, stop, self.s1, self.s2, self.ss0, self.ss1,
+                       self.ss2, fpmask, d4, ds4, d3, ds3, d2, ds2, out)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _lips3d_slab(np.npy_intp i0, np.npy_intp i1, np.npy_intp s1,
+                       np.npy_intp s2, np.npy_intp ss0, np.npy_intp ss1,
+                       np.npy_intp ss2, np.npy_intp ss0d, np.npy_intp ss1d,
+                       np.npy_intp ss2d, np.npy_intp nvox,
+                       np.npy_intp ncoords, double* fcoords,
+                       double* gram, np.npy_intp* pairs,
+                       np.npy_intp* fmask, np.npy_intp* fpmask,
+                       np.npy_intp* cvertices,
+                       np.npy_intp* d4, np.npy_intp ds4,
+                       np.npy_intp* d3, np.npy_intp ds3,
+                       np.npy_intp* d2, np.npy_intp ds2,
+                       double* out) nogil:
+    cdef:
+        double D[8][8]
+        np.npy_intp i, j, k, l, r, s, rr, ss, mr, ms, m, index, pindex
+        np.npy_intp w0, w1, w2, w3, g
+        double l0, l1, l2, l3, res
+    for i in range(i0, i1):
+        l0 = 0; l1 = 0; l2 = 0; l3 = 0
+        for j in range(s1-1):
+            for k in range(s2-1):
+                pindex = i*ss0+j*ss1+k*ss2
+                index = i*ss0d+j*ss1d+k*ss2d
+                for r in range(8):
+                    rr = (index+cvertices[r]) % nvox
+                    mr = fmask[rr]
+                    for s in range(r+1):
+                        res = 0
+                        ss = (index+cvertices[s]) % nvox
+                        ms = fmask[ss]
+                        if mr * ms and gram != NULL:
+                            # precomputed inner products, see LKCAccumulator
+                            g = 2 * (8 * r + s)
+                            res = gram[pairs[g] * nvox
+                                       + (index + pairs[g+1]) % nvox]
+                        elif mr * ms:
+                            for l in range(ncoords):
+                                res += fcoords[l*nvox+ss] * fcoords[l*nvox+rr]
+                        D[r][s] = res
+                        D[s][r] = res
+
+                for l in range(ds4):
+                    m = fpmask[pindex + d4[8*l]]
+                    if m:
+                        m = m * fpmask[pindex + d4[8*l+1]] \
+                            * fpmask[pindex + d4[8*l+2]] \
+                            * fpmask[pindex + d4[8*l+3]]
+                        if not m:
+                            continue
+                        w0 = d4[8*l+4]; w1 = d4[8*l+5]
+                        w2 = d4[8*l+6]; w3 = d4[8*l+7]
+                        l3 = l3 + mu3_tet(D[w0][w0], D[w0][w1], D[w0][w2],
+                                          D[w0][w3], D[w1][w1], D[w1][w2],
+                                          D[w1][w3], D[w2][w2], D[w2][w3],
+                                          D[w3][w3])
+                        l2 = l2 - mu2_tet(D[w0][w0], D[w0][w1], D[w0][w2],
+                                          D[w0][w3], D[w1][w1], D[w1][w2],
+                                          D[w1][w3], D[w2][w2], D[w2][w3],
+                                          D[w3][w3])
+                        l1 = l1 + mu1_tet(D[w0][w0], D[w0][w1], D[w0][w2],
+                                          D[w0][w3], D[w1][w1], D[w1][w2],
+                                          D[w1][w3], D[w2][w2], D[w2][w3],
+                                          D[w3][w3])
+                        l0 = l0 - 1
+
+                for l in range(ds3):
+                    m = fpmask[pindex + d3[6*l]]
+                    if m:
+                        m = m * fpmask[pindex + d3[6*l+1]] \
+                            * fpmask[pindex + d3[6*l+2]]
+                        if not m:
+                            continue
+                        w0 = d3[6*l+3]; w1 = d3[6*l+4]; w2 = d3[6*l+5]
+                        l2 = l2 + mu2_tri(D[w0][w0], D[w0][w1], D[w0][w2],
+                                          D[w1][w1], D[w1][w2], D[w2][w2])
+                        l1 = l1 - mu1_tri(D[w0][w0], D[w0][w1], D[w0][w2],
+                                          D[w1][w1], D[w1][w2], D[w2][w2])
+                        l0 = l0 + 1
+
+                for l in range(ds2):
+                    m = fpmask[pindex + d2[4*l]]
+                    if m:
+                        m = m * fpmask[pindex + d2[4*l+1]]
+                        if not m:
+                            continue
+                        w0 = d2[4*l+2]; w1 = d2[4*l+3]
+                        l1 = l1 + mu1_edge(D[w0][w0], D[w0][w1], D[w1][w1])
+                        l0 = l0 - 1
+        out[4*i] = l0
+        out[4*i+1] = l1
+        out[4*i+2] = l2
+        out[4*i+3] = l3
+
+
+cdef class _Lips3dSlabs:
+    cdef np.ndarray fcoords, gram, pairs, fmask, fpmask, cvertices
+    cdef np.ndarray d4, d3, d2, out
+    cdef np.npy_intp s1, s2, ss0, ss1, ss2, ss0d, ss1d, ss2d
+
+    def __init__(self, fcoords, fmask, fpmask, cvertices, d4, d3, d2, out,
+                 s1, s2, strides, dstrides, gram=None, pairs=None):
+        # Inner products are either computed from fcoords (ncoords, nvox)
+        # or read from gram (ngram, nvox) following pairs
+        self.fcoords = fcoords
+        self.gram, self.pairs = gram, pairs
+        self.fmask, self.fpmask = fmask, fpmask
+        self.cvertices = cvertices
+        self.d4, self.d3, self.d2 = d4, d3, d2
+        self.out = out
+        self.s1, self.s2 = s1, s2
+        self.ss0, self.ss1, self.ss2 = strides
+        self.ss0d, self.ss1d, self.ss2d = dstrides
+
+    def __call__(self, np.npy_intp start, np.npy_intp stop):
+        cdef double* fcoords = <double*>self.fcoords.data
+        cdef np.npy_intp ncoords = self.fcoords.shape[0]
+        cdef np.npy_intp nvox = self.fcoords.shape[1]
+        cdef double* gram = NULL
+        cdef np.npy_intp* pairs = NULL
+        cdef np.npy_intp* fmask = <np.npy_intp*>self.fmask.data
+        cdef np.npy_intp* fpmask = <np.npy_intp*>self.fpmask.data
+        cdef np.npy_intp* cvertices = <np.npy_intp*>self.cvertices.data
+        cdef np.npy_intp* d4 = <np.npy_intp*>self.d4.data
+        cdef np.npy_intp* d3 = <np.npy_intp*>self.d3.data
+        cdef np.npy_intp* d2 = <np.npy_intp*>self.d2.data
+        cdef np.npy_intp ds4 = self.d4.shape[0], ds3 = self.d3.shape[0]
+        cdef np.npy_intp ds2 = self.d2.shape[0]
+        cdef double* out = <double*>self.out.data
+        if self.gram is not None:
+            gram = <double*>self.gram.data
+            pairs = <np.npy_intp*>self.pairs.data
+        with nogil:
+            _lips3d_slab(start, stop, self.s1, self.s2, self.ss0, self.ss1,
+                         self.ss2, self.ss0d, self.ss1d, self.ss2d, nvox,
+                         ncoords, fcoords, gram, pairs, fmask, fpmask,
+                         cvertices, d4, ds4, d3, ds3, d2, ds2, out)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _lips2d_slab(np.npy_intp i0, np.npy_intp i1, np.npy_intp s1,
+                       np.npy_intp ss0, np.npy_intp ss1, np.npy_intp ss0d,
+                       np.npy_intp ss1d, np.npy_intp npix,
+                       np.npy_intp ncoords, double* fcoords,
+                       np.npy_intp* fmask, np.npy_intp* fpmask,
+                       np.npy_intp* cvertices,
+                       np.npy_intp* d3, np.npy_intp ds3,
+                       np.npy_intp* d2, np.npy_intp ds2,
+                       double* out) nogil:
+    cdef:
+        double D[4][4]
+        np.npy_intp i, j, l, r, s, rr, ss, mr, ms, m, index, pindex
+        np.npy_intp w0, w1, w2
+        double l0, l1, l2, res
+    for i in range(i0, i1):
+        l0 = 0; l1 = 0; l2 = 0
+        for j in range(s1-1):
+            pindex = i*ss0+j*ss1
+            index = i*ss0d+j*ss1d
+            for r in range(4):
+                rr = (index+cvertices[r]) % npix
+                mr = fmask[rr]
+                for s in range(r+1):
+                    res = 0
+                    ss = (index+cvertices[s]) % npix
+                    ms = fmask[ss]
+                    if mr * ms:
+                        for l in range(ncoords):
+                            res += fcoords[l*npix+ss] * fcoords[l*npix+rr]
+                    D[r][s] = res
+                    D[s][r] = res
+
+            for l in range(ds3):
+                m = fpmask[pindex + d3[6*l]]
+                if m:
+                    m = m * fpmask[pindex + d3[6*l+1]] \
+                        * fpmask[pindex + d3[6*l+2]]
+                    if not m:
+                        continue
+                    w0 = d3[6*l+3]; w1 = d3[6*l+4]; w2 = d3[6*l+5]
+                    l2 = l2 + mu2_tri(D[w0][w0], D[w0][w1], D[w0][w2],
+                                      D[w1][w1], D[w1][w2], D[w2][w2])
+                    l1 = l1 - mu1_tri(D[w0][w0], D[w0][w1], D[w0][w2],
+                                      D[w1][w1], D[w1][w2], D[w2][w2])
+                    l0 = l0 + 1
+
+            for l in range(ds2):
+                m = fpmask[pindex + d2[4*l]]
+                if m:
+                    m = m * fpmask[pindex + d2[4*l+1]]
+                    if not m:
+                        continue
+                    w0 = d2[4*l+2]; w1 = d2[4*l+3]
+                    l1 = l1 + mu1_edge(D[w0][w0], D[w0][w1], D[w1][w1])
+                    l0 = l0 - 1
+        out[3*i] = l0
+        out[3*i+1] = l1
+        out[3*i+2] = l2
+
+
+cdef class _Lips2dSlabs:
+    cdef np.ndarray fcoords, fmask, fpmask, cvertices, d3, d2, out
+    cdef np.npy_intp s1, ss0, ss1, ss0d, ss1d
+
+    def __init__(self, fcoords, fmask, fpmask, cvertices, d3, d2, out,
+                 s1, strides, dstrides):
+        self.fcoords = fcoords
+        self.fmask, self.fpmask = fmask, fpmask
+        self.cvertices = cvertices
+        self.d3, self.d2 = d3, d2
+        self.out = out
+        self.s1 = s1
+        self.ss0, self.ss1 = strides
+        self.ss0d, self.ss1d = dstrides
+
+    def __call__(self, np.npy_intp start, np.npy_intp stop):
+        cdef double* fcoords = <double*>self.fcoords.data
+        cdef np.npy_intp ncoords = self.fcoords.shape[0]
+        cdef np.npy_intp npix = self.fcoords.shape[1]
+        cdef np.npy_intp* fmask = <np.npy_intp*>self.fmask.data
+        cdef np.npy_intp* fpmask = <np.npy_intp*>self.fpmask.data
+        cdef np.npy_intp* cvertices = <np.npy_intp*>self.cvertices.data
+        cdef np.npy_intp* d3 = <np.npy_intp*>self.d3.data
+        cdef np.npy_intp* d2 = <np.npy_intp*>self.d2.data
+        cdef np.npy_intp ds3 = self.d3.shape[0], ds2 = self.d2.shape[0]
+        cdef double* out = <double*>self.out.data
+        with nogil:
+            _lips2d_slab(start, stop, self.s1, self.ss0, self.ss1, self.ss0d,
+                         self.ss1d, npix, ncoords, fcoords, fmask, fpmask,
+                         cvertices, d3, ds3, d2, ds2, out)
+
+
+def EC3d(mask, nthreads=1):
     """ Compute Euler characteristic of region within `mask`
 
     Given a 3d `mask`, compute the 0th intrinsic volume (Euler characteristic)
@@ -349,6 +655,9 @@ def EC3d(mask):
     ----------
     mask : ndarray((i,j,k), np.int)
          Binary mask determining whether or not a voxel is in the mask.
+    nthreads : int, optional
+         Number of threads processing slabs of the mask along the first
+         axis.
 
     Returns
     -------
@@ -383,9 +692,8 @@ def EC3d(mask):
         np.ndarray[np.intp_t, ndim=2] d3
         np.ndarray[np.intp_t, ndim=2] d4
         # scalars
-        np.npy_intp i, j, k, l, s0, s1, s2, ds2, ds3, ds4, index, m, nvox
+        np.npy_intp s0, s1, s2
         np.npy_intp ss0, ss1, ss2 # strides
-        np.npy_intp v0, v1, v2, v3 # vertices
         np.npy_intp l0 = 0
 
     mask_c = mask
@@ -417,51 +725,23 @@ def EC3d(mask):
     d3 = np.array(list(c[3].difference(union[3])))
     d2 = np.array(list(c[2].difference(union[2])))
 
-    ds2 = d2.shape[0]
-    ds3 = d3.shape[0]
-    ds4 = d4.shape[0]
-
     ss0 = strides[0]
     ss1 = strides[1]
     ss2 = strides[2]
 
-    nvox = mask.size
-
-    for i in range(s0-1):
-        for j in range(s1-1):
-            for k in range(s2-1):
-                index = i*ss0+j*ss1+k*ss2
-                for l in range(ds4):
-                    v0 = index + d4[l,0]
-                    m = fpmask[v0]
-                    if m:
-                        v1 = index + d4[l,1]
-                        v2 = index + d4[l,2]
-                        v3 = index + d4[l,3]
-                        m = m * fpmask[v1] * fpmask[v2] * fpmask[v3]
-                        l0 = l0 - m
-
-                for l in range(ds3):
-                    v0 = index + d3[l,0]
-                    m = fpmask[v0]
-                    if m:
-                        v1 = index + d3[l,1]
-                        v2 = index + d3[l,2]
-                        m = m * fpmask[v1] * fpmask[v2]
-                        l0 = l0 + m
-
-                for l in range(ds2):
-                    v0 = index + d2[l,0]
-                    m = fpmask[v0]
-                    if m:
-                        v1 = index + d2[l,1]
-                        m = m * fpmask[v1]
-                        l0 = l0 - m
+    # Sum the contributions of slabs of cubes
+    out = np.zeros(s0-1)
+    worker = _EC3dSlabs(fpmask, np.ascontiguousarray(d4, np.intp),
+                        np.ascontiguousarray(d3, np.intp),
+                        np.ascontiguousarray(d2, np.intp), out,
+                        s1, s2, ss0, ss1, ss2)
+    run_threads(worker, s0-1, nthreads)
+    l0 = <np.npy_intp> out.sum()
     l0 += mask.sum()
     return l0
 
 
-def Lips3d(coords, mask):
+def Lips3d(coords, mask, nthreads=1):
     """ Estimated intrinsic volumes within masked region given coordinates
 
     Given a 3d `mask` and coordinates `coords`, estimate the intrinsic volumes
@@ -477,6 +757,9 @@ def Lips3d(coords, mask):
     mask : ndarray((i,j,k), np.int)
          Binary mask determining whether or not
          a voxel is in the mask.
+    nthreads : int, optional
+         Number of threads processing slabs of the mask along the first
+         axis.
 
     Returns
     -------
@@ -509,7 +792,7 @@ def Lips3d(coords, mask):
         value = np.zeros(4)
         coords = coords.reshape((coords.shape[0],) + mask.shape)
         if mask.ndim == 2:
-            value[:3] = Lips2d(coords, mask)
+            value[:3] = Lips2d(coords, mask, nthreads)
         elif mask.ndim == 1:
             value[:2] = Lips1d(coords, mask)
         return value
@@ -521,9 +804,18 @@ def Lips3d(coords, mask):
         # c-level versions of the arrays
         np.ndarray[np.float_t, ndim=4] coords_c
         np.ndarray[np.intp_t, ndim=3] mask_c
-        # 'flattened' coords (2d array)
-        np.ndarray[np.float_t, ndim=2] fcoords
-        np.ndarray[np.float_t, ndim=2] D
+    coords_c = coords
+    mask_c = mask
+    fcoords = np.ascontiguousarray(coords_c).reshape((coords_c.shape[0], -1))
+    return _lips3d(fcoords, mask_c, nthreads)
+
+
+def _lips3d(fcoords, mask, nthreads=1, gram=None, pairs=None):
+    """ Intrinsic volumes of the region within 3d `mask`, given either
+    flattened coordinates `fcoords` (N, mask.size), or inner products
+    between neighbouring voxels `gram` (see `LKCAccumulator`)
+    """
+    cdef:
         # 'flattened' mask (1d array)
         np.ndarray[np.intp_t, ndim=1] fmask
         np.ndarray[np.intp_t, ndim=1] fpmask
@@ -538,27 +830,17 @@ def Lips3d(coords, mask):
         np.ndarray[np.intp_t, ndim=2] m2
         np.ndarray[np.intp_t, ndim=1] cvertices
         # scalars
-        np.npy_intp i, j, k, l, s0, s1, s2, ds4, ds3, ds2
-        np.npy_intp index, pindex, m, nvox, r, s, rr, ss, mr, ms
+        np.npy_intp i, j, k, s0, s1, s2
         np.npy_intp ss0, ss1, ss2 # strides
-        np.npy_intp v0, v1, v2, v3 # vertices for mask
-        np.npy_intp w0, w1, w2, w3 # vertices for data
-        double l0, l1, l2, l3
-        double res
-
-    coords_c = coords
-    mask_c = mask
-    l0 = 0; l1 = 0; l2 = 0; l3 = 0
 
     pmask_shape = np.array(mask.shape) + 1
     pmask = np.zeros(pmask_shape, np.int)
-    pmask[:-1,:-1,:-1] = mask_c
+    pmask[:-1,:-1,:-1] = mask
 
     s0, s1, s2 = (pmask.shape[0], pmask.shape[1], pmask.shape[2])
 
     fpmask = pmask.reshape(-1)
-    fmask = mask_c.reshape(-1)
-    fcoords = coords_c.reshape((coords_c.shape[0], -1))
+    fmask = np.ascontiguousarray(mask, np.intp).reshape(-1)
 
     # First do the interior contributions.
     # We first figure out which vertices, edges, triangles, tetrahedra
@@ -594,106 +876,114 @@ def Lips3d(coords, mask):
 
     d4 = np.array([[_convert_stride3(v, strides, (4,2,1)) for v in m4[i]] for i in range(m4.shape[0])])
     d4 = np.hstack([m4, d4])
-    ds4 = d4.shape[0]
 
     d3 = np.array([[_convert_stride3(v, strides, (4,2,1)) for v in m3[i]] for i in range(m3.shape[0])])
     d3 = np.hstack([m3, d3])
-    ds3 = d3.shape[0]
 
     d2 = np.array([[_convert_stride3(v, strides, (4,2,1)) for v in m2[i]] for i in range(m2.shape[0])])
     d2 = np.hstack([m2, d2])
-    ds2 = d2.shape[0]
-
-    nvox = mask.size
-
-    D = np.zeros((8,8))
-
-    for i in range(s0-1):
-        for j in range(s1-1):
-            for k in range(s2-1):
-
-                pindex = i*ss0+j*ss1+k*ss2
-                index = i*ss0d+j*ss1d+k*ss2d
-                for r in range(8):
-                    rr = (index+cvertices[r]) % nvox
-                    mr = fmask[rr]
-                    for s in range(r+1):
-                        res = 0
-                        ss = (index+cvertices[s]) % nvox
-                        ms = fmask[ss]
-                        if mr * ms:
-                            for l in range(fcoords.shape[0]):
-                                res += fcoords[l,ss] * fcoords[l,rr]
-                            D[r,s] = res
-                            D[s,r] = res
-                        else:
-                            D[r,s] = 0
-                            D[s,r] = 0
-
-                for l in range(ds4):
-                    v0 = pindex + d4[l,0]
-                    w0 = d4[l,4]
-                    m = fpmask[v0]
-                    if m:
-                        v1 = pindex + d4[l,1]
-                        v2 = pindex + d4[l,2]
-                        v3 = pindex + d4[l,3]
-                        w1 = d4[l,5]
-                        w2 = d4[l,6]
-                        w3 = d4[l,7]
-
-                        m = m * fpmask[v1] * fpmask[v2] * fpmask[v3]
-
-                        l3 = l3 + m * mu3_tet(D[w0,w0], D[w0,w1], D[w0,w2], 
-                                              D[w0,w3], D[w1,w1], D[w1,w2], 
-                                              D[w1,w3], D[w2,w2], D[w2,w3],
-                                              D[w3,w3])
-
-                        l2 = l2 - m * mu2_tet(D[w0,w0], D[w0,w1], D[w0,w2], 
-                                              D[w0,w3], D[w1,w1], D[w1,w2], 
-                                              D[w1,w3], D[w2,w2], D[w2,w3],
-                                              D[w3,w3])
-
-                        l1 = l1 + m * mu1_tet(D[w0,w0], D[w0,w1], D[w0,w2], 
-                                              D[w0,w3], D[w1,w1], D[w1,w2], 
-                                              D[w1,w3], D[w2,w2], D[w2,w3],
-                                              D[w3,w3])
-
-                        l0 = l0 - m
-
-                for l in range(ds3):
-                    v0 = pindex + d3[l,0]
-                    w0 = d3[l,3]
-                    m = fpmask[v0]
-                    if m:
-                        v1 = pindex + d3[l,1]
-                        v2 = pindex + d3[l,2]
-                        w1 = d3[l,4]
-                        w2 = d3[l,5]
-
-                        m = m * fpmask[v1] * fpmask[v2] 
-                        l2 = l2 + m * mu2_tri(D[w0,w0], D[w0,w1], D[w0,w2], 
-                                              D[w1,w1], D[w1,w2], D[w2,w2]) 
-
-                        l1 = l1 - m * mu1_tri(D[w0,w0], D[w0,w1], D[w0,w2], 
-                                              D[w1,w1], D[w1,w2], D[w2,w2]) 
-
-                        l0 = l0 + m
 
-                for l in range(ds2):
-                    v0 = pindex + d2[l,0]
-                    w0 = d2[l,2]
-                    m = fpmask[v0]
-                    if m:
-                        v1 = pindex + d2[l,1]
-                        w1 = d2[l,3]
-                        m = m * fpmask[v1]
-                        l1 = l1 + m * mu1_edge(D[w0,w0], D[w0,w1], D[w1,w1])
-
-                        l0 = l0 - m
-
-    l0 += mask.sum()
-    return np.array([l0, l1, l2, l3])
+    # Sum the contributions of slabs of cubes
+    out = np.zeros((s0-1, 4))
+    worker = _Lips3dSlabs(fcoords, fmask, fpmask, cvertices,
+                          np.ascontiguousarray(d4, np.intp),
+                          np.ascontiguousarray(d3, np.intp),
+                          np.ascontiguousarray(d2, np.intp), out, s1, s2,
+                          (ss0, ss1, ss2), (ss0d, ss1d, ss2d), gram, pairs)
+    run_threads(worker, s0-1, nthreads)
+    mu = out.sum(0)
+    mu[0] += mask.sum()
+    return mu
+
+
+# Offsets between two corners of a cube, up to sign
+_GRAM_OFFSETS = [(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1)
+                 for k in (-1, 0, 1) if (i, j, k) >= (0, 0, 0)]
+
+
+class LKCAccumulator(object):
+    """ Streaming estimation of the intrinsic volumes of a 3d region
+    from the residuals of a model fit
+
+    The intrinsic volumes estimated by `Lips3d` from the normalized
+    residuals ``resid / sqrt((resid ** 2).sum(0))`` only depend on the
+    inner products between residuals in neighbouring voxels. These are
+    accumulated as residual volumes (or blocks of volumes) are passed to
+    `update`, so that memory is proportional to a few volumes rather
+    than to the number of time points.
+
+    Examples
+    --------
+    >>> mask = np.ones((6, 5, 4), np.int)
+    >>> acc = LKCAccumulator(mask)
+    >>> for resid in np.random.standard_normal((20, 6, 5, 4)):
+    ...     acc.update(resid)
+    >>> mu = acc.intrinsic_volumes()
+
+    ``mu`` can then be passed as the `search` region of the random field
+    statistics in `nipy.algorithms.statistics.rft`.
+    """
+    def __init__(self, mask):
+        mask = np.asarray(mask)
+        if mask.ndim != 3:
+            raise ValueError('mask should be three-dimensional')
+        if not set(np.unique(mask)).issubset([0,1]):
+            raise ValueError('mask should be filled with 0/1 values')
+        self.mask = mask.astype(np.intp)
+        self.gram = np.zeros((len(_GRAM_OFFSETS),) + mask.shape)
+        self.n = 0
+
+    def _pairs(self, offset):
+        """ Slices of voxels u and u + offset within the volume
+        """
+        src, dst = [slice(None)], [slice(None)]
+        for d, size in zip(offset, self.mask.shape):
+            src.append(slice(max(0, -d), size - max(0, d)))
+            dst.append(slice(max(0, d), size - max(0, -d)))
+        return tuple(src), tuple(dst)
+
+    def update(self, resid):
+        """ Accumulate residual volume(s) `resid`, of shape mask.shape or
+        (n,) + mask.shape
+        """
+        resid = np.asarray(resid, dtype=np.float64)
+        if resid.shape == self.mask.shape:
+            resid = resid[None]
+        if resid.shape[1:] != self.mask.shape:
+            raise ValueError('shape of residuals does not match mask')
+        for g, offset in enumerate(_GRAM_OFFSETS):
+            src, dst = self._pairs(offset)
+            self.gram[g][src[1:]] += (resid[src] * resid[dst]).sum(0)
+        self.n += resid.shape[0]
+
+    def intrinsic_volumes(self, nthreads=1):
+        """ Estimated intrinsic volumes [mu0, mu1, mu2, mu3] of the masked
+        region, see `Lips3d`
+        """
+        norm = np.sqrt(self.gram[0])
+        inv_norm = np.zeros(norm.shape)
+        inv_norm[norm > 0] = 1. / norm[norm > 0]
+        # Inner products of the normalized residuals
+        gram = np.zeros(self.gram.shape)
+        for g, offset in enumerate(_GRAM_OFFSETS):
+            src, dst = self._pairs(offset)
+            gram[g][src[1:]] = self.gram[g][src[1:]] * inv_norm[src[1:]] \
+                * inv_norm[dst[1:]]
+        gram = gram.reshape((gram.shape[0], -1))
+        # Gram row and base corner offset of each pair of cube corners,
+        # corners being numbered as in _lips3d
+        dstrides = strides_from(self.mask.shape, np.bool)
+        corners = [(i, j, k) for i in range(2) for j in range(2)
+                   for k in range(2)]
+        pairs = np.zeros((8, 8, 2), np.intp)
+        for r, a in enumerate(corners):
+            for s, b in enumerate(corners):
+                d, base = tuple(np.subtract(b, a)), a
+                if d < (0, 0, 0):
+                    d, base = tuple(np.subtract(a, b)), b
+                pairs[r, s] = (_GRAM_OFFSETS.index(d), np.dot(base, dstrides))
+        return _lips3d(np.zeros((0, gram.shape[1])), self.mask, nthreads,
+                       gram, pairs)
 
 
 def _convert_stride3(v, stride1, stride2):
@@ -727,7 +1017,7 @@ def _convert_stride1(v, stride1, stride2):
     return v0 * stride2[0]
 
 
-def Lips2d(coords, mask):
+def Lips2d(coords, mask, nthreads=1):
     """ Estimate intrinsic volumes for 2d region in `mask` given `coords`
 
     Given a 2d `mask` and coordinates `coords`, estimate the intrinsic volumes
@@ -742,6 +1032,9 @@ def Lips2d(coords, mask):
          dimensional coordinates, but can be any integer > 0
     mask : ndarray((i,j), np.int)
          Binary mask determining whether or not a voxel is in the mask.
+    nthreads : int, optional
+         Number of threads processing slabs of the mask along the first
+         axis.
 
     Returns
     -------
@@ -782,7 +1075,6 @@ def Lips2d(coords, mask):
         np.ndarray[np.intp_t, ndim=2] mask_c
         # 'flattened' coords (2d array)
         np.ndarray[np.float_t, ndim=2] fcoords
-        np.ndarray[np.float_t, ndim=2] D
         # 'flattened' mask (1d array)
         np.ndarray[np.intp_t, ndim=1] fmask
         np.ndarray[np.intp_t, ndim=1] fpmask
@@ -793,16 +1085,11 @@ def Lips2d(coords, mask):
         np.ndarray[np.intp_t, ndim=2] d2
         np.ndarray[np.intp_t, ndim=1] cvertices
         # scalars
-        np.npy_intp i, j, k, l, r, s, rr, ss, mr, ms, s0, s1
-        np.npy_intp ds2, ds3, index, m, npix
+        np.npy_intp i, j, s0, s1
         np.npy_intp ss0, ss1, ss0d, ss1d # strides
-        np.npy_intp v0, v1, v2 # vertices
-        double l0, l1, l2
-        double res
 
     coords_c = coords
     mask_c = mask
-    l0 = 0; l1 = 0; l2 = 0
 
     pmask_shape = np.array(mask.shape) + 1
     pmask = np.zeros(pmask_shape, np.int)
@@ -811,8 +1098,8 @@ def Lips2d(coords, mask):
     s0, s1 = pmask.shape[0], pmask.shape[1]
 
     fpmask = pmask.reshape(-1)
-    fmask = mask_c.reshape(-1)
-    fcoords = coords.reshape((coords.shape[0], -1))
+    fmask = np.ascontiguousarray(mask_c).reshape(-1)
+    fcoords = np.ascontiguousarray(coords_c).reshape((coords_c.shape[0], -1))
 
     # First do the interior contributions.
     # We first figure out which vertices, edges, triangles, tetrahedra
@@ -843,65 +1130,20 @@ def Lips2d(coords, mask):
 
     d3 = np.array([[_convert_stride2(v, strides, (2,1)) for v in m3[i]] for i in range(m3.shape[0])])
     d3 = np.hstack([m3, d3])
-    ds3 = d3.shape[0]
 
     d2 = np.array([[_convert_stride2(v, strides, (2,1)) for v in m2[i]] for i in range(m2.shape[0])])
     d2 = np.hstack([m2, d2])
-    ds2 = d2.shape[0]
-
-    D = np.zeros((4,4))
-
-    npix = mask.size
-
-    for i in range(s0-1):
-        for j in range(s1-1):
-            pindex = i*ss0+j*ss1
-            index = i*ss0d+j*ss1d
-            for r in range(4):
-                rr = (index+cvertices[r]) % npix
-                mr = fmask[rr]
-                for s in range(r+1):
-                    res = 0
-                    ss = (index+cvertices[s]) % npix
-                    ms = fmask[ss]
-                    if mr * ms:
-                        for l in range(fcoords.shape[0]):
-                            res += fcoords[l,ss] * fcoords[l,rr]
-                            D[r,s] = res
-                            D[s,r] = res
-                    else:
-                        D[r,s] = 0
-                        D[s,r] = 0
 
-            for l in range(ds3):
-                v0 = pindex + d3[l,0]
-                w0 = d3[l,3]
-                m = fpmask[v0]
-                if m:
-                    v1 = pindex + d3[l,1]
-                    v2 = pindex + d3[l,2]
-                    w1 = d3[l,4]
-                    w2 = d3[l,5]
-                    m = m * fpmask[v1] * fpmask[v2]
-                    l2 = l2 + mu2_tri(D[w0,w0], D[w0,w1], D[w0,w2],
-                                        D[w1,w1], D[w1,w2], D[w2,w2]) * m
-                    l1 = l1 - mu1_tri(D[w0,w0], D[w0,w1], D[w0,w2],
-                                        D[w1,w1], D[w1,w2], D[w2,w2]) * m
-                    l0 = l0 + m
-
-            for l in range(ds2):
-                v0 = pindex + d2[l,0]
-                w0 = d2[l,2]
-                m = fpmask[v0]
-                if m:
-                    v1 = pindex + d2[l,1]
-                    w1 = d2[l,3]
-                    m = m * fpmask[v1]
-                    l1 = l1 + m * mu1_edge(D[w0,w0], D[w0,w1], D[w1,w1])
-                    l0 = l0 - m
-
-    l0 += mask.sum()
-    return np.array([l0,l1,l2])
+    # Sum the contributions of slabs of squares
+    out = np.zeros((s0-1, 3))
+    worker = _Lips2dSlabs(fcoords, fmask, fpmask, cvertices,
+                          np.ascontiguousarray(d3, np.intp),
+                          np.ascontiguousarray(d2, np.intp), out, s1,
+                          (ss0, ss1), (ss0d, ss1d))
+    run_threads(worker, s0-1, nthreads)
+    mu = out.sum(0)
+    mu[0] += mask.sum()
+    return mu
 
 
 def EC2d(mask):
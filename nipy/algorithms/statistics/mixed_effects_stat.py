@@ -22,7 +22,9 @@ Author: Bertrand Thirion, 2012.
 
 import numpy as np
 
-EPS = 100 * np.finfo(float).eps
+# fraction of converged tests above which they are removed from the
+# working arrays of the EM algorithm
+COMPACT_RATIO = .25
 
 
 def generate_data(X, beta, V2, V1):
@@ -102,7 +104,8 @@ class MixedEffectsModel(object):
     """Class to handle multiple one-sample mixed effects models
     """
 
-    def __init__(self, X, n_iter=5, verbose=False):
+    def __init__(self, X, n_iter=5, verbose=False, tol=None, chunk_size=None,
+                 dtype=np.float64):
         """
         Set the effects and first-level variance,
         and initialize related quantities
@@ -114,11 +117,41 @@ class MixedEffectsModel(object):
         n_iter: int, optional,
                number of iterations of the EM algorithm
         verbose: bool, optional, verbosity mode
+        tol: float, optional,
+             if not None, the EM algorithm is stopped for the tests
+             where the relative change of the group variance and the
+             change of the effects, relative to the group standard
+             deviation, are below tol; the remaining tests are
+             iterated on compacted arrays
+        chunk_size: int, optional,
+                    if not None, the tests are processed by chunks of
+                    chunk_size, to bound the memory used
+        dtype: numpy dtype, optional,
+               the precision of the computations, e.g. np.float32
         """
         self.n_iter = n_iter
         self.verbose = verbose
-        self.X = X
-        self.pinv_X = np.linalg.pinv(X)
+        self.tol = tol
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.X = np.asarray(X, dtype=self.dtype)
+        self.pinv_X = np.linalg.pinv(X).astype(self.dtype)
+
+    def _chunks(self, n_tests):
+        """Yield the slices of the tests processed together"""
+        chunk_size = self.chunk_size or max(n_tests, 1)
+        for start in range(0, n_tests, chunk_size):
+            yield slice(start, min(start + chunk_size, n_tests))
+
+    def _log_like(self, Y, V1, Y_, V2):
+        """ Log-likelihood of (Y, V1), given the fitted values and variances
+        """
+        tvar = V2 + V1
+        logl = np.sum(((Y - Y_) ** 2) / tvar, 0, dtype=np.float64)
+        logl += np.sum(np.log(tvar), 0, dtype=np.float64)
+        logl += np.log(2 * np.pi) * Y.shape[0]
+        logl *= (- 0.5)
+        return logl
 
     def log_like(self, Y, V1):
         """ Compute the log-likelihood of (Y, V1) under the model
@@ -136,11 +169,12 @@ class MixedEffectsModel(object):
               the log-likelihood of the model
         """
         Y, V1 = check_arrays(Y, V1)
-        tvar = self.V2 + V1
-        logl = np.sum(((Y - self.Y_) ** 2) / tvar, 0)
-        logl += np.sum(np.log(tvar), 0)
-        logl += np.log(2 * np.pi) * Y.shape[0]
-        logl *= (- 0.5)
+        logl = np.zeros(Y.shape[1])
+        for chunk in self._chunks(Y.shape[1]):
+            logl[chunk] = self._log_like(
+                np.asarray(Y[:, chunk], dtype=self.dtype),
+                np.asarray(V1[:, chunk], dtype=self.dtype),
+                self.Y_[:, chunk], self.V2[chunk])
         return logl
 
     def predict(self, Y, V1):
@@ -151,25 +185,101 @@ class MixedEffectsModel(object):
         """Return the log_likelihood of the data. See the log_like method"""
         return self.log_like(Y, V1)
 
-    def _one_step(self, Y, V1):
-        """Applies one step of an EM algorithm to estimate self.mean_, self.var
+    def _one_step(self, Y, V1, Y_, V2):
+        """Applies one step of an EM algorithm to estimate the effects and
+        the group variance
 
         Parameters
         ----------
-        Y, array of shape (n_samples, n_tests) or (n_samples)
+        Y, array of shape (n_samples, n_tests)
               the estimated effects
-        V1, array of shape (n_samples, n_tests) or (n_samples)
+        V1, array of shape (n_samples, n_tests)
                  first-level variance
+        Y_, array of shape (n_samples, n_tests)
+            the current fitted values
+        V2, array of shape (n_tests)
+            the current group variance
+
+        Returns
+        -------
+        beta, Y_, V2: the updated effects, fitted values and group variance
         """
         # E step
-        prec = 1. / (self.V2 + V1)
-        Y_ = prec * (self.V2 * Y + V1 * self.Y_)
-        cvar = V1 * self.V2 * prec
+        prec = 1. / (V2 + V1)
+        Y_ = prec * (V2 * Y + V1 * Y_)
+        cvar = V1 * V2 * prec
 
         # M step
-        self.beta_ = np.dot(self.pinv_X, Y_)
-        self.Y_ = np.dot(self.X, self.beta_)
-        self.V2 = np.mean((Y_ - self.Y_) ** 2, 0) + cvar.mean(0)
+        beta = np.dot(self.pinv_X, Y_)
+        fit = np.dot(self.X, beta)
+        V2 = np.mean((Y_ - fit) ** 2, 0) + cvar.mean(0)
+        return beta, fit, V2
+
+    def _fit_chunk(self, Y, V1, chunk):
+        """ Run the EM algorithm on the tests of the given chunk
+        """
+        beta = np.dot(self.pinv_X, Y)
+        Y_ = np.dot(self.X, beta)
+        V2 = np.mean((Y - Y_) ** 2, 0)
+
+        if self.verbose:
+            # relative slack on the likelihood monotonicity check, which
+            # follows the precision of the computation
+            eps = 100 * np.finfo(self.dtype).eps
+            log_like_init = self._log_like(Y, V1, Y_, V2)
+            print('Average log-likelihood: ', log_like_init.mean())
+
+        # working arrays, restricted to the tests that have not converged;
+        # converged tests are frozen, and only removed from the working
+        # arrays once they make up a fraction COMPACT_RATIO of them
+        active = np.arange(Y.shape[1])
+        frozen = np.zeros(Y.shape[1], np.bool)
+        Y_a, V1_a, fit_a, V2_a, beta_a = Y, V1, Y_, V2, beta
+        n_iter = np.zeros(Y.shape[1], np.int)
+        for i in range(self.n_iter):
+            new_beta, fit_a, new_V2 = self._one_step(Y_a, V1_a, fit_a, V2_a)
+            n_iter[active[~frozen]] += 1
+            if self.tol is None:
+                beta_a, V2_a = new_beta, new_V2
+                beta, Y_, V2 = beta_a, fit_a, V2_a
+            else:
+                done = ((np.abs(new_V2 - V2_a) <= self.tol * V2_a) &
+                        (np.abs(new_beta - beta_a).max(0) <=
+                         self.tol * np.sqrt(V2_a)) & ~frozen)
+                beta_a, V2_a = new_beta, new_V2
+                # store the estimates of the tests that converged, or of
+                # all the running tests to monitor the likelihood
+                store = ~frozen if self.verbose else done
+                beta[:, active[store]] = beta_a[:, store]
+                Y_[:, active[store]] = fit_a[:, store]
+                V2[active[store]] = V2_a[store]
+                frozen |= done
+                if frozen.sum() >= COMPACT_RATIO * frozen.size:
+                    keep = ~frozen
+                    active, frozen = active[keep], frozen[keep]
+                    Y_a, V1_a, fit_a = Y_a[:, keep], V1_a[:, keep], fit_a[:, keep]
+                    beta_a, V2_a = beta_a[:, keep], V2_a[keep]
+
+            if self.verbose:
+                log_like_ = self._log_like(Y, V1, Y_, V2)
+                if (log_like_ < log_like_init -
+                    eps * np.abs(log_like_init)).any():
+                    raise ValueError('The log-likelihood cannot decrease')
+                log_like_init = log_like_
+                print ('Iteration %d, average log-likelihood: %f' % (
+                        i, log_like_.mean()))
+            if active.size == 0:
+                break
+
+        if self.tol is not None:
+            store = ~frozen
+            beta[:, active[store]] = beta_a[:, store]
+            Y_[:, active[store]] = fit_a[:, store]
+            V2[active[store]] = V2_a[store]
+        self.beta_[:, chunk] = beta
+        self.Y_[:, chunk] = Y_
+        self.V2[chunk] = V2
+        self.n_iter_[chunk] = n_iter
 
     def fit(self, Y, V1):
         """ Launches the EM algorithm to estimate self
@@ -189,28 +299,20 @@ class MixedEffectsModel(object):
         if self.X.shape[0] != Y.shape[0]:
             raise ValueError('X and Y must have the same numbers of rows')
         Y, V1 = check_arrays(Y, V1)
-        self.beta_ = np.dot(self.pinv_X, Y)
-        self.Y_ = np.dot(self.X, self.beta_)
-        self.V2 = np.mean((Y - self.Y_) ** 2, 0)
-
-        if self.verbose:
-            log_like_init = self.log_like(Y, V1)
-            print('Average log-likelihood: ', log_like_init.mean())
-
-        for i in range(self.n_iter):
-            self._one_step(Y, V1)
-
-            if self.verbose:
-                log_like_ = self.log_like(Y, V1)
-                if (log_like_ < (log_like_init - EPS)).any():
-                    raise ValueError('The log-likelihood cannot decrease')
-                log_like_init = log_like_
-                print ('Iteration %d, average log-likelihood: %f' % (
-                        i, log_like_.mean()))
+        n_tests = Y.shape[1]
+        self.beta_ = np.zeros((self.X.shape[1], n_tests), self.dtype)
+        self.Y_ = np.zeros(Y.shape, self.dtype)
+        self.V2 = np.zeros(n_tests, self.dtype)
+        # number of EM iterations run for each test
+        self.n_iter_ = np.zeros(n_tests, np.int)
+        for chunk in self._chunks(n_tests):
+            self._fit_chunk(np.asarray(Y[:, chunk], dtype=self.dtype),
+                            np.asarray(V1[:, chunk], dtype=self.dtype), chunk)
         return self
 
 
-def two_sample_ftest(Y, V1, group, n_iter=5, verbose=False):
+def two_sample_ftest(Y, V1, group, n_iter=5, verbose=False, tol=None,
+                     chunk_size=None, dtype=np.float64):
     """Returns the mixed effects t-stat for each row of the X
     (one sample test)
     This uses the Formula in Roche et al., NeuroImage 2007
@@ -226,6 +328,8 @@ def two_sample_ftest(Y, V1, group, n_iter=5, verbose=False):
     n_iter: int, optional,
            number of iterations of the EM algorithm
     verbose: bool, optional, verbosity mode
+    tol, chunk_size, dtype: optional,
+                            see MixedEffectsModel
 
     Returns
     -------
@@ -241,10 +345,12 @@ def two_sample_ftest(Y, V1, group, n_iter=5, verbose=False):
     # create design matrices
     X = np.vstack((np.ones_like(group), group)).T
     return mfx_stat(Y, V1, X, 1, n_iter=n_iter, verbose=verbose,
-                    return_t=False, return_f=True)[0]
+                    return_t=False, return_f=True, tol=tol,
+                    chunk_size=chunk_size, dtype=dtype)[0]
 
 
-def two_sample_ttest(Y, V1, group, n_iter=5, verbose=False):
+def two_sample_ttest(Y, V1, group, n_iter=5, verbose=False, tol=None,
+                     chunk_size=None, dtype=np.float64):
     """Returns the mixed effects t-stat for each row of the X
     (one sample test)
     This uses the Formula in Roche et al., NeuroImage 2007
@@ -260,6 +366,8 @@ def two_sample_ttest(Y, V1, group, n_iter=5, verbose=False):
     n_iter: int, optional,
            number of iterations of the EM algorithm
     verbose: bool, optional, verbosity mode
+    tol, chunk_size, dtype: optional,
+                            see MixedEffectsModel
 
     Returns
     -------
@@ -268,10 +376,12 @@ def two_sample_ttest(Y, V1, group, n_iter=5, verbose=False):
     """
     X = np.vstack((np.ones_like(group), group)).T
     return mfx_stat(Y, V1, X, 1, n_iter=n_iter, verbose=verbose,
-                    return_t=True)[0]
+                    return_t=True, tol=tol, chunk_size=chunk_size,
+                    dtype=dtype)[0]
 
 
-def one_sample_ftest(Y, V1, n_iter=5, verbose=False):
+def one_sample_ftest(Y, V1, n_iter=5, verbose=False, tol=None,
+                     chunk_size=None, dtype=np.float64):
     """Returns the mixed effects F-stat for each row of the X
     (one sample test)
     This uses the Formula in Roche et al., NeuroImage 2007
@@ -285,6 +395,8 @@ def one_sample_ftest(Y, V1, n_iter=5, verbose=False):
     n_iter: int, optional,
            number of iterations of the EM algorithm
     verbose: bool, optional, verbosity mode
+    tol, chunk_size, dtype: optional,
+                            see MixedEffectsModel
 
     Returns
     -------
@@ -294,10 +406,12 @@ def one_sample_ftest(Y, V1, n_iter=5, verbose=False):
           sign of the mean for each test (allow for post-hoc signed tests)
     """
     return mfx_stat(Y, V1, np.ones((Y.shape[0], 1)), 0, n_iter=n_iter,
-                    verbose=verbose, return_t=False, return_f=True)[0]
+                    verbose=verbose, return_t=False, return_f=True, tol=tol,
+                    chunk_size=chunk_size, dtype=dtype)[0]
 
 
-def one_sample_ttest(Y, V1, n_iter=5, verbose=False):
+def one_sample_ttest(Y, V1, n_iter=5, verbose=False, tol=None,
+                     chunk_size=None, dtype=np.float64):
     """Returns the mixed effects t-stat for each row of the X
     (one sample test)
     This uses the Formula in Roche et al., NeuroImage 2007
@@ -311,6 +425,8 @@ def one_sample_ttest(Y, V1, n_iter=5, verbose=False):
     n_iter: int, optional,
            number of iterations of the EM algorithm
     verbose: bool, optional, verbosity mode
+    tol, chunk_size, dtype: optional,
+                            see MixedEffectsModel
 
     Returns
     -------
@@ -318,12 +434,14 @@ def one_sample_ttest(Y, V1, n_iter=5, verbose=False):
            statistical values obtained from the likelihood ratio test
     """
     return mfx_stat(Y, V1, np.ones((Y.shape[0], 1)), 0, n_iter=n_iter,
-                    verbose=verbose, return_t=True)[0]
+                    verbose=verbose, return_t=True, tol=tol,
+                    chunk_size=chunk_size, dtype=dtype)[0]
 
 
 def mfx_stat(Y, V1, X, column, n_iter=5, return_t=True,
              return_f=False, return_effect=False,
-             return_var=False, verbose=False):
+             return_var=False, verbose=False, tol=None, chunk_size=None,
+             dtype=np.float64):
     """Run a mixed-effects model test on the column of the design matrix
 
     Parameters
@@ -348,6 +466,13 @@ def mfx_stat(Y, V1, X, column, n_iter=5, return_t=True,
               should one return the variance estimate (False by default)
 
     verbose: bool, optional, verbosity mode
+    tol: float, optional,
+         convergence tolerance of the EM algorithm, see MixedEffectsModel
+    chunk_size: int, optional,
+                if not None, the tests are processed by chunks of
+                chunk_size, to bound the memory used
+    dtype: numpy dtype, optional,
+           the precision of the model estimation, e.g. np.float32
 
     Returns
     -------
@@ -366,14 +491,20 @@ def mfx_stat(Y, V1, X, column, n_iter=5, return_t=True,
     contrast_mask = 1 - np.eye(X.shape[1])[column]
     X0 = X * contrast_mask
 
+    Y, V1 = check_arrays(Y, V1)
+
     # instantiate the mixed effects models
-    model_0 = MixedEffectsModel(X0, n_iter=n_iter, verbose=verbose).fit(Y, V1)
-    model_1 = MixedEffectsModel(X, n_iter=n_iter, verbose=verbose).fit(Y, V1)
+    model_0 = MixedEffectsModel(X0, n_iter=n_iter, verbose=verbose, tol=tol,
+                                chunk_size=chunk_size, dtype=dtype).fit(Y, V1)
+    model_1 = MixedEffectsModel(X, n_iter=n_iter, verbose=verbose, tol=tol,
+                                chunk_size=chunk_size, dtype=dtype).fit(Y, V1)
 
     # compute the log-likelihood ratio statistic
     fstat = 2 * (model_1.log_like(Y, V1) - model_0.log_like(Y, V1))
+    effect = model_1.beta_[column]
+    var = model_1.V2
     fstat = np.maximum(0, fstat)
-    sign = np.sign(model_1.beta_[column])
+    sign = np.sign(effect)
 
     output = ()
     if return_t:
@@ -381,7 +512,7 @@ def mfx_stat(Y, V1, X, column, n_iter=5, return_t=True,
     if return_f:
         output += (fstat,)
     if return_var:
-        output += (model_1.V2,)
+        output += (var,)
     if return_effect:
-        output += (model_1.beta_[column],)
+        output += (effect,)
     return output
@@ -419,6 +419,10 @@ class IntrinsicVolumes(object):
         return self.__class__(mu)
 
 
+# Cached (quasi-)polynomial parts of EC densities, see ECcone._quasi_terms
+_QUASI_CACHE = {}
+
+
 class ECcone(IntrinsicVolumes):
     """ EC approximation to supremum distribution of var==1 Gaussian process
 
@@ -453,26 +457,23 @@ class ECcone(IntrinsicVolumes):
 
         search *= self.product
 
+        # Sum the (quasi-)polynomial parts over dimensions, evaluated with
+        # cached coefficients
+        _rho = np.zeros(x.shape)
         if np.isfinite(self.dfd):
-            q_even = ECquasi([0], m=self.dfd, exponent=0)
-            q_odd = ECquasi([0], m=self.dfd, exponent=0.5)
-        else:
-            q_even = np.poly1d([0])
-            q_odd = np.poly1d([0])
-
+            base = 1 + x**2/self.dfd
         for k in range(search.mu.shape[0]):
-            q = self.quasi(k)
             c = float(search.mu[k]) * np.power(2*np.pi, -(k+1)/2.)
-            if np.isfinite(self.dfd):
-                q_even += q[0] * c
-                q_odd += q[1] * c
-            else:
-                q_even += q * c
-
-        _rho = q_even(x) + q_odd(x)
+            if c == 0:
+                continue
+            for coeffs, exponent in self._quasi_terms(k):
+                term = np.polyval(coeffs, x) * c
+                if exponent != 0:
+                    term = term / np.power(base, exponent)
+                _rho = _rho + term
 
         if np.isfinite(self.dfd):
-            _rho *= np.power(1 + x**2/self.dfd, -(self.dfd-1)/2.)
+            _rho *= np.power(base, -(self.dfd-1)/2.)
         else:
             _rho *= np.exp(-x**2/2.)
 
@@ -513,6 +514,24 @@ class ECcone(IntrinsicVolumes):
                 quasi_polynomials.append(_q)
         return quasi_polynomials
 
+    def _quasi_terms(self, dim):
+        """ (coefficients, exponent) pairs of the (quasi-)polynomial parts
+        of EC density in dimension `dim`, see `quasi`.
+
+        These only depend on `dim`, self.dfd and self.mu, and are cached
+        across calls and instances.
+        """
+        key = (dim, float(self.dfd), self.mu.tostring())
+        if key not in _QUASI_CACHE:
+            q = self.quasi(dim)
+            if np.isfinite(self.dfd):
+                terms = [(np.asarray(_q.coeffs, np.float64), _q.exponent)
+                         for _q in q]
+            else:
+                terms = [(np.asarray(q.coeffs, np.float64), 0.)]
+            _QUASI_CACHE[key] = terms
+        return _QUASI_CACHE[key]
+
     def quasi(self, dim):
         """ (Quasi-)polynomial parts of EC density in dimension `dim`
 
@@ -10,7 +10,8 @@ from nose.tools import assert_true
 
 from ..empirical_pvalue import (
     NormalEmpiricalNull, smoothed_histogram_from_samples, fdr, fdr_threshold, 
-    gaussian_fdr_threshold, gaussian_fdr)
+    gaussian_fdr_threshold, gaussian_fdr, BenjaminiHochberg,
+    HistogramEmpiricalNull)
 
 def setup():
     # Suppress warnings during tests to reduce noise
@@ -31,6 +32,27 @@ def test_efdr():
     np.testing.assert_array_less(-efdr.threshold(alpha=0.05), -2.8)
     np.testing.assert_array_less(-efdr.uncorrected_threshold(alpha=0.001), -2.5)
 
+def test_histogram_efdr():
+    # the histogram-based fit is close to the sample-based one
+    np.random.seed([7])
+    n = 100000
+    x = np.random.randn(n)
+    x[:3000] += 3
+    efdr = NormalEmpiricalNull(x)
+    hefdr = HistogramEmpiricalNull(x)
+    efdr.learn()
+    hefdr.learn()
+    assert_true(np.absolute(hefdr.mu - efdr.mu) < .01)
+    assert_true(np.absolute(hefdr.sigma - efdr.sigma) < .01)
+    assert_true(np.absolute(hefdr.threshold() - efdr.threshold()) < .05)
+    assert_true(np.absolute(hefdr.fdr(3.0) - efdr.fdr(3.0)) < .01)
+    # the data can be streamed in chunks
+    sefdr = HistogramEmpiricalNull(bounds=(x.min(), x.max()))
+    for chunk in np.array_split(x, 5):
+        sefdr.update(chunk)
+    assert_true(sefdr.n == n)
+    assert_true(np.absolute(sefdr.threshold() - hefdr.threshold()) < .01)
+
 def test_smooth_histo():
    n = 100
    x = np.random.randn(n)
@@ -74,6 +96,57 @@ def test_gaussian_fdr_threshold():
     assert_true(ac < 4.0) 
     assert_true(ac > gaussian_fdr_threshold(x, alpha=.1))
 
+def test_efdr_vector():
+    # the fdr of an array of thresholds matches the scalar one
+    np.random.seed([3])
+    x = np.random.randn(10000)
+    x[:300] += 3
+    efdr = NormalEmpiricalNull(x)
+    theta = np.array([-1., 0.5, 2., 3., 20.])
+    q = efdr.fdr(theta)
+    for th, qt in zip(theta, q):
+        assert_true(np.allclose(efdr.fdr(th), qt))
+    assert_true(q[-1] == 0)
+
+def test_fdr_batch():
+    # maps handled at once match maps handled separately
+    np.random.seed([4])
+    x = np.random.rand(3, 100)
+    x[:, :10] *= .05 / 10
+    q = fdr(x, axis=1)
+    pc = fdr_threshold(x, axis=1)
+    assert_true(q.shape == x.shape)
+    assert_true(pc.shape == (3,))
+    for i in range(3):
+        assert_true(np.allclose(q[i], fdr(x[i])))
+        assert_true(pc[i] == fdr_threshold(x[i]))
+    assert_true(np.allclose(fdr(x.T, axis=0), q.T))
+    z = np.random.randn(100, 2) * 2
+    assert_true(np.allclose(gaussian_fdr(z, axis=0)[:, 1], gaussian_fdr(z[:, 1])))
+    assert_true(np.allclose(gaussian_fdr_threshold(z, axis=0)[0],
+                            gaussian_fdr_threshold(z[:, 0])))
+
+def test_fdr_float32():
+    # single precision input is processed as such
+    np.random.seed([5])
+    x = np.random.rand(1000)
+    x[:50] *= 1.e-4
+    q = fdr(x.astype(np.float32))
+    assert_true(q.dtype == np.float32)
+    assert_true(np.allclose(q, fdr(x), rtol=1.e-5))
+
+def test_fdr_reuse():
+    # the threshold is the same before and after sorting the p-values
+    np.random.seed([6])
+    x = np.random.randn(1000)
+    x[:50] += 4
+    bh = BenjaminiHochberg.from_normal(x)
+    pc = bh.threshold(.05)
+    q = bh.q_values()
+    assert_true(bh.threshold(.05) == pc)
+    assert_true(np.allclose(q, gaussian_fdr(x)))
+    assert_true(q[x > gaussian_fdr_threshold(x)].max() <= .05)
+
 if __name__ == "__main__":
     import nose
     nose.run(argv=['', __file__])
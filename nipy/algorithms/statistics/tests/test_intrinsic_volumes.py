@@ -331,6 +331,41 @@ def test_lips3_nans():
     assert_array_equal(np.isnan(phi(e, box1 + box2)), False)
 
 
+def test_lips_nthreads():
+    # Slabs processed by different threads share a row of voxels; faces in
+    # that row must be counted exactly once
+    mask = (np.random.uniform(size=(17, 12, 9)) > 0.3).astype(np.int)
+    coords = np.random.standard_normal((5,) + mask.shape)
+    for nthreads in (2, 3, 16, 40):
+        assert_equal(intvol.EC3d(mask, nthreads), intvol.EC3d(mask))
+        assert_almost_equal(intvol.Lips3d(coords, mask, nthreads),
+                            intvol.Lips3d(coords, mask))
+        assert_almost_equal(intvol.Lips2d(coords[..., 0], mask[..., 0],
+                                          nthreads),
+                            intvol.Lips2d(coords[..., 0], mask[..., 0]))
+    box1, box2, edge1, edge2 = nonintersecting_boxes((20,)*3)
+    c = np.indices((20,)*3).astype(np.float)
+    assert_almost_equal(intvol.Lips3d(c, box1 + box2, 4),
+                        intvol.Lips3d(c, box1) + intvol.Lips3d(c, box2))
+
+
+def test_lkc_accumulator():
+    mask = (np.random.uniform(size=(9, 8, 7)) > 0.2).astype(np.int)
+    resid = np.random.standard_normal((12,) + mask.shape)
+    coords = resid / np.sqrt((resid ** 2).sum(0))
+    expected = intvol.Lips3d(coords, mask)
+    acc = intvol.LKCAccumulator(mask)
+    for r in resid:
+        acc.update(r)
+    assert_equal(acc.n, 12)
+    assert_almost_equal(acc.intrinsic_volumes(), expected)
+    acc = intvol.LKCAccumulator(mask)
+    acc.update(resid[:5])
+    acc.update(resid[5:])
+    assert_almost_equal(acc.intrinsic_volumes(nthreads=3), expected)
+    assert_raises(ValueError, acc.update, resid[:, :-1])
+
+
 def test_slices():
     # Slices have EC 1...
     e = intvol.EC3d
@@ -8,7 +8,7 @@ import numpy.random as nr
 
 from ..mixed_effects_stat import (
     one_sample_ttest, one_sample_ftest, two_sample_ttest, two_sample_ftest, 
-    generate_data, t_stat, mfx_stat)
+    generate_data, t_stat, mfx_stat, MixedEffectsModel)
 
 
 def test_mfx():
@@ -129,7 +129,51 @@ def test_mfx_ftest():
     assert (np.abs(f.mean() - 1) < 1)
     assert f.var() < 10
     assert f.var() > .2
-     
+
+
+
+def test_mfx_convergence():
+    """ test the early stopping, chunked and single precision fits
+    """
+    n_samples, n_tests = 15, 500
+    np.random.seed(1)
+    vardata = np.random.rand(n_samples, n_tests)
+    data = generate_data(np.ones((n_samples, 1)), 0, 1, vardata)
+    X = np.ones((n_samples, 1))
+    model = MixedEffectsModel(X, n_iter=50).fit(data, vardata)
+
+    # chunking does not change the results
+    t1 = one_sample_ttest(data, vardata, n_iter=5)
+    t2 = one_sample_ttest(data, vardata, n_iter=5, chunk_size=64)
+    assert_almost_equal(t1, t2, 12)
+
+    # converged tests stop iterating
+    model_tol = MixedEffectsModel(X, n_iter=50, tol=1.e-6).fit(data, vardata)
+    assert_true((model_tol.n_iter_ < 50).any())
+    assert_true((model_tol.n_iter_ >= 1).all())
+    assert_almost_equal(model_tol.beta_, model.beta_, 3)
+    assert_almost_equal(model_tol.log_like(data, vardata),
+                        model.log_like(data, vardata), 6)
+
+    # single precision
+    t3 = one_sample_ttest(data, vardata, n_iter=5, dtype=np.float32)
+    assert_true(np.abs(t3 - t1).max() < 1.e-3)
+
+
+def test_mfx_verbose_float32():
+    """ the likelihood check of the verbose mode follows the precision
+    """
+    n_samples, n_tests = 15, 2000
+    np.random.seed(1)
+    vardata = np.random.randn(n_samples, n_tests) ** 2
+    data = generate_data(np.ones(n_samples), np.random.randn(n_tests) > 0,
+                         .25, vardata)
+    X = np.ones((n_samples, 1))
+    for tol in (None, 1.e-4):
+        model = MixedEffectsModel(X, n_iter=20, verbose=True, tol=tol,
+                                  dtype=np.float32).fit(data, vardata)
+        assert_true(np.isfinite(model.log_like(data, vardata)).all())
+
 
 if __name__ == "__main__":
     import nose
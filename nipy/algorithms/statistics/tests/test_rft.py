@@ -494,3 +494,25 @@ def test_F3():
                 f1 = rft.FStat(dfn=dfn, dfd=dfd).density(x, dim) 
                 f2 = F(x, dim, dfn=dfn, dfd=dfd)
                 yield assert_almost_equal, f1, f2
+
+
+def test_quasi_cache():
+    # Cached, vectorized evaluation agrees with the quasi-polynomials
+    x = np.linspace(0.1, 5, 31)
+    for dfd in [np.inf, 20]:
+        T = rft.TStat(dfd=dfd)
+        for dim in range(1, 4):
+            q = T.quasi(dim)
+            if np.isfinite(dfd):
+                expected = (q[0](x) + q[1](x)) * \
+                    np.power(1 + x**2/dfd, -(dfd-1)/2.)
+            else:
+                expected = q(x) * np.exp(-x**2/2.)
+            expected *= np.power(2*np.pi, -(dim+1)/2.)
+            assert_almost_equal(T.density(x, dim), expected)
+            assert_almost_equal(T.density(x[3:5], dim), expected[3:5])
+        # Instances with the same parameters share the cache
+        assert T._quasi_terms(2) is rft.TStat(dfd=dfd)._quasi_terms(2)
+    search = [1, 4, 10, 30]
+    F = rft.FStat(dfn=3, dfd=30, search=search)
+    assert_almost_equal(F(x), [F(xx) for xx in x])
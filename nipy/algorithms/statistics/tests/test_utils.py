@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 
 import numpy as np
+from numpy.linalg import LinAlgError
 from scipy.stats import norm
 
-from ..utils import multiple_mahalanobis, z_score, multiple_fast_inv
-from nose.tools import assert_true
+from ..utils import (multiple_mahalanobis, z_score, multiple_fast_inv,
+                     multiple_spd_inv)
+from nose.tools import assert_true, assert_raises
 from numpy.testing import assert_almost_equal, assert_array_almost_equal
 
 def test_z_score():
@@ -42,6 +44,37 @@ def test_multiple_fast_inv():
     assert_almost_equal(X_inv_ref, X_inv)
 
 
+def random_spd(n_samples, dim):
+    X = np.random.randn(n_samples, dim + 2, dim)
+    return np.array([np.dot(x.T, x) for x in X])
+
+
+def test_multiple_spd_inv():
+    for dim in range(1, 7):
+        X = random_spd(50, dim)
+        X_inv_ref = np.array([np.linalg.inv(x) for x in X])
+        assert_almost_equal(multiple_spd_inv(X), X_inv_ref)
+        assert_almost_equal(multiple_fast_inv(X.copy()), X_inv_ref)
+    X[3] = -np.eye(6)
+    assert_raises(LinAlgError, multiple_spd_inv, X)
+    assert_raises(ValueError, multiple_spd_inv, X[:, :5])
+
+
+def test_mahalanobis_small_dims():
+    # closed forms (dim <= 3) and Cholesky (dim > 3) against reference
+    for dim in range(1, 6):
+        x = np.random.randn(dim, 40)
+        A = random_spd(40, dim)
+        mah = np.array([np.dot(x[:, i], np.dot(np.linalg.inv(A[i]), x[:, i]))
+                        for i in range(40)])
+        assert_almost_equal(multiple_mahalanobis(x, A.T.copy()), mah)
+        # single covariance for all samples
+        mah = np.sum(x * np.dot(np.linalg.inv(A[0]), x), 0)
+        assert_almost_equal(multiple_mahalanobis(x, A[0]), mah)
+        A[5] = 0
+        assert_raises(LinAlgError, multiple_mahalanobis, x, A.T.copy())
+
+
 if __name__ == "__main__":
     import nose
     nose.run(argv=['', __file__])
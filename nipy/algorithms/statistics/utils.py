@@ -1,6 +1,7 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 import numpy as np
+from numpy.linalg import LinAlgError
 from scipy.stats import norm
 TINY = 1e-15
 
@@ -72,8 +73,138 @@ def multiple_fast_inv(a):
     return a
 
 
+def _spd_closed_form_inv(a):
+    """ Adjugate and determinant of small symmetric matrices
+
+    Parameters
+    ----------
+    a: array of shape (n_dim, n_dim, n_samples), with n_dim <= 3
+       Symmetric matrices stacked along the last axis. Only the upper
+       triangle is read.
+
+    Returns
+    -------
+    adj: array of shape (n_dim, n_dim, n_samples)
+         Adjugate matrices, such that ``adj / det`` are the inverses
+    det: array of shape (n_samples,)
+         Determinants
+    """
+    dim = a.shape[0]
+    adj = np.zeros(a.shape)
+    if dim == 1:
+        adj[0, 0] = 1
+        det = a[0, 0].copy()
+    elif dim == 2:
+        adj[0, 0], adj[1, 1] = a[1, 1], a[0, 0]
+        adj[0, 1] = adj[1, 0] = - a[0, 1]
+        det = a[0, 0] * a[1, 1] - a[0, 1] ** 2
+    else:
+        adj[0, 0] = a[1, 1] * a[2, 2] - a[1, 2] ** 2
+        adj[1, 1] = a[0, 0] * a[2, 2] - a[0, 2] ** 2
+        adj[2, 2] = a[0, 0] * a[1, 1] - a[0, 1] ** 2
+        adj[0, 1] = adj[1, 0] = a[0, 2] * a[1, 2] - a[0, 1] * a[2, 2]
+        adj[0, 2] = adj[2, 0] = a[0, 1] * a[1, 2] - a[0, 2] * a[1, 1]
+        adj[1, 2] = adj[2, 1] = a[0, 1] * a[0, 2] - a[0, 0] * a[1, 2]
+        det = a[0, 0] * adj[0, 0] + a[0, 1] * adj[0, 1] + a[0, 2] * adj[0, 2]
+    if np.any(det <= 0):
+        raise LinAlgError('Matrices are not positive definite')
+    return adj, det
+
+
+def _spd_cholesky(a):
+    """ Lower Cholesky factors of symmetric positive definite matrices
+
+    The decomposition is vectorized over the samples, so that the
+    Python loop only runs over the matrix dimension.
+
+    Parameters
+    ----------
+    a: array of shape (n_dim, n_dim, n_samples)
+       Symmetric positive definite matrices stacked along the last
+       axis. Only the lower triangle is read.
+
+    Returns
+    -------
+    chol: array of shape (n_dim, n_dim, n_samples)
+          Lower triangular factors, such that ``a[..., i] ==
+          np.dot(chol[..., i], chol[..., i].T)``
+    """
+    dim = a.shape[0]
+    chol = np.zeros(a.shape)
+    for j in range(dim):
+        pivot = a[j, j] - np.sum(chol[j, :j] ** 2, 0)
+        if np.any(pivot <= 0):
+            raise LinAlgError('Matrix Cholesky decomposition failed')
+        chol[j, j] = np.sqrt(pivot)
+        chol[j + 1:, j] = (a[j + 1:, j] -
+                           np.sum(chol[j + 1:, :j] * chol[j, :j], 1)) / \
+                           chol[j, j]
+    return chol
+
+
+def _lower_triangular_inv(chol):
+    """ Inverse of lower triangular matrices stacked along the last axis
+    """
+    dim = chol.shape[0]
+    eye = np.eye(dim)
+    inv = np.zeros(chol.shape)
+    for i in range(dim):
+        inv[i] = (eye[i][:, np.newaxis] -
+                  np.sum(chol[i, :i, np.newaxis] * inv[:i], 0)) / chol[i, i]
+    return inv
+
+
+def multiple_spd_inv(a):
+    """Compute the inverse of a set of symmetric positive definite arrays
+
+    Unlike `multiple_fast_inv`, the computation is vectorized across
+    samples: closed forms are used for matrices of dimension up to 3,
+    and a Cholesky decomposition otherwise.
+
+    Parameters
+    ----------
+    a: array_like of shape (n_samples, n_dim, n_dim)
+        Set of symmetric positive definite matrices to be inverted.
+
+    Returns
+    -------
+    inv: ndarray of shape (n_samples, n_dim, n_dim)
+       yielding the inverse of the inputs
+
+    Raises
+    ------
+    LinAlgError :
+        If some matrices are not positive definite.
+    ValueError :
+        If `a` is not square.
+    """
+    a = np.asarray(a)
+    if a.ndim != 3 or a.shape[1] != a.shape[2]:
+        raise ValueError('a must have shape(n_samples, n_dim, n_dim)')
+    # Work with the samples along the last axis; symmetry makes the
+    # transposition of each matrix harmless
+    at = a.T
+    dim = at.shape[0]
+    if dim <= 3:
+        adj, det = _spd_closed_form_inv(at)
+        inv = adj / det
+    else:
+        linv = _lower_triangular_inv(_spd_cholesky(at))
+        inv = np.zeros(at.shape)
+        for j in range(dim):
+            for k in range(j, dim):
+                inv[j, k] = np.sum(linv[k:, j] * linv[k:, k], 0)
+                inv[k, j] = inv[j, k]
+    return np.ascontiguousarray(inv.T)
+
+
 def multiple_mahalanobis(effect, covariance):
     """Returns the squared Mahalanobis distance for a given set of samples
+
+    The covariance matrices are assumed to be symmetric positive
+    definite. The distances are computed with array operations over
+    all samples at once: closed forms are used when n_features <= 3,
+    and triangular solves on Cholesky factors otherwise.
     
     Parameters
     ----------
@@ -86,6 +217,13 @@ def multiple_mahalanobis(effect, covariance):
     -------
     sqd: array of shape (n_samples,)
          the squared distances (one per sample)
+
+    Raises
+    ------
+    LinAlgError :
+        If some covariance matrices are not positive definite.
+    ValueError :
+        If the shapes of `effect` and `covariance` are inconsistent.
     """ 
     # check size
     if effect.ndim == 1:
@@ -97,15 +235,19 @@ def multiple_mahalanobis(effect, covariance):
     if covariance.shape[0] != covariance.shape[1]:
         raise ValueError('Inconsistant shape for covariance')
 
-    # transpose and make contuguous for the sake of speed
-    Xt, Kt = np.ascontiguousarray(effect.T), np.ascontiguousarray(covariance.T)
-
-    # compute the inverse of the covariances
-    Kt = multiple_fast_inv(Kt)
-    
-    # derive the squared Mahalanobis distances
-    sqd = np.sum(np.sum(Xt[:, :, np.newaxis] * Xt[:, np.newaxis] * Kt, 1), 1)
-    return sqd
+    dim = covariance.shape[0]
+    if dim <= 3:
+        # quadratic form of the adjugate, divided by the determinant
+        adj, det = _spd_closed_form_inv(covariance)
+        sqd = np.sum(np.sum(effect[:, np.newaxis] * effect * adj, 0), 0)
+        return sqd / det
+
+    # solve chol * y = effect, then |y|^2 = effect^t inv(covariance) effect
+    chol = _spd_cholesky(covariance)
+    y = np.zeros(np.broadcast(effect, chol[0]).shape)
+    for i in range(dim):
+        y[i] = (effect[i] - np.sum(chol[i, :i] * y[:i], 0)) / chol[i, i]
+    return np.sum(y ** 2, 0)
 
 
 # Taken from python doc site, exists in python2.6
@@ -3,12 +3,70 @@
 """
 this module contains a function to perform fast distance computation on arrays
 
+The distances are computed by blocks of rows, so that the temporaries never
+exceed BLOCK_SIZE elements; euclidean_distance_knn and
+euclidean_distance_radius do not allocate the full distance matrix at all.
+
 Author : Bertrand Thirion, 2008-2011
 """
 import numpy as np
 
+# maximal number of elements of the temporary distance blocks
+BLOCK_SIZE = 2 ** 20
+
+
+def _check_arrays(X, Y, dtype):
+    """ Casts X and Y to 2D arrays of type dtype and checks their shapes
+    """
+    X = np.asarray(X, dtype)
+    if Y is None:
+        Y = X
+    else:
+        Y = np.asarray(Y, dtype)
+    if X.ndim == 1:
+        X = np.reshape(X, (X.size, 1))
+    if Y.ndim == 1:
+        Y = np.reshape(Y, (Y.size, 1))
+    if X.shape[1] != Y.shape[1]:
+        raise ValueError("incompatible dimension for X and Y matrices")
+    return X, Y
+
 
-def euclidean_distance(X, Y=None):
+def _distance_blocks(X, Y, block_size=None, out=None):
+    """ Yields the slices of rows of X and the corresponding blocks of the
+    distance matrix between the rows of X and Y, which are views on out if
+    it is provided
+    """
+    n1, n2 = X.shape[0], Y.shape[0]
+    if block_size is None:
+        block_size = max(1, BLOCK_SIZE // max(n2, 1))
+    NX = np.reshape(np.sum(X * X, 1), (n1, 1))
+    NY = np.reshape(np.sum(Y * Y, 1), (1, n2))
+    for start in range(0, n1, block_size):
+        rows = slice(start, min(start + block_size, n1))
+        if out is None:
+            yield rows, _distance_block(X[rows], Y, NX[rows], NY)
+        else:
+            yield rows, _distance_block(X[rows], Y, NX[rows], NY, out[rows])
+
+
+def _distance_block(X, Y, NX, NY, out=None):
+    """ Distance matrix between the rows of X and Y, with squared norms NX
+    and NY, written in out if provided
+    """
+    if out is None:
+        out = np.empty((X.shape[0], Y.shape[0]), X.dtype)
+    np.add(NX, NY, out)
+    XY = np.dot(X, Y.T)
+    XY *= 2
+    out -= XY
+    np.maximum(out, 0, out)
+    np.sqrt(out, out)
+    return out
+
+
+def euclidean_distance(X, Y=None, out=None, dtype=np.float64,
+                       block_size=None):
     """
     Considering the rows of X (and Y=X) as vectors, compute the
     distance matrix between each pair of vectors
@@ -18,23 +76,101 @@ def euclidean_distance(X, Y=None):
     X, array of shape (n1,p)
     Y=None, array of shape (n2,p)
             if Y==None, then Y=X is used instead
+    out=None, array of shape (n1, n2), optional
+              preallocated output array
+    dtype=np.float64, the precision of the computation, e.g. np.float32
+    block_size=None, int, optional
+                     number of rows of X processed at once; by default
+                     the temporaries have at most BLOCK_SIZE elements
 
     Returns
     -------
     ED, array fo shape(n1, n2) with all the pairwise distance
     """
-    if Y == None:
-        Y = X
-    if X.shape[1] != Y.shape[1]:
-        raise ValueError("incompatible dimension for X and Y matrices")
+    X, Y = _check_arrays(X, Y, dtype)
+    n1, n2 = X.shape[0], Y.shape[0]
+    if out is None:
+        out = np.empty((n1, n2), X.dtype)
+    elif out.shape != (n1, n2):
+        raise ValueError("out should have shape (%d, %d)" % (n1, n2))
+    direct = out if out.dtype == X.dtype else None
+    for rows, block in _distance_blocks(X, Y, block_size, direct):
+        if direct is None:
+            out[rows] = block
+    return out
 
-    n1 = X.shape[0]
-    n2 = Y.shape[0]
-    NX = np.reshape(np.sum(X * X, 1), (n1, 1))
-    NY = np.reshape(np.sum(Y * Y, 1), (1, n2))
-    ED = np.repeat(NX, n2, 1)
-    ED += np.repeat(NY, n1, 0)
-    ED -= 2 * np.dot(X, Y.T)
-    ED = np.maximum(ED, 0)
-    ED = np.sqrt(ED)
-    return ED
+
+def euclidean_distance_knn(X, Y=None, k=1, dtype=np.float64,
+                           block_size=None):
+    """
+    Returns the k smallest distances between each row of X and the rows
+    of Y, without allocating the whole distance matrix
+
+    Parameters
+    ----------
+    X, array of shape (n1,p)
+    Y=None, array of shape (n2,p)
+            if Y==None, then Y=X is used instead
+    k=1, int, the number of neighbours per row, at most n2
+    dtype=np.float64, the precision of the computation, e.g. np.float32
+    block_size=None, int, optional, see euclidean_distance
+
+    Returns
+    -------
+    dist, array of shape(n1, k): the sorted distances of the k nearest
+          rows of Y to each row of X
+    idx, array of shape(n1, k): the indexes of these rows in Y
+    """
+    X, Y = _check_arrays(X, Y, dtype)
+    n1, n2 = X.shape[0], Y.shape[0]
+    k = int(k)
+    if k < 1 or k > n2:
+        raise ValueError("k should be between 1 and %d" % n2)
+    dist = np.empty((n1, k), X.dtype)
+    idx = np.empty((n1, k), np.int)
+    for rows, block in _distance_blocks(X, Y, block_size):
+        if k < n2:
+            neighb = np.argpartition(block, k - 1, 1)[:, :k]
+        else:
+            neighb = np.tile(np.arange(n2), (block.shape[0], 1))
+        block_dist = block[np.arange(block.shape[0])[:, np.newaxis], neighb]
+        order = np.argsort(block_dist, 1)
+        ranks = np.arange(block.shape[0])[:, np.newaxis]
+        dist[rows] = block_dist[ranks, order]
+        idx[rows] = neighb[ranks, order]
+    return dist, idx
+
+
+def euclidean_distance_radius(X, Y=None, radius=1., dtype=np.float64,
+                              block_size=None):
+    """
+    Returns the distances between the rows of X and Y that are smaller
+    than radius, without allocating the whole distance matrix
+
+    Parameters
+    ----------
+    X, array of shape (n1,p)
+    Y=None, array of shape (n2,p)
+            if Y==None, then Y=X is used instead
+    radius=1., float, the distance threshold (strict)
+    dtype=np.float64, the precision of the computation, e.g. np.float32
+    block_size=None, int, optional, see euclidean_distance
+
+    Returns
+    -------
+    i, array of shape(n_pairs): indexes of the rows of X
+    j, array of shape(n_pairs): indexes of the rows of Y
+    dist, array of shape(n_pairs): the corresponding distances,
+          sorted by i, then j
+    """
+    X, Y = _check_arrays(X, Y, dtype)
+    i, j, dist = [], [], []
+    for rows, block in _distance_blocks(X, Y, block_size):
+        bi, bj = np.nonzero(block < radius)
+        i.append(bi + rows.start)
+        j.append(bj)
+        dist.append(block[bi, bj])
+    if len(i) == 0:
+        return (np.zeros(0, np.int), np.zeros(0, np.int),
+                np.zeros(0, X.dtype))
+    return np.hstack(i), np.hstack(j), np.hstack(dist)
@@ -4,9 +4,10 @@
 Test the fast distance estimator
 """
 import numpy as np
-from numpy.testing import assert_almost_equal
+from numpy.testing import assert_almost_equal, assert_array_equal
 
 from ..fast_distance import euclidean_distance as ed 
+from ..fast_distance import euclidean_distance_knn, euclidean_distance_radius
 
 def test_euclidean_1():
     """ test that the euclidean distance is as expected
@@ -34,7 +35,44 @@ def test_euclidean_2():
 	
     assert_almost_equal(ED, ref) 
 
-  
+
+def test_euclidean_blocks():
+    """ test that the blocked, preallocated and float32 distances
+    are consistent
+    """
+    X = np.random.randn(30, 3)
+    Y = np.random.randn(20, 3)
+    ref = ed(X, Y)
+    assert_almost_equal(ed(X, Y, block_size=7), ref)
+    out = np.zeros((30, 20), np.float32)
+    ed(X, Y, out=out, block_size=4)
+    assert_almost_equal(out, ref, 5)
+    assert_almost_equal(ed(X, Y, dtype=np.float32), ref, 5)
+
+
+def test_euclidean_knn():
+    """ test the k smallest distances against the sorted distance matrix
+    """
+    X = np.random.randn(30, 3)
+    Y = np.random.randn(20, 3)
+    ref = ed(X, Y)
+    for k in [1, 5, 20]:
+        dist, idx = euclidean_distance_knn(X, Y, k, block_size=7)
+        assert_almost_equal(dist, np.sort(ref, 1)[:, :k])
+        assert_almost_equal(dist, ref[np.arange(30)[:, np.newaxis], idx])
+
+
+def test_euclidean_radius():
+    """ test the distances below a radius against the distance matrix
+    """
+    X = np.random.randn(30, 3)
+    Y = np.random.randn(20, 3)
+    ref = ed(X, Y)
+    i, j, dist = euclidean_distance_radius(X, Y, 1., block_size=7)
+    assert_array_equal(np.vstack((i, j)), np.nonzero(ref < 1.))
+    assert_almost_equal(dist, ref[ref < 1.])
+
+
 if __name__ == "__main__":
     import nose
     nose.run(argv=['', __file__])
@@ -94,8 +94,8 @@ Dependencies
 To run NIPY, you will need:
 
 * python_ >= 2.5 (tested with 2.5, 2.6, 2.7, 3.2, 3.3)
-* numpy_ >= 1.2
-* scipy_ >= 0.7.0
+* numpy_ >= 1.8
+* scipy_ >= 0.12.0
 * sympy_ >= 0.6.6
 * nibabel_ >= 1.2
 
@@ -142,8 +142,8 @@ REQUIRES            = ["numpy", "scipy", "sympy"]
 STATUS              = 'beta'
 
 # versions
-NUMPY_MIN_VERSION='1.2'
-SCIPY_MIN_VERSION = '0.7'
+NUMPY_MIN_VERSION='1.8'
+SCIPY_MIN_VERSION = '0.12'
 NIBABEL_MIN_VERSION = '1.2'
 SYMPY_MIN_VERSION = '0.6.6'
 MAYAVI_MIN_VERSION = '3.0'
@@ -44,11 +44,11 @@ cdef extern from "fff_onesample_stat.h":
 
   fff_onesample_stat* fff_onesample_stat_new(size_t n, fff_onesample_stat_flag flag, double base)
   void fff_onesample_stat_delete(fff_onesample_stat* thisone)
-  double fff_onesample_stat_eval(fff_onesample_stat* thisone, fff_vector* x)
+  double fff_onesample_stat_eval(fff_onesample_stat* thisone, fff_vector* x) nogil
 
   fff_onesample_stat_mfx* fff_onesample_stat_mfx_new(size_t n, fff_onesample_stat_flag flag, double base) 
   void fff_onesample_stat_mfx_delete(fff_onesample_stat_mfx* thisone) 
-  double fff_onesample_stat_mfx_eval(fff_onesample_stat_mfx* thisone, fff_vector* x, fff_vector* vx)
+  double fff_onesample_stat_mfx_eval(fff_onesample_stat_mfx* thisone, fff_vector* x, fff_vector* vx) nogil
 
   void fff_onesample_stat_mfx_pdf_fit(fff_vector* w, fff_vector* z,
                                       fff_onesample_stat_mfx* thisone, 
@@ -57,13 +57,15 @@ cdef extern from "fff_onesample_stat.h":
                                        fff_onesample_stat_mfx* thisone, 
                                        fff_vector* x, fff_vector* vx)
 
-  void fff_onesample_permute_signs(fff_vector* xx, fff_vector* x, double magic)
+  void fff_onesample_permute_signs(fff_vector* xx, fff_vector* x, double magic) nogil
 
 # Initialize numpy
 fffpy_import_array()
 import_array()
 import numpy as np
 
+from nipy.utils.threads import run_threads
+
 
 # Stat dictionary
 stats = {'mean': FFF_ONESAMPLE_EMPIRICAL_MEAN,
@@ -84,149 +86,153 @@ stats = {'mean': FFF_ONESAMPLE_EMPIRICAL_MEAN,
          'elr_mfx': FFF_ONESAMPLE_ELR_MFX}
 
 
+def _magic_numbers(Magics):
+  """
+  Return the magic numbers as a contiguous double array.
+  """
+  if Magics is None:
+    return np.zeros(1) ## Just to make sure
+  return np.ascontiguousarray(np.ravel(Magics), dtype='double')
+
+
+cdef size_t _nvoxels(ndarray Y, int axis):
+  cdef fffpy_multi_iterator* multi
+  cdef size_t size
+  multi = fffpy_multi_iterator_new(1, axis, <void*>Y)
+  size = multi.size
+  fffpy_multi_iterator_delete(multi)
+  return size
+
+
+cdef class _StatSlabs:
+  """
+  Evaluate a one-sample statistic, with or without mixed-effect
+  correction, on a range of voxels. Each call builds its own iterator
+  and workspace, so that distinct ranges may be processed in parallel
+  threads.
+  """
+  cdef ndarray Y, V, T, Magics
+  cdef fff_onesample_stat_flag flag_stat
+  cdef double base
+  cdef int axis, mfx
+  cdef unsigned int n, niter
+
+  def __cinit__(self, ndarray Y, ndarray V, ndarray T, ndarray Magics,
+                int flag_stat, double base, int axis, unsigned int niter):
+    self.Y = Y
+    self.V = V
+    self.T = T
+    self.Magics = Magics
+    self.flag_stat = <fff_onesample_stat_flag>flag_stat
+    self.base = base
+    self.axis = axis
+    self.mfx = V is not None
+    self.n = <unsigned int>Y.shape[axis]
+    self.niter = niter
+
+  def __call__(self, size_t start, size_t stop):
+    cdef fff_vector *y, *v, *t, *yp
+    cdef fff_onesample_stat* stat = NULL
+    cdef fff_onesample_stat_mfx* stat_mfx = NULL
+    cdef unsigned long int simu, nsimu, idx
+    cdef double *magics
+    cdef fffpy_multi_iterator* multi
+
+    # Multi-iterator and local structures
+    if self.mfx:
+      multi = fffpy_multi_iterator_new(3, self.axis, <void*>self.Y,
+                                       <void*>self.V, <void*>self.T)
+      stat_mfx = fff_onesample_stat_mfx_new(self.n, self.flag_stat, self.base)
+      stat_mfx.niter = self.niter
+    else:
+      multi = fffpy_multi_iterator_new(2, self.axis, <void*>self.Y,
+                                       <void*>self.T)
+      stat = fff_onesample_stat_new(self.n, self.flag_stat, self.base)
+    yp = fff_vector_new(self.n)
+    magics = <double*>self.Magics.data
+    nsimu = self.Magics.shape[0]
+
+    # Vector views
+    y = multi.vector[0]
+    v = multi.vector[1]
+    t = multi.vector[multi.narr - 1]
+
+    # Loop
+    with nogil:
+      for simu from 0 <= simu < nsimu:
+        fffpy_multi_iterator_goto(multi, start)
+        idx = simu*t.stride
+        while(multi.index < stop):
+          fff_onesample_permute_signs(yp, y, magics[simu])
+          if stat_mfx != NULL:
+            t.data[idx] = fff_onesample_stat_mfx_eval(stat_mfx, yp, v)
+          else:
+            t.data[idx] = fff_onesample_stat_eval(stat, yp)
+          fffpy_multi_iterator_update(multi)
+
+    # Free memory
+    fffpy_multi_iterator_delete(multi)
+    fff_vector_delete(yp)
+    if stat_mfx != NULL:
+      fff_onesample_stat_mfx_delete(stat_mfx)
+    else:
+      fff_onesample_stat_delete(stat)
+
+
 # Test stat without mixed-effect correction
 def stat(ndarray Y, id='student', double base=0.0,
-         int axis=0, ndarray Magics=None):
+         int axis=0, ndarray Magics=None, nthreads=1):
   """
-  T = stat(Y, id='student', base=0.0, axis=0, magics=None).
+  T = stat(Y, id='student', base=0.0, axis=0, magics=None, nthreads=1).
   
   Compute a one-sample test statistic over a number of deterministic
-  or random permutations. 
+  or random permutations. The voxels are shared between `nthreads`
+  threads.
   """
-  cdef fff_vector *y, *t, *magics, *yp
-  cdef fff_onesample_stat* stat
-  cdef fff_onesample_stat_flag flag_stat = stats[id]
-  cdef unsigned int n
-  cdef unsigned long int simu, nsimu, idx
-  cdef double magic
-  cdef fffpy_multi_iterator* multi
+  Y = np.asarray(Y, dtype='double')
+  Magics = _magic_numbers(Magics)
 
-  # Get number of observations
-  n = <unsigned int>Y.shape[axis]
-
-  # Read out magic numbers
-  if Magics == None:
-    magics = fff_vector_new(1)
-    magics.data[0] = 0 ## Just to make sure
-  else:
-    magics = fff_vector_fromPyArray(Magics)
-    
   # Create output array
-  nsimu = magics.size
   dims = [Y.shape[i] for i in range(Y.ndim)]
-  dims[axis] = nsimu 
+  dims[axis] = Magics.size
   T = np.zeros(dims)
 
-  # Create local structure
-  stat = fff_onesample_stat_new(n, flag_stat, base)
-  yp = fff_vector_new(n)
-
-  # Multi-iterator 
-  multi = fffpy_multi_iterator_new(2, axis, <void*>Y, <void*>T)
-
-  # Vector views
-  y = multi.vector[0]
-  t = multi.vector[1]
-  
   # Loop
-  for simu from 0 <= simu < nsimu:
-    
-    # Set the magic number
-    magic = magics.data[simu*magics.stride]
-      
-    # Reset the multi-iterator
-    fffpy_multi_iterator_reset(multi); 
-    
-    # Perform the loop 
-    idx = simu*t.stride
-    while(multi.index < multi.size):
-      fff_onesample_permute_signs(yp, y, magic)
-      t.data[idx] = fff_onesample_stat_eval(stat, yp)
-      fffpy_multi_iterator_update(multi)
-
-  # Free memory 
-  fffpy_multi_iterator_delete(multi)
-  fff_vector_delete(yp)
-  fff_vector_delete(magics)
-  fff_onesample_stat_delete(stat)
+  worker = _StatSlabs(Y, None, T, Magics, stats[id], base, axis, 0)
+  run_threads(worker, _nvoxels(Y, axis), nthreads)
 
   # Return
   return T
 
 
 def stat_mfx(ndarray Y, ndarray V, id='student_mfx', double base=0.0,
-             int axis=0, ndarray Magics=None, unsigned int niter=5):
+             int axis=0, ndarray Magics=None, unsigned int niter=5,
+             nthreads=1):
   """
-  T = stat_mfx(Y, V, id='student_mfx', base=0.0, axis=0, magics=None, niter=5).
+  T = stat_mfx(Y, V, id='student_mfx', base=0.0, axis=0, magics=None, niter=5,
+               nthreads=1).
   
   Compute a one-sample test statistic, with mixed-effect correction,
-  over a number of deterministic or random permutations.
+  over a number of deterministic or random permutations. The voxels
+  are shared between `nthreads` threads.
   """
-  cdef fff_vector *y, *v, *t, *magics, *yp
-  cdef fff_onesample_stat_mfx* stat
-  cdef fff_onesample_stat_flag flag_stat = stats[id]
-  cdef int n
-  cdef unsigned long int nsimu_max, simu, idx
-  cdef double magic
-  cdef fffpy_multi_iterator* multi
-
-  # Get number of observations
-  n = <int>Y.shape[axis]
+  Y = np.asarray(Y, dtype='double')
+  V = np.asarray(V, dtype='double')
+  Magics = _magic_numbers(Magics)
 
-  # Read out magic numbers
-  if Magics == None:
-    magics = fff_vector_new(1)
-    magics.data[0] = 0 ## Just to make sure
-  else:
-    magics = fff_vector_fromPyArray(Magics)
-    
   # Create output array
-  nsimu = magics.size
   dims = [Y.shape[i] for i in range(Y.ndim)]
-  dims[axis] = nsimu 
+  dims[axis] = Magics.size
   T = np.zeros(dims)
 
-  # Create local structure
-  stat = fff_onesample_stat_mfx_new(n, flag_stat, base)
-  stat.niter = niter
-  yp = fff_vector_new(n)
-
-  # Multi-iterator 
-  multi = fffpy_multi_iterator_new(3, axis, <void*>Y, <void*>V, <void*>T)
-
-  # Vector views
-  y = multi.vector[0]
-  v = multi.vector[1]
-  t = multi.vector[2]
-  
-  # Loop  
-  for simu from 0 <= simu < nsimu:
+  # Loop
+  worker = _StatSlabs(Y, V, T, Magics, stats[id], base, axis, niter)
+  run_threads(worker, _nvoxels(Y, axis), nthreads)
 
-    # Set the magic number
-    magic = magics.data[simu*magics.stride]
-    
-    # Reset the multi-iterator      
-    fffpy_multi_iterator_reset(multi)
-    
-    # Perform the loop 
-    idx = simu*t.stride
-    while(multi.index < multi.size):
-      fff_onesample_permute_signs(yp, y, magic)
-      t.data[idx] = fff_onesample_stat_mfx_eval(stat, yp, v)
-      fffpy_multi_iterator_update(multi)
-      
-
-  # Free memory
-  fffpy_multi_iterator_delete(multi)
-  fff_vector_delete(yp)
-  fff_vector_delete(magics)
-  fff_onesample_stat_mfx_delete(stat)
-  
   # Return
   return T
 
 
-
 def pdf_fit_mfx(ndarray Y, ndarray V, int axis=0, int niter=5, int constraint=0, double base=0.0):
   """
   (W, Z) = pdf_fit_mfx(data=Y, vardata=V, axis=0, niter=5, constraint=False, base=0.0).
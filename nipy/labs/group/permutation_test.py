@@ -6,10 +6,12 @@
 import numpy as np
 import scipy.misc as sm
 import warnings
+from itertools import imap
 
 # Our own imports
-from nipy.algorithms.graph import wgraph_from_3d_grid
-from nipy.algorithms.graph.field import Field, field_from_graph_and_data
+from nipy.algorithms.graph import cc_from_3d_grid, cc_summary
+from nipy.algorithms.graph.lattice import LatticeField
+from nipy.algorithms.graph._graph import tfce as _tfce
 
 from ..utils import zscore 
 from .onesample import stat as os_stat, stat_mfx as os_stat_mfx
@@ -22,6 +24,11 @@ DEF_NPERMS = int(1e4)
 DEF_NITER = 5
 DEF_STAT_ONESAMPLE = 'student'
 DEF_STAT_TWOSAMPLE = 'student'
+DEF_TFCE_E = 0.5
+DEF_TFCE_H = 2.0
+DEF_TFCE_NSTEPS = 100
+# Statistics computed with matrix products over sign-flip permutations
+SIGN_FLIP_STATS = ('mean', 'student')
 
 
 #===========================================
@@ -44,9 +51,7 @@ def extract_clusters_from_thresh(T,XYZ,th,k=18):
     labels = -np.ones(len(T),int)
     I = np.where(T >= th)[0]
     if len(I)>0:
-        SupraThreshXYZ = XYZ[:, I]
-        CC_label = wgraph_from_3d_grid(SupraThreshXYZ.T, k).cc()
-        labels[I] = CC_label
+        labels[I] = cc_from_3d_grid(XYZ[:, I].T, k)
     return labels
 
 
@@ -122,8 +127,7 @@ def _extract_clusters_from_diam(labels, T, XYZ, th, diam, k,
         else:
             # build the field
             p = len(T[I])
-            F = field_from_graph_and_data(
-                wgraph_from_3d_grid(XYZ[:, I].T, k), np.reshape(T[I],(p,1)))
+            F = LatticeField(XYZ[:, I].T, k, np.reshape(T[I],(p,1)))
             # compute the blobs
             idx, parent,label = F.threshold_bifurcations(0,th)
             nidx = np.size(idx)
@@ -183,6 +187,40 @@ def extract_clusters_from_graph(T, G, th):
     return labels
 
 
+def tfce_neighb(G=None, XYZ=None, k=18):
+    """
+    Compact neighbourhood representation (idx, neighb) used by `tfce`,
+    either from weighted graph G or from voxels coordinates XYZ (3,p)
+    in the k-connectivity scheme
+    """
+    if G == None:
+        G = LatticeField(XYZ.T, k)
+    idx, neighb, _ = G.compact_neighb()
+    return idx, neighb
+
+
+def tfce(T, neighb, dh=None, E=DEF_TFCE_E, H=DEF_TFCE_H):
+    """
+    Threshold-free cluster enhancement of statistical map T
+
+    In:  T      (p)     statistical map
+         neighb <tuple> (idx, neighb) neighbourhood system, see `tfce_neighb`
+         dh     <float> threshold step, defaults to max(T)/DEF_TFCE_NSTEPS
+         E      <float> cluster extent exponent
+         H      <float> height exponent
+    Out: tfce   (p)     enhanced map, sum over thresholds h < T of
+                        e(h)**E * h**H * dh where e(h) is the size of the
+                        cluster above h containing the voxel.
+                        Non-positive values are not enhanced.
+    """
+    T = np.asarray(T, dtype=np.float64).ravel()
+    if dh == None:
+        dh = T.max() / float(DEF_TFCE_NSTEPS)
+    idx, neighb = neighb
+    return _tfce(T, idx.astype(np.int), neighb.astype(np.int),
+                 float(dh), float(E), float(H))
+
+
 #======================================
 #======================================
 # Useful functions
@@ -205,11 +243,109 @@ def sorted_values(a):
 
 
 
+def sign_flips(magics, n):
+    """
+    Signs applied to the n subjects by the sign-flip permutations
+    given by their magic numbers: the i-th binary digit of a magic
+    number flips the sign of subject i (see fff_onesample_permute_signs)
+
+    Returns an array of shape (len(magics), n) of +1 and -1
+    """
+    m = np.ravel(magics).astype(float)
+    signs = np.ones((m.size, n))
+    for i in range(n):
+        aux = m / 2
+        m = np.floor(aux)
+        signs[aux > m, i] = -1
+    return signs
+
+
+def sign_flip_stat(Y, stat_id, base=0.0, axis=0, Magics=None):
+    """
+    Same as os_stat for the 'mean' and 'student' statistics, computed
+    for all the permutations at once with BLAS products
+
+    The permuted means are given by the product of the (nmagics, n)
+    sign matrix with the (n, nvoxels) data. For the 'student' statistic,
+    the data are first centered per voxel, and the sum of squared
+    deviations of the sign-flipped data is obtained from the
+    permutation-invariant sum of squares of the centered data, the
+    permuted means of the centered data and the voxel means, so that it
+    does not cancel out when the data have a large offset. The identity
+    permutation is computed directly, so that it yields exactly the
+    unpermuted statistic.
+    """
+    if stat_id not in SIGN_FLIP_STATS:
+        raise ValueError('statistic %s is not a sign-flip statistic'
+                         % stat_id)
+    Y = np.asarray(Y, dtype=float)
+    axis = axis % Y.ndim
+    Y = np.rollaxis(Y, axis)
+    n, shape = Y.shape[0], Y.shape[1:]
+    Y = np.reshape(Y, (n, -1))
+    if Magics is None:
+        Magics = np.zeros(1)
+    signs = sign_flips(Magics, n)
+    identity = np.all(signs > 0, 1)
+    mean = Y.sum(0) / n
+    if stat_id == 'student':
+        Y = Y - mean
+        sbar = signs.sum(1) / n
+
+    # Permuted means, computed in place to limit memory traffic. A
+    # single matrix product would round differently depending on the
+    # position of a permutation within the batch, hence one product
+    # per permutation.
+    T = np.empty((signs.shape[0], Y.shape[1]))
+    for j in range(signs.shape[0]):
+        T[j] = np.dot(signs[j], Y)
+    T /= n
+    if stat_id == 'student':
+        # With z = y - m and sbar the mean of the signs s, the sum of
+        # squares of s * y - mean(s * y) is
+        # sum(z ** 2) - n mean(s * z) ** 2 + n m ** 2 (1 - sbar ** 2)
+        # + 2 m (sum(z) - n sbar mean(s * z)), where sum(z) is kept
+        # since the rounded data are not exactly centered
+        std = T ** 2
+        std *= - n
+        std += (Y ** 2).sum(0)
+        cross = T * sbar[:, np.newaxis]
+        cross *= - n
+        cross += Y.sum(0)
+        cross *= 2 * mean
+        std += cross
+        del cross
+        std += np.outer(n * (1 - sbar) * (1 + sbar), mean ** 2)
+        T += np.outer(sbar, mean)
+        if identity.any():
+            std[identity] = (Y ** 2).sum(0)
+        np.maximum(std, 0, std)
+        std /= n
+        np.sqrt(std, std)
+    if identity.any():
+        T[identity] = mean
+    T -= base
+    if stat_id == 'student':
+        T *= np.sqrt(n - 1)
+        null = T == 0
+        olderr = np.seterr(divide='ignore', invalid='ignore')
+        T /= std
+        np.seterr(**olderr)
+        T[null] = 0
+    T = np.reshape(T, (signs.shape[0],) + shape)
+    return np.rollaxis(T, 0, axis + 1)
+
+
 def onesample_stat(Y, V, stat_id, base=0.0, axis=0, Magics=None, niter=DEF_NITER):
     """
     Wrapper for os_stat and os_stat_mfx
+
+    The 'mean' and 'student' statistics are computed for all the
+    permutations at once by sign_flip_stat.
     """
-    if stat_id.find('_mfx')<0: 
+    if stat_id in SIGN_FLIP_STATS:
+        return sign_flip_stat(Y, stat_id, base, axis, Magics)
+    elif stat_id.find('_mfx')<0: 
         return os_stat(Y, stat_id, base, axis, Magics)
     else:
         return os_stat_mfx(Y, V, stat_id, base, axis, Magics, niter)
@@ -250,22 +386,21 @@ def compute_cluster_stats(Tvalues, labels, random_Tvalues, cluster_stats=["size"
         else:
             Fisher_values = None
     else:
-        if "size" in cluster_stats:
-            size_values = np.zeros(nclust,int)
-        else:
-            size_values = None
         if "Fisher" in cluster_stats:
-            Fisher_values = np.zeros(nclust,float)
             ndraws = len(random_Tvalues)
             pseudo_p_values = 1 - np.searchsorted(random_Tvalues,Tvalues)/float(ndraws)
+            weights = -np.log(pseudo_p_values)
         else:
-            Fisher_values = None
-    for i in xrange(nclust):
-        I = np.where(labels==i)[0]
+            weights = np.zeros(len(labels))
+        size, mass, _ = cc_summary(labels, weights)
         if "size" in cluster_stats:
-            size_values[i] = len(I)
+            size_values = size
+        else:
+            size_values = None
         if "Fisher" in cluster_stats:
-            Fisher_values[i] = -np.sum(np.log(pseudo_p_values[I]))
+            Fisher_values = mass
+        else:
+            Fisher_values = None
     return size_values, Fisher_values
 
 
@@ -294,6 +429,159 @@ def peak_XYZ(XYZ, Tvalues, labels, label_values):
         C[:, i] = XYZ[:, I[np.argmax(Tvalues[I])]]
     return C
 
+#======================================
+#======================================
+# Parallel permutation engine
+#======================================
+#======================================
+
+# Default number of permutations evaluated per worker task
+DEF_BATCH_SIZE = 16
+
+# Permutation problem held by each worker process (see
+# `_init_permutation_worker`)
+_worker_state = None
+
+
+def cluster_values(Tvalues, labels, thresh, random_Tvalues, stat):
+    """
+    Summary statistic of each cluster defined by `labels`
+
+    Parameters
+    ----------
+    Tvalues : array of shape (p,)
+        statistic values
+    labels : array of shape (p,)
+        cluster labels, negative for voxels outside clusters
+    thresh : float
+        threshold used to extract the clusters
+    random_Tvalues : array of shape (ndraws,)
+        sorted statistic values under the null hypothesis
+    stat : string
+        one of 'size', 'Fisher' or 'mass' (sum of suprathreshold
+        statistic excursions)
+
+    Returns
+    -------
+    values : array of shape (nclust,)
+    """
+    nclust = labels.max() + 1
+    if nclust <= 0:
+        return np.zeros(0)
+    I = labels >= 0
+    if stat == 'size':
+        weights = None
+    elif stat == 'Fisher':
+        pseudo_p_values = 1 - np.searchsorted(random_Tvalues, Tvalues[I])\
+            / float(len(random_Tvalues))
+        weights = -np.log(pseudo_p_values)
+    elif stat == 'mass':
+        weights = Tvalues[I] - thresh
+    else:
+        raise ValueError('unknown cluster statistic %s' % stat)
+    return np.bincount(labels[I], weights, nclust).astype(float)
+
+
+def region_values(Tvalues, labels, label_values, random_Tvalues):
+    """
+    Fisher statistic of each region, equivalent to
+    `compute_region_stat` but without python loop over regions
+    """
+    label_values = np.asarray(label_values)
+    pseudo_p_values = 1 - np.searchsorted(random_Tvalues, Tvalues)\
+        / float(len(random_Tvalues))
+    idx = np.searchsorted(label_values, labels)
+    idx[idx == len(label_values)] = 0
+    I = label_values[idx] == labels
+    return np.bincount(idx[I], -np.log(pseudo_p_values[I]),
+                       len(label_values))
+
+
+def _extract_clusters(T, XYZ, G, thresh, diam):
+    if diam == None:
+        if XYZ == None:
+            return extract_clusters_from_graph(T, G, thresh)
+        return extract_clusters_from_thresh(T, XYZ, thresh)
+    return extract_clusters_from_diam(T, XYZ, thresh, diam)
+
+
+def _init_permutation_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _permutation_batch(magics):
+    """
+    Evaluate a batch of permutations, given by their magic numbers,
+    and return the summaries needed by `permutation_test.calibrate_parallel`.
+    Only depends on the magic numbers, so that results do not depend
+    on the way permutations are distributed across workers.
+    """
+    s = _worker_state
+    if s['nsamples'] == 1:
+        T = onesample_stat(s['data'], s['vardata'], s['stat_id'], s['base'],
+                           s['axis'], magics, s['niter'])
+    else:
+        T = twosample_stat(s['data1'], s['vardata1'], s['data2'],
+                           s['vardata2'], s['stat_id'], s['axis'], magics,
+                           s['niter'])
+    # Permuted statistics, shape (nmagics, p)
+    if s['axis'] == 1:
+        T = T.T
+    Tvalues = s['Tvalues']
+    out = {'exceed': (T >= Tvalues).sum(0), 'maxT': T.max(1),
+           'clusters': [], 'regions': []}
+    for thresh, diam, observed in s['clusters']:
+        res = {'nclust': 0, 'nvoxels': 0}
+        for stat in observed:
+            res['max' + stat] = np.zeros(len(magics))
+            res['exceed_' + stat] = np.zeros(len(observed[stat]), int)
+        for j in range(len(magics)):
+            labels = _extract_clusters(T[j], s['XYZ'], s['G'], thresh, diam)
+            res['nclust'] += labels.max() + 1
+            res['nvoxels'] += (labels >= 0).sum()
+            for stat in observed:
+                values = cluster_values(T[j], labels, thresh,
+                                        s['random_Tvalues'], stat)
+                if values.size == 0:
+                    continue
+                res['max' + stat][j] = values.max()
+                # Number of permuted clusters at least as large as each
+                # observed cluster
+                res['exceed_' + stat] += len(values) - np.searchsorted(
+                    np.sort(values), observed[stat], 'left')
+        out['clusters'].append(res)
+    if s['tfce'] != None:
+        neighb, dh, E, H = s['tfce']
+        out['maxtfce'] = np.array([tfce(T[j], neighb, dh, E, H).max()
+                                   for j in range(len(magics))])
+    for labels, label_values in s['regions']:
+        out['regions'].append(np.array(
+                [region_values(T[j], labels, label_values,
+                               s['random_Tvalues'])
+                 for j in range(len(magics))]).T)
+    return out
+
+
+def _region_p_values(Fisher_values, perm_Fisher_values):
+    """
+    Uncorrected and min-p corrected region p-values from the observed
+    (nregions,) and permuted (nregions, nperms) Fisher statistics
+    """
+    nregions, nperms = perm_Fisher_values.shape
+    sorted_perm = np.sort(perm_Fisher_values, axis=1)
+    p_values = np.array([1 - np.searchsorted(sorted_perm[j], Fisher_values[j])
+                         / float(nperms) for j in range(nregions)])
+    perm_p_values = np.zeros((nregions, nperms))
+    for j in range(nregions):
+        I = np.argsort(perm_Fisher_values[j])
+        perm_p_values[j][I] = 1 - np.arange(1, nperms + 1) / float(nperms)
+    perm_min_p_values = np.sort(perm_p_values.min(axis=0))
+    Corr_p_values = 1 - np.searchsorted(-perm_min_p_values, -p_values)\
+        / float(nperms)
+    return p_values, Corr_p_values
+
+
 #======================================
 #======================================
 # Generic permutation test class
@@ -529,6 +817,219 @@ class permutation_test(object):
 
 
 
+    def calibrate_parallel(self, nperms=DEF_NPERMS, clusters=None,
+                           cluster_stats=["size", "Fisher"], regions=None,
+                           region_stats=["Fisher"], tfce_params=None,
+                           n_jobs=1, seed=None, batch_size=DEF_BATCH_SIZE):
+        """
+        Calibrate summary statistics using a pool of worker processes
+
+        Same as `calibrate`, except that permutations are evaluated in
+        batches distributed across `n_jobs` processes and that only the
+        null distributions needed to compute p-values (maximum statistic,
+        maximum cluster statistics, region statistics) are accumulated,
+        rather than every permuted cluster statistic.
+
+        Parameters
+        ----------
+        nperms : int, optional
+            Number of random permutations generated.
+            Exhaustive permutations are used only if nperms=None,
+            or exceeds total number of possible permutations
+        clusters : list [(thresh1,diam1),(thresh2,diam2),...], optional
+            List of cluster extraction pairs, see `calibrate`
+        cluster_stats : list [stat1,...], optional
+            List of cluster summary statistics id ('size', 'Fisher' or
+            'mass')
+        regions : list [Labels1,Labels2,...]
+            List of region labels arrays, of size (p,)
+        region_stats : list [stat1,...], optional
+            List of region summary statistics id (only 'Fisher' supported
+            for now)
+        tfce_params : None or dict, optional
+            If not None, also calibrate the threshold-free cluster
+            enhancement of the statistic map, using the keyword
+            arguments of `tfce` given in this dictionary, and "k" for
+            the connectivity. The threshold step defaults to that of
+            the observed map, and is used for all permutations.
+        n_jobs : int, optional
+            Number of worker processes. With n_jobs=1, permutations are
+            evaluated in the calling process.
+        seed : None or int, optional
+            Seed of the random permutations draw. For a given seed, the
+            results do not depend on `n_jobs` or `batch_size`.
+        batch_size : int, optional
+            Number of permutations evaluated per worker task
+
+        Returns
+        -------
+        voxel_results : dict
+            Keys ``p_values``, ``Corr_p_values`` and ``perm_maxT_values``,
+            see `calibrate`, and if tfce_params is not None ``tfce_values``,
+            ``tfce_Corr_p_values`` (corrected by the maximum TFCE
+            procedure) and ``perm_maxtfce_values``
+        cluster_results : list [results1,results2,...]
+            List of dictionaries with keys "thresh", "diam", "labels",
+            "expected_number_of_clusters", "expected_voxels_per_cluster",
+            "peak_XYZ" if XYZ field is nonempty and for each summary
+            statistic id "S": "S_values", "S_p_values", "S_Corr_p_values"
+            and "perm_maxS_values"
+        region_results : list [results1,results2,...]
+            List of dictionaries with keys "label_values", "peak_XYZ"
+            (if XYZ field nonempty) and for each summary statistic id "S":
+            "S_values", "perm_S_values", "S_p_values", "S_Corr_p_values"
+        """
+        # Magic numbers are drawn here so that each permutation is
+        # fully determined before being dispatched
+        if self.nsamples == 1:
+            n = self.data.shape[self.axis]
+            max_nperms = 2 ** n
+        else:
+            n1 = self.data1.shape[self.axis]
+            n2 = self.data2.shape[self.axis]
+            max_nperms = sm.comb(n1 + n2, n1, exact=1)
+        if nperms == None or nperms >= max_nperms:
+            magic_numbers = np.arange(max_nperms, dtype=float)
+        else:
+            rng = np.random.RandomState(seed)
+            magic_numbers = np.floor(rng.uniform(0, max_nperms, size=nperms))
+        nmagic = len(magic_numbers)
+        batches = [magic_numbers[i:i + batch_size]
+                   for i in range(0, nmagic, batch_size)]
+        XYZ = getattr(self, 'XYZ', None)
+        G = getattr(self, 'G', None)
+        # Observed cluster and region statistics
+        cluster_results = []
+        observed_clusters = []
+        if clusters != None:
+            for thresh, diam in clusters:
+                labels = _extract_clusters(self.Tvalues, XYZ, G, thresh, diam)
+                results = {"thresh": thresh, "diam": diam, "labels": labels}
+                if XYZ != None:
+                    results["peak_XYZ"] = peak_XYZ(
+                        XYZ, self.Tvalues, labels,
+                        np.arange(labels.max() + 1))
+                observed = {}
+                for stat in cluster_stats:
+                    observed[stat] = cluster_values(
+                        self.Tvalues, labels, thresh, self.random_Tvalues,
+                        stat)
+                    results[stat + "_values"] = observed[stat]
+                observed_clusters.append((thresh, diam, observed))
+                cluster_results.append(results)
+        region_results = []
+        observed_regions = []
+        if regions != None and "Fisher" in region_stats:
+            for labels in regions:
+                label_values = sorted_values(labels)
+                results = {"label_values": label_values}
+                if XYZ != None:
+                    results["peak_XYZ"] = peak_XYZ(XYZ, self.Tvalues, labels,
+                                                   label_values)
+                results["Fisher_values"] = region_values(
+                    self.Tvalues, labels, label_values, self.random_Tvalues)
+                observed_regions.append((labels, label_values))
+                region_results.append(results)
+        tfce_state = None
+        if tfce_params != None:
+            params = dict(tfce_params)
+            neighb = tfce_neighb(G, XYZ, params.get('k', 18))
+            dh = params.get('dh')
+            if dh == None:
+                dh = self.Tvalues.max() / float(DEF_TFCE_NSTEPS)
+            tfce_state = (neighb, dh, params.get('E', DEF_TFCE_E),
+                          params.get('H', DEF_TFCE_H))
+            tfce_values = tfce(self.Tvalues, *tfce_state)
+            perm_maxtfce_values = np.zeros(nmagic)
+        state = {'nsamples': self.nsamples, 'stat_id': self.stat_id,
+                 'axis': self.axis, 'niter': self.niter,
+                 'Tvalues': self.Tvalues,
+                 'random_Tvalues': self.random_Tvalues, 'XYZ': XYZ, 'G': G,
+                 'clusters': observed_clusters, 'regions': observed_regions,
+                 'tfce': tfce_state}
+        if self.nsamples == 1:
+            state.update(data=self.data, vardata=self.vardata,
+                         base=self.base)
+        else:
+            state.update(data1=self.data1, vardata1=self.vardata1,
+                         data2=self.data2, vardata2=self.vardata2)
+        if n_jobs == 1:
+            pool = None
+            _init_permutation_worker(state)
+            outputs = imap(_permutation_batch, batches)
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(n_jobs, _init_permutation_worker,
+                                        (state,))
+            outputs = pool.imap(_permutation_batch, batches)
+        # Accumulate batch summaries in permutation order
+        p_values = np.zeros(len(self.Tvalues))
+        perm_maxT_values = np.zeros(nmagic)
+        for results in cluster_results:
+            results["expected_number_of_clusters"] = 0
+            results["expected_voxels_per_cluster"] = 0
+            for stat in cluster_stats:
+                results["perm_max" + stat + "_values"] = np.zeros(nmagic)
+                results[stat + "_p_values"] = np.zeros(
+                    len(results[stat + "_values"]))
+        for results in region_results:
+            results["perm_Fisher_values"] = np.zeros(
+                (len(results["label_values"]), nmagic))
+        try:
+            start = 0
+            for out in outputs:
+                stop = start + len(out['maxT'])
+                p_values += out['exceed']
+                perm_maxT_values[start:stop] = out['maxT']
+                if tfce_state != None:
+                    perm_maxtfce_values[start:stop] = out['maxtfce']
+                for results, res in zip(cluster_results, out['clusters']):
+                    results["expected_number_of_clusters"] += res['nclust']
+                    results["expected_voxels_per_cluster"] += res['nvoxels']
+                    for stat in cluster_stats:
+                        results["perm_max" + stat + "_values"][start:stop] = \
+                            res['max' + stat]
+                        results[stat + "_p_values"] += res['exceed_' + stat]
+                for results, perm_Fisher in zip(region_results,
+                                                out['regions']):
+                    results["perm_Fisher_values"][:, start:stop] = perm_Fisher
+                start = stop
+        finally:
+            if pool is None:
+                _init_permutation_worker(None)
+            else:
+                pool.close()
+                pool.join()
+        # Compute p-values
+        perm_maxT_values.sort()
+        voxel_results = {
+            'p_values': p_values / float(nmagic),
+            'Corr_p_values': 1 - np.searchsorted(
+                perm_maxT_values, self.Tvalues) / float(nmagic),
+            'perm_maxT_values': perm_maxT_values}
+        if tfce_state != None:
+            perm_maxtfce_values.sort()
+            voxel_results['tfce_values'] = tfce_values
+            voxel_results['tfce_Corr_p_values'] = 1 - np.searchsorted(
+                perm_maxtfce_values, tfce_values) / float(nmagic)
+            voxel_results['perm_maxtfce_values'] = perm_maxtfce_values
+        for results in cluster_results:
+            nclust = results["expected_number_of_clusters"]
+            for stat in cluster_stats:
+                perm_max = results["perm_max" + stat + "_values"]
+                perm_max.sort()
+                results[stat + "_p_values"] /= float(max(nclust, 1))
+                results[stat + "_Corr_p_values"] = 1 - np.searchsorted(
+                    perm_max, results[stat + "_values"]) / float(nmagic)
+            results["expected_voxels_per_cluster"] /= float(max(nclust, 1))
+            results["expected_number_of_clusters"] = nclust / float(nmagic)
+        for results in region_results:
+            results["Fisher_p_values"], results["Fisher_Corr_p_values"] = \
+                _region_p_values(results["Fisher_values"],
+                                 results["perm_Fisher_values"])
+        return voxel_results, cluster_results, region_results
+
+
     def height_threshold(self, pval):
         """
         Return the uniform height threshold matching a given
@@ -1,6 +1,7 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 import unittest
+import weakref
 
 import numpy as np
 
@@ -69,5 +70,126 @@ class test_permutation_test(unittest.TestCase):
         p_values, cluster_results, region_results = P.calibrate(nperms=nperms, clusters=c, regions=r)
 
 
+    def test_calibrate_parallel(self):
+        data, vardata, XYZ = make_data(mask_shape=(5, 5, 5))
+        P = pt.permutation_test_onesample(data, XYZ, ndraws=100)
+        c = [(P.random_Tvalues[int(P.ndraws * 0.5)], None)]
+        r = np.ones(data.shape[1], int)
+        r[data.shape[1] // 2:] *= 10
+        kwargs = dict(nperms=20, clusters=c, regions=[r],
+                      cluster_stats=["size", "Fisher", "mass"], seed=1)
+        res1 = P.calibrate_parallel(n_jobs=1, batch_size=20, **kwargs)
+        res2 = P.calibrate_parallel(n_jobs=2, batch_size=3, **kwargs)
+        for key in ('p_values', 'Corr_p_values', 'perm_maxT_values'):
+            np.testing.assert_array_equal(res1[0][key], res2[0][key])
+        for key in ('size', 'Fisher', 'mass'):
+            np.testing.assert_array_equal(
+                res1[1][0]['perm_max%s_values' % key],
+                res2[1][0]['perm_max%s_values' % key])
+            np.testing.assert_array_equal(res1[1][0]['%s_p_values' % key],
+                                          res2[1][0]['%s_p_values' % key])
+        np.testing.assert_array_equal(res1[2][0]['perm_Fisher_values'],
+                                      res2[2][0]['perm_Fisher_values'])
+        # Exhaustive permutations include the identity
+        P = pt.permutation_test_onesample(data[:4], XYZ, ndraws=100)
+        vox, clust, reg = P.calibrate_parallel(nperms=None)
+        self.assertEqual(len(vox['perm_maxT_values']), 16)
+        self.assertTrue(np.all(vox['p_values'] >= 1. / 16))
+
+    def test_calibrate_parallel_streams(self):
+        # with a single job, each batch summary is accumulated and released
+        # before the next batch is computed
+        data, vardata, XYZ = make_data(mask_shape=(5, 5, 5))
+        P = pt.permutation_test_onesample(data, XYZ, ndraws=100)
+        c = [(P.random_Tvalues[int(P.ndraws * 0.5)], None)]
+        alive = []
+        permutation_batch = pt._permutation_batch
+
+        def recording_batch(magics):
+            out = permutation_batch(magics)
+            alive[:] = [ref for ref in alive if ref() is not None]
+            self.assertTrue(len(alive) <= 1)
+            alive.append(weakref.ref(out['exceed']))
+            return out
+
+        pt._permutation_batch = recording_batch
+        try:
+            P.calibrate_parallel(nperms=20, clusters=c, n_jobs=1,
+                                 batch_size=3, seed=1)
+        finally:
+            pt._permutation_batch = permutation_batch
+
+    def test_calibrate_parallel_twosample(self):
+        data, vardata, XYZ = make_data(n=8, mask_shape=(5, 5, 5))
+        P = pt.permutation_test_twosample(data[:4], data[4:], XYZ,
+                                          ndraws=100)
+        c = [(P.random_Tvalues[int(P.ndraws * 0.5)], None)]
+        res1 = P.calibrate_parallel(nperms=10, clusters=c, seed=0)
+        res2 = P.calibrate_parallel(nperms=10, clusters=c, seed=0, n_jobs=2,
+                                    batch_size=4)
+        np.testing.assert_array_equal(res1[0]['Corr_p_values'],
+                                      res2[0]['Corr_p_values'])
+        np.testing.assert_array_equal(res1[1][0]['size_Corr_p_values'],
+                                      res2[1][0]['size_Corr_p_values'])
+
+    def test_tfce(self):
+        data, vardata, XYZ = make_data(mask_shape=(6, 6, 6))
+        T = np.random.randn(XYZ.shape[1])
+        G = wgraph_from_3d_grid(XYZ.T)
+        dh, E, H = .1, .5, 2.
+        enhanced = pt.tfce(T, pt.tfce_neighb(G), dh, E, H)
+        # brute-force computation, relabelling at every threshold
+        expected = np.zeros(len(T))
+        for h in dh * np.arange(1, int(T.max() / dh) + 1):
+            labels = pt.extract_clusters_from_graph(T, G, h)
+            size = np.bincount(labels[labels >= 0])
+            I = labels >= 0
+            expected[I] += size[labels[I]] ** E * h ** H * dh
+        np.testing.assert_array_almost_equal(enhanced, expected)
+        np.testing.assert_array_equal(
+            pt.tfce(T, pt.tfce_neighb(XYZ=XYZ), dh, E, H), enhanced)
+
+    def test_calibrate_parallel_tfce(self):
+        data, vardata, XYZ = make_data(mask_shape=(5, 5, 5))
+        P = pt.permutation_test_onesample(data, XYZ, ndraws=100)
+        vox, _, _ = P.calibrate_parallel(nperms=10, tfce_params={}, seed=0)
+        vox2, _, _ = P.calibrate_parallel(nperms=10, tfce_params={}, seed=0,
+                                          n_jobs=2, batch_size=3)
+        self.assertEqual(vox['tfce_values'].shape, P.Tvalues.shape)
+        np.testing.assert_array_equal(vox['tfce_Corr_p_values'],
+                                      vox2['tfce_Corr_p_values'])
+        self.assertTrue(np.all(vox['tfce_Corr_p_values'] >= 0))
+        self.assertTrue(np.all(vox['tfce_Corr_p_values'] <= 1))
+
+    def test_sign_flip_stat(self):
+        data, vardata, XYZ = make_data(n=8, mask_shape=(4, 4, 4))
+        magics = np.arange(2 ** 8, dtype=float)
+        random_magics = np.random.randint(0, 2 ** 8, 20).astype(float)
+        for stat_id in pt.SIGN_FLIP_STATS:
+            for axis in (0, 1):
+                Y = data if axis == 0 else data.T
+                for m in (magics, random_magics):
+                    T = pt.sign_flip_stat(Y, stat_id, .2, axis, m)
+                    np.testing.assert_array_almost_equal(
+                        T, pt.os_stat(Y, stat_id, .2, axis, m))
+                # the identity permutation gives the unpermuted statistic
+                np.testing.assert_array_almost_equal(
+                    pt.sign_flip_stat(Y, stat_id, .2, axis),
+                    pt.os_stat(Y, stat_id, .2, axis))
+
+    def test_sign_flip_stat_offset(self):
+        # the student statistic does not cancel out for data with a
+        # large offset, including the all-flip permutation
+        n = 8
+        magics = np.array([0, 2 ** n - 1, 5, 100], dtype=float)
+        signs = pt.sign_flips(magics, n)
+        for offset in (1.e5, 1.e7):
+            Y = offset + np.random.randn(n, 30)
+            T = pt.sign_flip_stat(Y, 'student', 0, 0, magics)
+            flipped = signs[:, :, np.newaxis] * Y
+            ref = (np.sqrt(n - 1) * flipped.mean(1) / flipped.std(1))
+            np.testing.assert_allclose(T, ref, rtol=1.e-8)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -57,9 +57,34 @@ def test_onesample_stat():
     xT = x.T.copy()
     y = onesample.stat(xT, axis=0).reshape(nvox)
     assert_equal(y, y_target)
-    
 
-    
+
+def test_stat_nthreads():
+    # Threaded voxel loops give the same statistics as a single thread
+    np.random.seed(0)
+    x = np.random.randn(5, 3, 4, 10)
+    vx = np.random.rand(5, 3, 4, 10) + .1
+    magics = np.array([0., 5., 11.])
+    for nthreads in (2, 3, 100):
+        assert_equal(onesample.stat(x, 'wilcoxon', axis=3, Magics=magics,
+                                    nthreads=nthreads),
+                     onesample.stat(x, 'wilcoxon', axis=3, Magics=magics))
+        assert_almost_equal(
+            onesample.stat_mfx(x, vx, axis=3, Magics=magics,
+                               nthreads=nthreads),
+            onesample.stat_mfx(x, vx, axis=3, Magics=magics))
+        assert_equal(twosample.stat(x[..., :4], x[..., 4:], axis=3,
+                                    Magics=magics, nthreads=nthreads),
+                     twosample.stat(x[..., :4], x[..., 4:], axis=3,
+                                    Magics=magics))
+        assert_almost_equal(
+            twosample.stat_mfx(x[..., :4], vx[..., :4], x[..., 4:],
+                               vx[..., 4:], axis=3, Magics=magics,
+                               nthreads=nthreads),
+            twosample.stat_mfx(x[..., :4], vx[..., :4], x[..., 4:],
+                               vx[..., 4:], axis=3, Magics=magics))
+
+
 if __name__ == "__main__":
     import nose
     nose.run(argv=['', __file__])
@@ -28,13 +28,13 @@ cdef extern from "fff_twosample_stat.h":
 
   fff_twosample_stat* fff_twosample_stat_new(unsigned int n1, unsigned int n2, fff_twosample_stat_flag flag)
   void fff_twosample_stat_delete(fff_twosample_stat* thisone) 
-  double fff_twosample_stat_eval(fff_twosample_stat* thisone, fff_vector* x)
+  double fff_twosample_stat_eval(fff_twosample_stat* thisone, fff_vector* x) nogil
 
   fff_twosample_stat_mfx* fff_twosample_stat_mfx_new(unsigned int n1, unsigned int n2,
                                                      fff_twosample_stat_flag flag)
   void fff_twosample_stat_mfx_delete(fff_twosample_stat_mfx* thisone) 
   double fff_twosample_stat_mfx_eval(fff_twosample_stat_mfx* thisone, 
-                                     fff_vector* x, fff_vector* vx)
+                                     fff_vector* x, fff_vector* vx) nogil
   
   unsigned int fff_twosample_permutation(unsigned int* idx1, unsigned int* idx2, 
                                          unsigned int n1, unsigned int n2, double* magic)
@@ -42,7 +42,7 @@ cdef extern from "fff_twosample_stat.h":
   void fff_twosample_apply_permutation(fff_vector* px, fff_vector* pv, 
                                        fff_vector* x1, fff_vector* v1, 
                                        fff_vector* x2,  fff_vector* v2,
-                                       unsigned int i, unsigned int* idx1, unsigned int* idx2)
+                                       unsigned int i, unsigned int* idx1, unsigned int* idx2) nogil
    
 
 # Initialize numpy
@@ -50,6 +50,8 @@ fffpy_import_array()
 import_array()
 import numpy as np
 
+from nipy.utils.threads import run_threads
+
 
 # Stat dictionary
 stats = {'student': FFF_TWOSAMPLE_STUDENT,
@@ -63,84 +65,154 @@ def count_permutations(unsigned int n1, unsigned int n2):
   return int(n)
   
 
-def stat(ndarray Y1, ndarray Y2, id='student', int axis=0, ndarray Magics=None):
+def _permutations(unsigned int n1, unsigned int n2, ndarray Magics):
   """
-  T = stat(Y1, Y2, id='student', axis=0, magics=None).
-  
-  Compute a two-sample test statistic (Y1>Y2) over a number of
-  deterministic or random permutations.
+  (Nex, Idx1, Idx2) = _permutations(n1, n2, Magics).
+
+  Generate the permutations corresponding to the magic numbers.
   """
-  cdef fff_vector *y1, *y2, *t, *yp, *magics
-  cdef fff_array *idx1, *idx2
-  cdef unsigned int n, n1, n2, nex
-  cdef unsigned long int simu, nsimu, idx
-  cdef fff_twosample_stat* stat
-  cdef fff_twosample_stat_flag flag_stat = stats[id]
+  cdef unsigned long int simu, nsimu
   cdef double magic
+  cdef ndarray Nex, Idx1, Idx2
+
+  if Magics is None:
+    Magics = np.zeros(1) ## Just to make sure
+  Magics = np.ravel(Magics)
+  nsimu = Magics.size
+  Nex = np.zeros(nsimu, dtype=np.uintc)
+  Idx1 = np.zeros((nsimu, max(n1, 1)), dtype=np.uintc)
+  Idx2 = np.zeros((nsimu, max(n2, 1)), dtype=np.uintc)
+  for simu from 0 <= simu < nsimu:
+    magic = Magics[simu]
+    (<unsigned int*>Nex.data)[simu] = fff_twosample_permutation(
+      <unsigned int*>Idx1.data + simu*Idx1.shape[1],
+      <unsigned int*>Idx2.data + simu*Idx2.shape[1],
+      n1, n2, &magic)
+  return Nex, Idx1, Idx2
+
+
+cdef size_t _nvoxels(ndarray Y, int axis):
   cdef fffpy_multi_iterator* multi
+  cdef size_t size
+  multi = fffpy_multi_iterator_new(1, axis, <void*>Y)
+  size = multi.size
+  fffpy_multi_iterator_delete(multi)
+  return size
 
-  # Get number of observations
-  n1 = <unsigned int>Y1.shape[axis]
-  n2 = <unsigned int>Y2.shape[axis]
-  n = n1 + n2
 
-  # Read out magic numbers
-  if Magics == None:
-    magics = fff_vector_new(1)
-    magics.data[0] = 0 ## Just to make sure
-  else:
-    magics = fff_vector_fromPyArray(Magics)
+cdef class _StatSlabs:
+  """
+  Evaluate a two-sample statistic, with or without mixed-effect
+  correction, on a range of voxels. Each call builds its own iterator
+  and workspace, so that distinct ranges may be processed in parallel
+  threads.
+  """
+  cdef ndarray Y1, V1, Y2, V2, T, Nex, Idx1, Idx2
+  cdef fff_twosample_stat_flag flag_stat
+  cdef int axis, mfx
+  cdef unsigned int n1, n2, niter
+
+  def __cinit__(self, ndarray Y1, ndarray V1, ndarray Y2, ndarray V2,
+                ndarray T, ndarray Magics, int flag_stat, int axis,
+                unsigned int niter):
+    self.Y1 = Y1
+    self.V1 = V1
+    self.Y2 = Y2
+    self.V2 = V2
+    self.T = T
+    self.flag_stat = <fff_twosample_stat_flag>flag_stat
+    self.axis = axis
+    self.mfx = V1 is not None
+    self.n1 = <unsigned int>Y1.shape[axis]
+    self.n2 = <unsigned int>Y2.shape[axis]
+    self.niter = niter
+    self.Nex, self.Idx1, self.Idx2 = _permutations(self.n1, self.n2, Magics)
+
+  def __call__(self, size_t start, size_t stop):
+    cdef fff_vector *y1, *y2, *v1, *v2, *t, *yp, *vp
+    cdef fff_twosample_stat* stat = NULL
+    cdef fff_twosample_stat_mfx* stat_mfx = NULL
+    cdef unsigned long int simu, nsimu, idx
+    cdef unsigned int *nex, *idx1, *idx2
+    cdef size_t s1, s2
+    cdef unsigned int n = self.n1 + self.n2
+    cdef fffpy_multi_iterator* multi
+
+    # Multi-iterator and local structures
+    yp = fff_vector_new(n)
+    vp = NULL
+    if self.mfx:
+      multi = fffpy_multi_iterator_new(5, self.axis,
+                                       <void*>self.Y1, <void*>self.V1,
+                                       <void*>self.Y2, <void*>self.V2,
+                                       <void*>self.T)
+      y1 = multi.vector[0]
+      v1 = multi.vector[1]
+      y2 = multi.vector[2]
+      v2 = multi.vector[3]
+      vp = fff_vector_new(n)
+      stat_mfx = fff_twosample_stat_mfx_new(self.n1, self.n2, self.flag_stat)
+      stat_mfx.niter = self.niter
+    else:
+      multi = fffpy_multi_iterator_new(3, self.axis, <void*>self.Y1,
+                                       <void*>self.Y2, <void*>self.T)
+      y1 = multi.vector[0]
+      v1 = NULL
+      y2 = multi.vector[1]
+      v2 = NULL
+      stat = fff_twosample_stat_new(self.n1, self.n2, self.flag_stat)
+    t = multi.vector[multi.narr - 1]
+    nsimu = self.Nex.shape[0]
+    nex = <unsigned int*>self.Nex.data
+    idx1 = <unsigned int*>self.Idx1.data
+    idx2 = <unsigned int*>self.Idx2.data
+    s1 = self.Idx1.shape[1]
+    s2 = self.Idx2.shape[1]
+
+    # Loop
+    with nogil:
+      for simu from 0 <= simu < nsimu:
+        fffpy_multi_iterator_goto(multi, start)
+        idx = simu*t.stride
+        while(multi.index < stop):
+          fff_twosample_apply_permutation(yp, vp, y1, v1, y2, v2, nex[simu],
+                                          idx1 + simu*s1, idx2 + simu*s2)
+          if stat_mfx != NULL:
+            t.data[idx] = fff_twosample_stat_mfx_eval(stat_mfx, yp, vp)
+          else:
+            t.data[idx] = fff_twosample_stat_eval(stat, yp)
+          fffpy_multi_iterator_update(multi)
+
+    # Delete local structures
+    fffpy_multi_iterator_delete(multi)
+    fff_vector_delete(yp)
+    if stat_mfx != NULL:
+      fff_vector_delete(vp)
+      fff_twosample_stat_mfx_delete(stat_mfx)
+    else:
+      fff_twosample_stat_delete(stat)
+
+
+def stat(ndarray Y1, ndarray Y2, id='student', int axis=0, ndarray Magics=None,
+         nthreads=1):
+  """
+  T = stat(Y1, Y2, id='student', axis=0, magics=None, nthreads=1).
+  
+  Compute a two-sample test statistic (Y1>Y2) over a number of
+  deterministic or random permutations. The voxels are shared between
+  `nthreads` threads.
+  """
+  Y1 = np.asarray(Y1, dtype='double')
+  Y2 = np.asarray(Y2, dtype='double')
 
   # Create output array
-  nsimu = magics.size
   dims = [Y1.shape[i] for i in range(Y1.ndim)]
-  dims[axis] = nsimu
+  dims[axis] = 1 if Magics is None else Magics.size
   T = np.zeros(dims)
 
-  # Create local structure
-  yp = fff_vector_new(n)
-  idx1 = fff_array_new1d(FFF_UINT, n1)
-  idx2 = fff_array_new1d(FFF_UINT, n2)
-  stat = fff_twosample_stat_new(n1, n2, flag_stat)
-
-  # Multi-iterator 
-  multi = fffpy_multi_iterator_new(3, axis, <void*>Y1, <void*>Y2, <void*>T)
-
-  # Vector views
-  y1 = multi.vector[0]
-  y2 = multi.vector[1]
-  t = multi.vector[2]
-  
   # Loop
-  for simu from 0 <= simu < nsimu:
-    
-    # Set the magic number
-    magic = magics.data[simu*magics.stride]
-
-    # Generate permutation 
-    nex = fff_twosample_permutation(<unsigned int*>idx1.data,
-                                    <unsigned int*>idx2.data,
-                                    n1, n2, &magic)
-   
-    # Reset the multi-iterator
-    fffpy_multi_iterator_reset(multi)
-    
-    # Perform the loop 
-    idx = simu*t.stride
-    while(multi.index < multi.size):
-      fff_twosample_apply_permutation(yp, NULL, y1, NULL, y2, NULL, nex,
-                                      <unsigned int*>idx1.data,
-                                      <unsigned int*>idx2.data)
-      t.data[idx] = fff_twosample_stat_eval(stat, yp)
-      fffpy_multi_iterator_update(multi)
-
-  # Delete local structures
-  fffpy_multi_iterator_delete(multi)
-  fff_vector_delete(magics)
-  fff_vector_delete(yp)
-  fff_array_delete(idx1)
-  fff_array_delete(idx2)
-  fff_twosample_stat_delete(stat)
+  worker = _StatSlabs(Y1, None, Y2, None, T, Magics, stats[id], axis, 0)
+  run_threads(worker, _nvoxels(Y1, axis), nthreads)
 
   # Return
   return T
@@ -148,92 +220,28 @@ def stat(ndarray Y1, ndarray Y2, id='student', int axis=0, ndarray Magics=None):
 
 def stat_mfx(ndarray Y1, ndarray V1, ndarray Y2, ndarray V2,
              id='student_mfx', int axis=0, ndarray Magics=None,
-             unsigned int niter=5):
+             unsigned int niter=5, nthreads=1):
   """
-  T = stat(Y1, V1, Y2, V2, id='student', axis=0, magics=None, niter=5).
+  T = stat(Y1, V1, Y2, V2, id='student', axis=0, magics=None, niter=5,
+           nthreads=1).
   
   Compute a two-sample test statistic (Y1>Y2) over a number of
-  deterministic or random permutations.
+  deterministic or random permutations. The voxels are shared between
+  `nthreads` threads.
   """
-  cdef fff_vector *y1, *y2, *v1, *v2, *t, *yp, *vp, *magics
-  cdef fff_array *idx1, *idx2
-  cdef unsigned int n, n1, n2, nex
-  cdef unsigned long int simu, nsimu, idx
-  cdef fff_twosample_stat_mfx* stat
-  cdef fff_twosample_stat_flag flag_stat = stats[id]
-  cdef double magic
-  cdef fffpy_multi_iterator* multi
-
-  # Get number of observations
-  n1 = <unsigned int>Y1.shape[axis]
-  n2 = <unsigned int>Y2.shape[axis]
-  n = n1 + n2
-
-  # Read out magic numbers
-  if Magics == None:
-    magics = fff_vector_new(1)
-    magics.data[0] = 0 ## Just to make sure
-  else:
-    magics = fff_vector_fromPyArray(Magics)
+  Y1 = np.asarray(Y1, dtype='double')
+  V1 = np.asarray(V1, dtype='double')
+  Y2 = np.asarray(Y2, dtype='double')
+  V2 = np.asarray(V2, dtype='double')
 
   # Create output array
-  nsimu = magics.size
   dims = [Y1.shape[i] for i in range(Y1.ndim)]
-  dims[axis] = nsimu 
+  dims[axis] = 1 if Magics is None else Magics.size
   T = np.zeros(dims)
 
-  # Create local structure
-  yp = fff_vector_new(n)
-  vp = fff_vector_new(n)
-  idx1 = fff_array_new1d(FFF_UINT, n1)
-  idx2 = fff_array_new1d(FFF_UINT, n2)
-  stat = fff_twosample_stat_mfx_new(n1, n2, flag_stat)
-  stat.niter = niter
-
-  # Multi-iterator 
-  multi = fffpy_multi_iterator_new(5, axis,
-                                   <void*>Y1, <void*>V1,
-                                   <void*>Y2, <void*>V2,
-                                   <void*>T)
-
-  # Vector views
-  y1 = multi.vector[0]
-  v1 = multi.vector[1]
-  y2 = multi.vector[2]
-  v2 = multi.vector[3]
-  t = multi.vector[4]
-  
   # Loop
-  for simu from 0 <= simu < nsimu:
-    
-    # Set the magic number
-    magic = magics.data[simu*magics.stride]
-
-    # Generate permutation 
-    nex = fff_twosample_permutation(<unsigned int*>idx1.data,
-                                    <unsigned int*>idx2.data,
-                                    n1, n2, &magic)
-   
-    # Reset the multi-iterator      
-    fffpy_multi_iterator_reset(multi)
-    
-    # Perform the loop 
-    idx = simu*t.stride
-    while(multi.index < multi.size):
-      fff_twosample_apply_permutation(yp, vp, y1, v1, y2, v2, nex,
-                                      <unsigned int*>idx1.data,
-                                      <unsigned int*>idx2.data)
-      t.data[idx] = fff_twosample_stat_mfx_eval(stat, yp, vp)
-      fffpy_multi_iterator_update(multi)
-
-  # Delete local structures
-  fffpy_multi_iterator_delete(multi)
-  fff_vector_delete(magics)
-  fff_vector_delete(yp)
-  fff_vector_delete(vp)
-  fff_array_delete(idx1)
-  fff_array_delete(idx2)
-  fff_twosample_stat_mfx_delete(stat)
+  worker = _StatSlabs(Y1, V1, Y2, V2, T, Magics, stats[id], axis, niter)
+  run_threads(worker, _nvoxels(Y1, axis), nthreads)
 
   # Return
   return T
@@ -7,8 +7,8 @@ import scipy.stats as sp_stats
 from nibabel import Nifti1Image as Image
 from nibabel.affines import apply_affine
 
-from ..algorithms.graph.field import field_from_graph_and_data
-from ..algorithms.graph.graph import wgraph_from_3d_grid
+from ..algorithms.graph.graph import cc_from_3d_grid, cc_summary
+from ..algorithms.graph.lattice import LatticeField
 from ..algorithms.statistics import empirical_pvalue
 from .glm import glm
 from .group.permutation_test import \
@@ -65,10 +65,11 @@ def cluster_stats(zimg, mask, height_th, height_control='fpr',
     nvoxels = np.size(xyz, 0)
 
     # Thresholding
+    fdr_control = empirical_pvalue.BenjaminiHochberg.from_normal(zmap)
     if height_control == 'fpr':
         zth = sp_stats.norm.isf(height_th)
     elif height_control == 'fdr':
-        zth = empirical_pvalue.gaussian_fdr_threshold(zmap, height_th)
+        zth = sp_stats.norm.isf(fdr_control.threshold(height_th))
     elif height_control == 'bonferroni':
         zth = sp_stats.norm.isf(height_th / nvoxels)
     else: ## Brute-force thresholding
@@ -81,28 +82,33 @@ def cluster_stats(zimg, mask, height_th, height_control='fpr',
     xyz_th = xyz[above_th]
 
     # Clustering
-    ## Extract local maxima and connex components above some threshold
-    ff = field_from_graph_and_data(wgraph_from_3d_grid(xyz_th, k=18), zmap_th)
-    maxima, depth = ff.get_local_maxima(th=zth)
-    labels = ff.cc()
+    ## Extract connex components above some threshold and their size
+    labels = cc_from_3d_grid(xyz_th, k=18)
+    sizes = cc_summary(labels, zmap_th)[0]
+    ## Extract local maxima, only within clusters large enough
+    kept = np.where(sizes >= cluster_th)[0]
+    idx = np.where(np.in1d(labels, kept))[0]
+    maxima, depth = np.zeros(0, np.int), np.zeros(0, np.int)
+    if idx.size > 0:
+        ff = LatticeField(xyz_th[idx], 18, zmap_th[idx])
+        maxima, depth = ff.get_local_maxima(th=zth)
+        maxima = idx[maxima]
     ## Make list of clusters, each cluster being a dictionary
     clusters = []
-    for k in range(labels.max() + 1):
-        s = np.sum(labels == k)
-        if s >= cluster_th:
-            in_cluster = labels[maxima] == k
-            m = maxima[in_cluster]
-            d = depth[in_cluster]
-            sorted = d.argsort()[::-1]
-            clusters.append({'size': s,
-                             'maxima': m[sorted],
-                             'depth': d[sorted]})
+    for k in kept:
+        in_cluster = labels[maxima] == k
+        m = maxima[in_cluster]
+        d = depth[in_cluster]
+        sorted = d.argsort()[::-1]
+        clusters.append({'size': sizes[k],
+                         'maxima': m[sorted],
+                         'depth': d[sorted]})
 
     ## Sort clusters by descending size order
     clusters.sort(key=lambda c : c['size'], reverse=True)
 
     # FDR-corrected p-values
-    fdr_pvalue = empirical_pvalue.gaussian_fdr(zmap)[above_th]
+    fdr_pvalue = fdr_control.q_values()[above_th]
 
     # Default "nulls"
     if not 'zmax' in nulls:
@@ -194,7 +200,7 @@ def get_3d_peaks(image, mask=None, threshold=0., nn=18, order_th=0):
         return None
 
     # Extract local maxima and connex components above some threshold
-    ff = field_from_graph_and_data(wgraph_from_3d_grid(xyz, k=18), data)
+    ff = LatticeField(xyz, 18, data)
     maxima, order = ff.get_local_maxima(th=threshold)
 
     # retain only the maxima greater than the specified order
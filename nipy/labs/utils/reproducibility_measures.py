@@ -312,7 +312,7 @@ def statistics_from_position(target, data, sigma=1.0):
                 1 is good
                 0 is bad
     """
-    from ...algorithms.utils.fast_distance import euclidean_distance as ed
+    from ...algorithms.utils.fast_distance import euclidean_distance_knn
     if data == None:
         if target == None:
             return 0.# could be 1.0 ?
@@ -321,8 +321,7 @@ def statistics_from_position(target, data, sigma=1.0):
     if target == None:
         return 0.
 
-    dmatrix = ed(data, target) / sigma
-    sensitivity = dmatrix.min(0)
+    sensitivity = euclidean_distance_knn(target, data, 1)[0][:, 0] / sigma
     sensitivity = np.exp( - 0.5 * sensitivity ** 2)
     sensitivity = np.mean(sensitivity)
     return sensitivity
@@ -0,0 +1,46 @@
+""" Testing threads module
+"""
+
+import numpy as np
+
+from ..threads import split_range, run_threads
+
+from nose.tools import assert_true, assert_equal, assert_raises
+
+
+def test_split_range():
+    for size in (0, 1, 7, 100):
+        for nthreads in (1, 3, 200):
+            chunks = split_range(size, nthreads)
+            assert_true(1 <= len(chunks) <= nthreads)
+            assert_equal(chunks[0][0], 0)
+            assert_equal(chunks[-1][1], size)
+            for (a, b), (c, d) in zip(chunks[:-1], chunks[1:]):
+                assert_equal(b, c)
+            lengths = [b - a for a, b in chunks]
+            assert_true(max(lengths) - min(lengths) <= 1)
+
+
+def test_run_threads():
+    out = np.zeros(100)
+
+    def worker(start, stop):
+        out[start:stop] = np.arange(start, stop)
+
+    for nthreads in (1, 4):
+        out[:] = 0
+        run_threads(worker, 100, nthreads)
+        assert_true((out == np.arange(100)).all())
+
+
+def test_thread_errors():
+    # exceptions raised in the worker threads reach the caller
+    done = []
+
+    def worker(start, stop):
+        if start > 0:
+            raise MemoryError('chunk %d' % start)
+        done.append((start, stop))
+
+    assert_raises(MemoryError, run_threads, worker, 10, 3)
+    assert_equal(done, [(0, 3)])
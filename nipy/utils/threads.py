@@ -0,0 +1,74 @@
+""" Utilities to run compiled loops over ranges of items in threads
+"""
+import sys
+import threading
+
+import numpy as np
+
+
+def split_range(size, nthreads):
+    """ Split range(size) into contiguous chunks
+
+    Parameters
+    ----------
+    size : int
+        number of items to split
+    nthreads : int
+        maximal number of chunks
+
+    Returns
+    -------
+    chunks : list
+        at most `nthreads` (start, stop) tuples, of approximately equal
+        lengths, covering range(size); there is at least one chunk, even
+        if `size` is 0
+    """
+    nchunks = max(1, min(int(nthreads), size))
+    bounds = np.linspace(0, size, nchunks + 1).astype(np.intp)
+    return [(bounds[i], bounds[i + 1]) for i in range(nchunks)]
+
+
+def _catch_errors(worker, start, stop, errors):
+    """ Call `worker(start, stop)`, appending the exception info to
+    `errors` if it fails
+    """
+    try:
+        worker(start, stop)
+    except BaseException:
+        errors.append(sys.exc_info())
+
+
+def run_threads(worker, size, nthreads):
+    """ Call `worker(start, stop)` on contiguous chunks of range(size)
+
+    Parameters
+    ----------
+    worker : callable
+        function of (start, stop), expected to release the GIL while
+        doing actual computations
+    size : int
+        number of items to process
+    nthreads : int
+        number of threads; the worker is called in the current thread if
+        there is a single chunk
+
+    Notes
+    -----
+    The first exception raised by a worker, if any, is raised again once
+    all the threads have returned.
+    """
+    chunks = split_range(size, nthreads)
+    if len(chunks) == 1:
+        worker(*chunks[0])
+        return
+    errors = []
+    threads = [threading.Thread(target=_catch_errors,
+                                args=(worker, start, stop, errors))
+               for start, stop in chunks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        exc_type, exc_value, exc_tb = errors[0]
+        raise exc_type, exc_value, exc_tb